@@ -4,28 +4,119 @@ Dependencias: flask flask-login werkzeug psycopg2-binary
 pip install flask flask-login werkzeug psycopg2-binary
 """
 
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import math
 import os
-from datetime import datetime
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from zoneinfo import ZoneInfo
 
-import psycopg2
-import psycopg2.extras
-from flask import (Flask, render_template_string, redirect, url_for,
-                   request, flash, get_flashed_messages)
+from flask import (Flask, Blueprint, Response, render_template, redirect, url_for, abort,
+                   request, flash, get_flashed_messages, jsonify, g, has_request_context,
+                   make_response, get_template_attribute)
 from flask_login import (LoginManager, UserMixin, login_user,
                          logout_user, login_required, current_user)
+import click
+from jinja2 import DictLoader
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from assets import assets, bp as assets_bp
+import auditoria
+import estoque_csv
+import eventos
+import metricas
+import migracoes
+import particoes
+import perfil
+import previsao
+import tendencias
+from db import SQLITE, get_db, observadores_conexao, observadores_sql, ouvinte, pool_stats
+from eventos import difusor
+from stats import cache as snapshot_cache, calcular_status, totais, versao_estoque
+
 # ─────────────────────────────────────────────
 #  App & Login setup
 # ─────────────────────────────────────────────
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)   # estáticos servidos por assets.py
+if os.environ.get("PROXY_CONFIAVEL"):
+    # Atrás do roteador do Heroku/nginx: IP real do cliente vem do X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["PROXY_CONFIAVEL"]))
+app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024   # upload do CSV de estoque
+app.register_blueprint(assets_bp)
 app.secret_key = "TROQUE-ESTA-CHAVE-POR-ALGO-SEGURO-EM-PRODUCAO"
 
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 login_manager.login_message = "Por favor, faça login para continuar."
 
+# Fuso usado para exibir datas e interpretar filtros de data
+TZ_LOCAL = os.environ.get("TZ_LOCAL", "America/Fortaleza")
+
+# ─────────────────────────────────────────────
+#  Senhas e proteção do login
+# ─────────────────────────────────────────────
+# Método/custo do hash (formato do werkzeug), ex.: "scrypt:32768:8:1",
+# "pbkdf2:sha256:600000". Hashes gravados com outro método são refeitos
+# no próximo login bem-sucedido.
+PASSWORD_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+# Prefixo que o werkzeug grava para o método configurado (normaliza "scrypt" etc.)
+_PASSWORD_PREFIXO = generate_password_hash("", method=PASSWORD_METHOD).split("$", 1)[0]
+
+def hash_senha(senha):
+    return generate_password_hash(senha, method=PASSWORD_METHOD)
+
+def hash_desatualizado(hash_gravado):
+    return hash_gravado.split("$", 1)[0] != _PASSWORD_PREFIXO
+
+# No máximo N verificações de hash simultâneas por worker; quem passar de
+# LOGIN_HASH_ESPERA segundos na fila recebe 503 em vez de travar o worker.
+_hash_slots = threading.BoundedSemaphore(int(os.environ.get("LOGIN_HASH_CONCORRENCIA", 2)))
+LOGIN_HASH_ESPERA = float(os.environ.get("LOGIN_HASH_ESPERA", 2))
+
+class TokenBucket:
+    """Balde de fichas por chave (usuário, IP), em memória e com tamanho limitado.
+
+    `taxa` no formato "N/S": até N tentativas de uma vez, repondo N a cada S s.
+    """
+
+    def __init__(self, taxa, max_chaves=10000):
+        n, seg = taxa.split("/")
+        self.capacidade = float(n)
+        self.reposicao  = float(n) / float(seg)   # fichas por segundo
+        self.max_chaves = max_chaves
+        self._baldes    = OrderedDict()           # chave -> (fichas, atualizado_em)
+        self._lock      = threading.Lock()
+        self.bloqueios  = 0
+
+    def consumir(self, chave):
+        """(True, 0) se há ficha; senão (False, segundos até a próxima)."""
+        agora = time.monotonic()
+        with self._lock:
+            fichas, quando = self._baldes.pop(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - quando) * self.reposicao)
+            ok = fichas >= 1
+            if ok:
+                fichas -= 1
+            else:
+                self.bloqueios += 1
+            self._baldes[chave] = (fichas, agora)
+            while len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+        return ok, 0 if ok else (1 - fichas) / self.reposicao
+
+limite_login_ip      = TokenBucket(os.environ.get("LOGIN_TAXA_IP", "20/60"))
+limite_login_usuario = TokenBucket(os.environ.get("LOGIN_TAXA_USUARIO", "5/60"))
+
 # ─────────────────────────────────────────────
 #  Dados iniciais
 # ─────────────────────────────────────────────
@@ -50,21 +141,15 @@ DADOS_INICIAIS = [
     ("MQW5", "Pecém",           "pb",       3, 0, 82),
 ]
 
+# Senhas em claro: o hash é gerado só na carga inicial (ver init_db)
 USUARIOS_INICIAIS = [
-    ("admin", generate_password_hash("admin123"), "Administrador", 1),
-    ("ti",    generate_password_hash("ti2024"),   "Equipe TI",     0),
+    ("admin", "admin123", "Administrador", 1),
+    ("ti",    "ti2024",   "Equipe TI",     0),
 ]
 
 # ─────────────────────────────────────────────
-#  Banco de dados — PostgreSQL
+#  Banco de dados — PostgreSQL (pool por worker, ver db.py)
 # ─────────────────────────────────────────────
-DATABASE_URL = os.environ.get("DATABASE_URL", "")
-
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.autocommit = False
-    return conn
-
 def dict_row(cursor, row):
     cols = [d[0] for d in cursor.description]
     return dict(zip(cols, row))
@@ -76,63 +161,8 @@ def fetchone_dict(cursor):
     row = cursor.fetchone()
     return dict_row(cursor, row) if row else None
 
-def init_db():
-    conn = get_db()
-    c = conn.cursor()
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS estoque (
-            id         SERIAL PRIMARY KEY,
-            codigo     TEXT,
-            setor      TEXT,
-            tipo       TEXT DEFAULT 'pb',
-            quantidade INTEGER,
-            aguardando INTEGER DEFAULT 0,
-            observacao TEXT    DEFAULT \'\',
-            tinta_pct  INTEGER DEFAULT NULL
-        )
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS historico (
-            id         SERIAL PRIMARY KEY,
-            estoque_id INTEGER,
-            usuario    TEXT,
-            acao       TEXT,
-            detalhe    TEXT,
-            criado_em  TEXT
-        )
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id       SERIAL PRIMARY KEY,
-            username TEXT UNIQUE,
-            password TEXT,
-            nome     TEXT,
-            is_admin INTEGER DEFAULT 0
-        )
-    """)
-
-    # Migração: renomear coluna modelo -> tipo (para bancos existentes)
-    try:
-        c.execute("ALTER TABLE estoque RENAME COLUMN modelo TO tipo")
-        conn.commit()
-    except Exception:
-        conn.rollback()
-    try:
-        c.execute("ALTER TABLE estoque ADD COLUMN tipo TEXT DEFAULT 'pb'")
-        conn.commit()
-    except Exception:
-        conn.rollback()
-    # Preenche tipo com base nos valores antigos do campo modelo/tipo
-    try:
-        c.execute("UPDATE estoque SET tipo='colorida' WHERE tipo ILIKE '%cmyk%' OR tipo ILIKE '%color%'")
-        c.execute("UPDATE estoque SET tipo='pb' WHERE tipo IS NULL OR (tipo != 'colorida' AND tipo != 'pb')")
-        conn.commit()
-    except Exception:
-        conn.rollback()
-
+@migracoes.migracao(8, "dados iniciais de estoque e usuários", backends=("postgres", "sqlite"))
+def _dados_iniciais(c):
     c.execute("SELECT COUNT(*) FROM estoque")
     if c.fetchone()[0] == 0:
         for row in DADOS_INICIAIS:
@@ -143,17 +173,33 @@ def init_db():
 
     c.execute("SELECT COUNT(*) FROM usuarios")
     if c.fetchone()[0] == 0:
-        for row in USUARIOS_INICIAIS:
+        for username, senha, nome, is_admin in USUARIOS_INICIAIS:
             c.execute(
                 "INSERT INTO usuarios (username,password,nome,is_admin) VALUES (%s,%s,%s,%s)",
-                row
+                (username, hash_senha(senha), nome, is_admin)
             )
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Esquema em dia (ver migracoes.py); no caso comum, uma única consulta."""
+    with get_db() as conn:
+        aplicadas = migracoes.migrar(conn)
+    for versao, descricao in aplicadas:
+        app.logger.info("Migração %d aplicada: %s", versao, descricao)
 
 init_db()
 
+@app.cli.command("migrar")
+@click.option("--status", is_flag=True, help="Só lista os passos e quando foram aplicados.")
+def cli_migrar(status):
+    """Aplica as migrações pendentes do esquema (fase de release do deploy)."""
+    with get_db() as conn:
+        if not status:
+            migracoes.migrar(conn)
+        passos = migracoes.status(conn)
+    for versao, descricao, aplicada_em in passos:
+        quando = aplicada_em.astimezone(ZoneInfo(TZ_LOCAL)).strftime("%d/%m/%Y %H:%M") if aplicada_em else "pendente"
+        print(f"{versao:4d}  {quando:16}  {descricao}")
+
 # ─────────────────────────────────────────────
 #  User model
 # ─────────────────────────────────────────────
@@ -164,35 +210,215 @@ class User(UserMixin):
         self.nome     = row["nome"]
         self.is_admin = bool(row["is_admin"])
 
+class UserCache:
+    """LRU com TTL na frente de load_user.
+
+    Invalidado por NOTIFY 'usuarios_alterados' (trigger em usuarios), o que
+    alcança todos os workers; o TTL limita a defasagem se o ouvinte cair.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._dados  = OrderedDict()   # user_id -> (User, expira_em)
+        self._lock   = threading.Lock()
+        self._geracao = 0              # muda a cada invalidação
+        self.hits = self.misses = self.invalidacoes = 0
+
+    def obter(self, user_id, carregar):
+        user, geracao = self.consultar(user_id)
+        if user is None:
+            user = carregar(user_id)
+            self.guardar(user_id, user, geracao)
+        return user
+
+    def consultar(self, user_id):
+        """(User em cache ou None, geração) — a geração vai para guardar()."""
+        with self._lock:
+            item = self._dados.get(user_id)
+            if item and item[1] > time.monotonic():
+                self._dados.move_to_end(user_id)
+                self.hits += 1
+                return item[0], None
+            self.misses += 1
+            return None, self._geracao
+
+    def guardar(self, user_id, user, geracao):
+        with self._lock:
+            # Não guarda o que foi lido antes de uma invalidação concorrente.
+            if user is not None and geracao == self._geracao:
+                self._dados[user_id] = (user, time.monotonic() + self.ttl)
+                self._dados.move_to_end(user_id)
+                while len(self._dados) > self.maxsize:
+                    self._dados.popitem(last=False)
+
+    def invalidar(self, user_id=None):
+        with self._lock:
+            self._geracao += 1
+            self.invalidacoes += 1
+            if user_id is None:
+                self._dados.clear()
+            else:
+                self._dados.pop(str(user_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {"tamanho": len(self._dados), "max": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "invalidacoes": self.invalidacoes}
+
+user_cache = UserCache(maxsize=int(os.environ.get("USER_CACHE_MAX", 1024)),
+                       ttl=float(os.environ.get("USER_CACHE_TTL", 60)))
+ouvinte.inscrever("usuarios_alterados", lambda payload: user_cache.invalidar(payload or None))
+ouvinte.ao_reconectar(user_cache.invalidar)
+
+SQL_USUARIO = "SELECT id,username,nome,is_admin FROM usuarios WHERE id=%s"
+
+def _carregar_usuario(user_id):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(SQL_USUARIO, (user_id,))
+        row = fetchone_dict(c)
+    return User(row) if row else None
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM usuarios WHERE id=%s", (user_id,))
-    row = fetchone_dict(c)
-    conn.close()
-    return User(row) if row else None
+    return user_cache.obter(str(user_id), _carregar_usuario)
+
+@app.before_request
+def _iniciar_ouvinte():
+    ouvinte.garantir()
 
 # ─────────────────────────────────────────────
-#  Helpers
+#  Motor de movimentações
 # ─────────────────────────────────────────────
-def calcular_status(qtd, aguardando):
-    if qtd >= 1:        return "OK"
-    if aguardando == 1: return "Aguardando Selbetti"
-    return "PROBLEMA"
+# tipo -> (ação no histórico, SET aplicado, condição extra, detalhe)
+# No detalhe, {setor} vem da própria linha atualizada e {valor} do parâmetro.
+MOVIMENTOS = {
+    "mais":       ("Adição",         "quantidade=quantidade+1, aguardando=0", "",                  "+1 unidade — {setor}"),
+    "menos":      ("Retirada",       "quantidade=quantidade-1",               "AND quantidade>0",  "-1 unidade — {setor}"),
+    "solicitar":  ("Solicitação",    "aguardando=1",                          "",                  "Pedido enviado à Selbetti — {setor}"),
+    "recebido":   ("Recebimento",    "quantidade=quantidade+1, aguardando=0", "",                  "Toner recebido +1 — {setor}"),
+    "observacao": ("Observação",     "observacao=%(valor)s",                  "",                  "Obs atualizada — {setor}: \"{valor}\""),
+    "tinta":      ("Nível de Tinta", "tinta_pct=%(valor)s",                   "",                  "Tinta atualizada para {valor}% — {setor}"),
+}
 
-def registrar(estoque_id, acao, detalhe=""):
-    conn = get_db()
-    c = conn.cursor()
-    nome = current_user.nome if current_user.is_authenticated else "Sistema"
-    c.execute(
-        "INSERT INTO historico (estoque_id,usuario,acao,detalhe,criado_em) VALUES (%s,%s,%s,%s,%s)",
-        (estoque_id, nome, acao, detalhe,
-         datetime.now().strftime("%d/%m/%Y %H:%M"))
+# UPDATE ... RETURNING alimentando o INSERT do histórico: um único comando,
+# uma ida ao banco, e a linha de auditoria só existe se o estoque mudou.
+SQL_MOVIMENTO = """
+    WITH alvo AS (
+        UPDATE estoque SET {set} WHERE id=%(id)s {cond}
+        RETURNING *
+    ), hist AS (
+        INSERT INTO historico (estoque_id,usuario,acao,detalhe,criado_em)
+        SELECT id, %(usuario)s, %(acao)s,
+               %(antes)s || COALESCE(setor,'') || %(depois)s, now()
+        FROM alvo
     )
-    conn.commit()
-    conn.close()
+    SELECT * FROM alvo
+"""
+
+# SQLite não aceita UPDATE dentro de WITH: dois comandos na mesma transação.
+# É também o comando do PostgreSQL quando o histórico vai para o gravador
+# em lote (auditoria.py).
+SQL_MOVIMENTO_SQLITE = "UPDATE estoque SET {set} WHERE id=%(id)s {cond} RETURNING *"
+
+# Concorrência otimista: todo movimento incrementa estoque.versao. Quem grava
+# um valor lido antes (pedido, observação, tinta) pode mandar a versão que
+# leu; o UPDATE só acontece se ela ainda for a atual, senão ConflitoVersao.
+# Os deltas comutam e a quantidade é conferida no próprio UPDATE, então
+# +1/-1 sempre se aplicam, com ou sem versão: nenhum clique se perde.
+COMUTATIVOS = {"mais", "menos", "recebido"}
+
+# (tipo, checar, historico no mesmo comando) -> SQL
+_SQL_MOVIMENTOS = {
+    (tipo, checar, junto): (SQL_MOVIMENTO if junto else SQL_MOVIMENTO_SQLITE).format(
+        set=sets + ", versao=versao+1",
+        cond=cond + (" AND versao=%(versao)s" if checar else ""))
+    for tipo, (_, sets, cond, _) in MOVIMENTOS.items()
+    for checar in (False, True)
+    for junto in (False, True)
+}
+
+class ConflitoVersao(Exception):
+    """O item mudou desde que o cliente o leu; `atual` é a linha de agora."""
+
+    def __init__(self, atual):
+        super().__init__(f"item {atual['id']} está na versão {atual['versao']}")
+        self.atual = atual
+
+SQL_ITEM = "SELECT * FROM estoque WHERE id=%s"
+
+def comando_movimento(estoque_id, tipo, valor, usuario, versao, historico=True):
+    """(sql, params, checar) de um movimento; o modo ASGI (asgi.py) roda o
+    mesmo comando no asyncpg. Com `historico`, o comando do PostgreSQL já
+    grava a linha de histórico; sem ele (e no SQLite), só altera o estoque."""
+    acao, _, _, detalhe = MOVIMENTOS[tipo]
+    checar = versao is not None and tipo not in COMUTATIVOS
+    antes, _, depois = detalhe.partition("{setor}")
+    params = {
+        "id": estoque_id, "valor": valor, "usuario": usuario, "acao": acao,
+        "antes":  antes.replace("{valor}", str(valor)),
+        "depois": depois.replace("{valor}", str(valor)),
+        "versao": versao,
+    }
+    return _SQL_MOVIMENTOS[tipo, checar, historico and not SQLITE], params, checar
+
+def linha_historico(row, params):
+    """Linha de histórico de um movimento aplicado, para o gravador em lote
+    (auditoria.py): o mesmo detalhe do comando síncrono, com o instante de agora."""
+    return (row["id"], params["usuario"], params["acao"],
+            params["antes"] + (row["setor"] or "") + params["depois"],
+            datetime.now(timezone.utc))
+
+def movimentar(conn, estoque_id, tipo, valor=None, usuario=None, versao=None):
+    """Aplica a movimentação `tipo` e grava o histórico na mesma instrução
+    (com HISTORICO_GRAVACAO=lote, entrega-o ao gravador; ver auditoria.py).
+
+    Retorna a linha de estoque já atualizada, ou None se nada mudou
+    (item inexistente ou retirada com estoque zerado). Com `versao` (a que
+    o cliente leu), levanta ConflitoVersao se o item já estiver em outra;
+    ignorada nos deltas (COMUTATIVOS).
+    """
+    if usuario is None:
+        usuario = current_user.nome if current_user.is_authenticated else "Sistema"
+    inicio = time.perf_counter()
+    # Histórico em lote (auditoria.py): a vaga na fila é reservada antes do
+    # UPDATE, para não esperar por ela segurando a linha do estoque. Sem
+    # vaga, o histórico vai no próprio comando, como no modo síncrono.
+    em_lote = auditoria.LOTE and auditoria.gravador.reservar(auditoria.gravador.espera)
+    sql, params, checar = comando_movimento(estoque_id, tipo, valor, usuario, versao,
+                                            historico=not em_lote)
+    c = conn.cursor()
+    try:
+        c.execute(sql, params)
+        row = fetchone_dict(c)
+        if row is None and checar:
+            c.execute(SQL_ITEM, (estoque_id,))
+            atual = fetchone_dict(c)
+            if atual is not None:           # o item existe: foi a versão que mudou
+                raise ConflitoVersao(atual)
+    except BaseException:
+        if em_lote:
+            auditoria.gravador.liberar(1)
+        raise
+    if em_lote:
+        if row is None:
+            auditoria.gravador.liberar(1)
+        else:
+            auditoria.gravador.registrar(conn, linha_historico(row, params))
+    elif SQLITE and row is not None:
+        c.execute("""
+            INSERT INTO historico (estoque_id,usuario,acao,detalhe,criado_em)
+            VALUES (%(id)s, %(usuario)s, %(acao)s, %(antes)s || COALESCE(%(setor)s,'') || %(depois)s, now())
+        """, {**params, "setor": row["setor"]})
+    app.logger.debug("movimento %s id=%s em %.2f ms", tipo, estoque_id,
+                     (time.perf_counter() - inicio) * 1000)
+    return row
 
+# ─────────────────────────────────────────────
+#  Helpers
+# ─────────────────────────────────────────────
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -202,166 +428,23 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
-# ══════════════════════════════════════════════
-#  CSS global
-# ══════════════════════════════════════════════
-CSS = """
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&family=JetBrains+Mono:wght@400;500&display=swap" rel="stylesheet">
-<style>
-:root{
-    /* Braslimp green palette */
-    --sb-bg:#14381f;--sb-bg2:#1a4526;--sb-border:rgba(255,255,255,.08);
-    --sb-text:rgba(255,255,255,.9);--sb-muted:rgba(255,255,255,.45);
-    --sb-active:rgba(255,255,255,.1);--sb-hover:rgba(255,255,255,.07);
-    --sb-accent:#4ade80;
-
-    --bg:#f5f7f5;--surface:#fff;--border:#e3e8e3;--border2:#cdd5cd;
-    --text:#111c11;--muted:#5a6b5a;--light:#93a893;
-    --primary:#166534;--primary-hover:#14532d;
-    --primary-bg:#f0fdf4;--primary-bd:#86efac;
-
-    --ok:#16a34a;--ok-bg:#f0fdf4;--ok-bd:#bbf7d0;
-    --warn:#b45309;--warn-bg:#fffbeb;--warn-bd:#fde68a;
-    --danger:#dc2626;--danger-bg:#fef2f2;--danger-bd:#fecaca;
-
-    --mono:'JetBrains Mono',monospace;--sans:'Inter',sans-serif;
-    --r:8px;--sh:0 1px 3px rgba(0,0,0,.07),0 1px 2px rgba(0,0,0,.04);
-    --sh-md:0 4px 16px rgba(0,0,0,.1);
-}
-*,*::before,*::after{box-sizing:border-box;margin:0;padding:0}
-body{font-family:var(--sans);background:var(--bg);color:var(--text);font-size:14px;line-height:1.5;-webkit-font-smoothing:antialiased}
-a{color:inherit;text-decoration:none}
-
-/* ── Shell ── */
-.shell{display:flex;min-height:100vh}
-.sidebar{width:230px;background:var(--sb-bg);display:flex;flex-direction:column;flex-shrink:0;position:fixed;top:0;left:0;bottom:0}
-.sb-logo{padding:22px 20px 18px;border-bottom:1px solid var(--sb-border);display:flex;align-items:center;gap:12px}
-.sb-logo .icon{width:34px;height:34px;border-radius:8px;overflow:hidden;flex-shrink:0;display:flex;align-items:center;justify-content:center;background:#fff}
-.sb-logo .icon img{width:34px;height:34px;object-fit:contain}
-.sb-logo .brand{font-weight:700;font-size:14px;line-height:1.25;color:var(--sb-text)}
-.sb-logo .brand span{font-weight:400;color:var(--sb-muted);font-size:11px;display:block;margin-top:1px}
-.nav-section{padding:16px 12px 8px}
-.nav-label{font-size:10px;font-weight:600;letter-spacing:.1em;text-transform:uppercase;color:var(--sb-muted);padding:0 10px;margin-bottom:6px}
-.nav-item{display:flex;align-items:center;gap:9px;padding:8px 10px;border-radius:6px;font-size:13px;font-weight:500;color:var(--sb-muted);transition:all .12s;cursor:pointer}
-.nav-item:hover{background:var(--sb-hover);color:var(--sb-text)}
-.nav-item.active{background:var(--sb-active);color:var(--sb-text);font-weight:600}
-.nav-item.active .nav-icon{color:var(--sb-accent)}
-.nav-icon{font-size:15px;width:18px;text-align:center}
-.sb-divider{height:1px;background:var(--sb-border);margin:8px 12px}
-.sb-footer{margin-top:auto;padding:16px 12px;border-top:1px solid var(--sb-border)}
-.user-chip{display:flex;align-items:center;gap:9px;padding:6px 8px}
-.user-av{width:30px;height:30px;background:var(--sb-accent);border-radius:50%;display:flex;align-items:center;justify-content:center;font-size:12px;font-weight:700;color:var(--sb-bg);flex-shrink:0}
-.user-name{font-size:12px;font-weight:600;color:var(--sb-text)}
-.user-role{font-size:10px;color:var(--sb-muted)}
-.logout-lnk{margin-top:6px;display:block;font-size:12px;color:var(--sb-muted);padding:5px 8px;border-radius:5px;transition:all .12s}
-.logout-lnk:hover{color:#fca5a5;background:rgba(220,38,38,.15)}
-
-/* ── Main ── */
-.main{margin-left:230px;flex:1;display:flex;flex-direction:column;min-height:100vh}
-.topbar{height:56px;background:var(--surface);border-bottom:1px solid var(--border);display:flex;align-items:center;padding:0 28px;gap:12px;position:sticky;top:0;z-index:10}
-.topbar-title{font-size:15px;font-weight:600;flex:1;color:var(--text)}
-.topbar-sub{font-size:12px;color:var(--muted)}
-.content{padding:28px;flex:1}
-
-/* ── Card ── */
-.card{background:var(--surface);border:1px solid var(--border);border-radius:var(--r);box-shadow:var(--sh)}
-.card-header{display:flex;align-items:center;justify-content:space-between;padding:14px 20px;border-bottom:1px solid var(--border)}
-.card-title{font-size:13px;font-weight:600}
-.card-sub{font-size:12px;color:var(--muted);margin-top:1px}
-
-/* ── Stats ── */
-.stats-row{display:grid;grid-template-columns:repeat(4,1fr);gap:14px;margin-bottom:20px}
-.stat{background:var(--surface);border:1px solid var(--border);border-radius:var(--r);padding:16px 18px;box-shadow:var(--sh)}
-.stat-label{font-size:11px;font-weight:600;color:var(--muted);text-transform:uppercase;letter-spacing:.06em;margin-bottom:6px}
-.stat-number{font-family:var(--mono);font-size:28px;font-weight:700;line-height:1}
-.stat-number.c-ok{color:var(--ok)}.stat-number.c-warn{color:var(--warn)}.stat-number.c-danger{color:var(--danger)}.stat-number.c-primary{color:var(--primary)}
-.stat-hint{font-size:11px;color:var(--muted);margin-top:4px}
-
-/* ── Alert ── */
-.alert{display:flex;align-items:center;gap:10px;padding:10px 14px;border-radius:var(--r);font-size:13px;margin-bottom:16px;border-left:3px solid}
-.alert-danger{background:var(--danger-bg);border-color:var(--danger);color:var(--danger)}
-
-/* ── Table ── */
-.table-wrap{overflow-x:auto}
-table{width:100%;border-collapse:collapse}
-thead th{font-size:11px;font-weight:600;text-transform:uppercase;letter-spacing:.07em;color:var(--muted);padding:10px 16px;text-align:left;background:var(--bg);border-bottom:1px solid var(--border);white-space:nowrap}
-tbody td{padding:11px 16px;border-bottom:1px solid var(--border);vertical-align:middle;font-size:13px}
-tbody tr:last-child td{border-bottom:none}
-tbody tr:hover td{background:#f9fbf9}
-
-/* ── Badges ── */
-.badge{display:inline-flex;align-items:center;gap:4px;padding:3px 9px;border-radius:20px;font-size:11px;font-weight:600;white-space:nowrap;border:1px solid}
-.badge-ok{background:var(--ok-bg);color:var(--ok);border-color:var(--ok-bd)}
-.badge-warn{background:var(--warn-bg);color:var(--warn);border-color:var(--warn-bd)}
-.badge-danger{background:var(--danger-bg);color:var(--danger);border-color:var(--danger-bd)}
-.badge-primary{background:var(--primary-bg);color:var(--primary);border-color:var(--primary-bd)}
-
-/* ── Qty ── */
-.qty{font-family:var(--mono);font-weight:700;font-size:15px}
-.qty-0{color:var(--danger)}.qty-1{color:var(--warn)}.qty-ok{color:var(--ok)}
-
-/* ── Code ── */
-.code{font-family:var(--mono);font-size:12px;background:var(--bg);border:1px solid var(--border);padding:2px 7px;border-radius:4px;color:var(--muted)}
-
-/* ── Buttons ── */
-.btn{display:inline-flex;align-items:center;gap:5px;padding:6px 12px;border-radius:6px;font-size:12px;font-weight:600;cursor:pointer;border:1px solid transparent;font-family:var(--sans);transition:all .12s;text-decoration:none}
-.btn-primary{background:var(--primary);color:#fff;border-color:var(--primary)}.btn-primary:hover{background:var(--primary-hover)}
-.btn-ghost{background:transparent;color:var(--muted);border-color:var(--border)}.btn-ghost:hover{color:var(--text);border-color:var(--border2)}
-.btn-danger-ghost{background:transparent;color:var(--danger);border-color:var(--danger-bd)}.btn-danger-ghost:hover{background:var(--danger-bg)}
-.action-row{display:flex;gap:4px;align-items:center;flex-wrap:wrap}
-.act{padding:4px 8px;border-radius:5px;font-size:11px;font-weight:600;cursor:pointer;border:1px solid transparent;font-family:var(--sans);transition:all .1s;text-decoration:none;display:inline-block;white-space:nowrap}
-.act-plus{background:var(--ok-bg);color:var(--ok);border-color:var(--ok-bd)}
-.act-minus{background:var(--danger-bg);color:var(--danger);border-color:var(--danger-bd)}
-.act-req{background:var(--warn-bg);color:var(--warn);border-color:var(--warn-bd)}
-.act-recv{background:var(--primary-bg);color:var(--primary);border-color:var(--primary-bd)}
-.act-edit{background:var(--bg);color:var(--muted);border-color:var(--border)}
-.act:hover{filter:brightness(.93)}
-
-/* ── Obs ── */
-.obs-text{font-size:12px;color:var(--muted);font-style:italic;max-width:180px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;display:block}
-.obs-empty{color:var(--light)}
-
-/* ── Forms ── */
-.form-group{margin-bottom:16px}
-label{display:block;font-size:12px;font-weight:600;color:var(--muted);margin-bottom:5px;text-transform:uppercase;letter-spacing:.05em}
-input[type=text],input[type=password],textarea,select{width:100%;padding:8px 11px;border:1px solid var(--border);border-radius:6px;font-size:13px;font-family:var(--sans);color:var(--text);background:var(--surface);transition:border .12s;outline:none}
-input:focus,textarea:focus,select:focus{border-color:var(--primary);box-shadow:0 0 0 3px rgba(22,101,52,.12)}
-textarea{resize:vertical;min-height:60px}
-
-/* ── Login ── */
-.login-wrap{min-height:100vh;display:flex;align-items:center;justify-content:center;background:var(--sb-bg)}
-.login-card{background:var(--surface);border:1px solid var(--border);border-radius:12px;box-shadow:var(--sh-md);padding:36px 40px;width:340px}
-.login-logo{display:flex;align-items:center;gap:10px;margin-bottom:28px}
-.login-logo .icon{width:42px;height:42px;background:#fff;border-radius:9px;border:1px solid var(--border);overflow:hidden;display:flex;align-items:center;justify-content:center}
-.login-logo .icon img{width:38px;height:38px;object-fit:contain}
-.login-logo .label{font-weight:700;font-size:14px;line-height:1.2;color:var(--text)}
-.login-logo .label span{font-weight:400;color:var(--muted);font-size:11px;display:block}
-.flash-msg{padding:8px 12px;border-radius:6px;font-size:12px;margin-bottom:14px}
-.flash-error{background:var(--danger-bg);color:var(--danger);border:1px solid var(--danger-bd)}
-.flash-success{background:var(--ok-bg);color:var(--ok);border:1px solid var(--ok-bd)}
-
-/* ── Modal ── */
-.modal-backdrop{display:none;position:fixed;inset:0;background:rgba(0,0,0,.35);z-index:100;align-items:center;justify-content:center}
-.modal-backdrop.open{display:flex}
-.modal{background:var(--surface);border:1px solid var(--border);border-radius:10px;box-shadow:var(--sh-md);padding:24px 28px;width:400px;max-width:96vw}
-.modal-title{font-size:14px;font-weight:700;margin-bottom:16px}
-.modal-actions{display:flex;gap:8px;justify-content:flex-end;margin-top:16px}
-
-/* ── History ── */
-.h-item{display:flex;align-items:flex-start;gap:12px;padding:11px 20px;border-bottom:1px solid var(--border)}
-.h-item:last-child{border-bottom:none}
-.h-dot{width:8px;height:8px;border-radius:50%;flex-shrink:0;margin-top:5px}
-.h-dot-plus{background:var(--ok)}.h-dot-minus{background:var(--danger)}
-.h-dot-req{background:var(--warn)}.h-dot-recv{background:var(--primary)}
-.h-dot-obs{background:var(--muted)}.h-dot-other{background:var(--light)}
-.h-acao{font-size:13px;font-weight:500}
-.h-meta{font-size:11px;color:var(--muted);margin-top:1px}
-
-/* ── Misc ── */
-.section-gap{margin-top:28px}
-@media(max-width:768px){.sidebar{display:none}.main{margin-left:0}.stats-row{grid-template-columns:repeat(2,1fr)}}
-</style>
-"""
+# Identifica o código/templates/assets em execução: um deploy novo invalida as ETags.
+_BUILD = hashlib.sha1(open(__file__, "rb").read()).hexdigest()[:8] + assets.digest
+
+def etag_pagina(nome, versao, user):
+    return f"{nome}-{versao}-{user.id}-{int(user.is_admin)}-{_BUILD}"
+
+def pagina_versionada(nome, versao, render):
+    """Resposta com ETag forte ligada à versão do estoque; 304 se o
+    navegador já tem esta versão. `render` só é chamado quando necessário."""
+    etag = etag_pagina(nome, versao, current_user)
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = make_response(render())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 # ── Shared layout renderer ────────────────────────────────────────────────────
 LAYOUT = """<!DOCTYPE html>
@@ -369,13 +452,13 @@ LAYOUT = """<!DOCTYPE html>
 <head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
 <title>{{ page_title }} — TI Toner</title>
-{{ css }}
+{% include "_assets_head.html" %}
 </head>
 <body>
 <div class="shell">
   <aside class="sidebar">
     <div class="sb-logo">
-      <div class="icon"><img src="https://media.licdn.com/dms/image/v2/D4D0BAQG0smJnZAhyhw/company-logo_200_200/company-logo_200_200/0/1689000003837/braslimpoficial_logo?e=2147483647&v=beta&t=7Pq4Tq4bXr0Z1cr4VpMETmGUD4mXZed6_xccVMK7pr8" alt="Braslimp"></div>
+      <div class="icon"><img src="{{ logo_url() }}" alt="Braslimp"></div>
       <div class="brand">Braslimp<span>Controle de Toners</span></div>
     </div>
     <nav class="nav-section">
@@ -386,6 +469,7 @@ LAYOUT = """<!DOCTYPE html>
       {% if current_user.is_admin %}
       <div class="nav-label" style="margin-top:12px">Admin</div>
       <a href="{{ url_for('usuarios') }}"  class="nav-item {% if active=='usuarios' %}active{% endif %}"><span class="nav-icon">👥</span> Usuários</a>
+      <a href="{{ url_for('importar_estoque') }}" class="nav-item {% if active=='importar' %}active{% endif %}"><span class="nav-icon">📥</span> Importar CSV</a>
       {% endif %}
     </nav>
     <div class="sb-footer">
@@ -404,19 +488,15 @@ LAYOUT = """<!DOCTYPE html>
       <div class="topbar-title">{{ page_title }}</div>
       <div class="topbar-sub">{{ page_sub }}</div>
     </div>
-    <div class="content">{{ body }}</div>
+    <div class="content">{% block content %}{% endblock %}</div>
   </div>
 </div>
 </body></html>"""
 
-def render_page(title, sub, active, body):
-    from markupsafe import Markup
-    return render_template_string(
-        LAYOUT,
-        page_title=title, page_sub=sub, active=active,
-        body=Markup(body), css=Markup(CSS),
-        url_for=url_for, current_user=current_user,
-    )
+def render_page(template, title, sub, active, **ctx):
+    """Renderiza layout + corpo numa única passada (o corpo estende layout.html)."""
+    return render_template(template, page_title=title, page_sub=sub,
+                           active=active, **ctx)
 
 # ══════════════════════════════════════════════
 #  Routes
@@ -425,12 +505,12 @@ def render_page(title, sub, active, body):
 # ── Login ─────────────────────────────────────
 LOGIN_HTML = """<!DOCTYPE html>
 <html lang="pt-BR">
-<head><meta charset="UTF-8"><title>Login — TI Toner</title>{{ css }}</head>
+<head><meta charset="UTF-8"><title>Login — TI Toner</title>{% set sem_preload = true %}{% include "_assets_head.html" %}</head>
 <body>
 <div class="login-wrap">
   <div class="login-card">
     <div class="login-logo">
-      <div class="icon"><img src="https://media.licdn.com/dms/image/v2/D4D0BAQG0smJnZAhyhw/company-logo_200_200/company-logo_200_200/0/1689000003837/braslimpoficial_logo?e=2147483647&v=beta&t=7Pq4Tq4bXr0Z1cr4VpMETmGUD4mXZed6_xccVMK7pr8" alt="Braslimp"></div>
+      <div class="icon"><img src="{{ logo_url() }}" alt="Braslimp"></div>
       <div class="label">Braslimp<span>Controle de Toners · TI</span></div>
     </div>
     {% for cat,msg in msgs %}
@@ -451,25 +531,49 @@ LOGIN_HTML = """<!DOCTYPE html>
 </div>
 </body></html>"""
 
+def _login_negado(msg, status, retry_after=None):
+    flash(msg, "error")
+    msgs = get_flashed_messages(with_categories=True)
+    resp = make_response(render_template("login.html", msgs=msgs), status)
+    if retry_after:
+        resp.headers["Retry-After"] = str(math.ceil(retry_after))
+    return resp
+
 @app.route("/login", methods=["GET","POST"])
 def login():
-    from markupsafe import Markup
     if current_user.is_authenticated:
         return redirect(url_for("index"))
     if request.method == "POST":
         u = request.form.get("username","").strip()
         p = request.form.get("password","")
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM usuarios WHERE username=%s", (u,))
-        row = fetchone_dict(c)
-        conn.close()
-        if row and check_password_hash(row["password"], p):
-            login_user(User(row))
-            return redirect(url_for("index"))
+        for limite, chave in ((limite_login_ip, request.remote_addr),
+                              (limite_login_usuario, u.lower())):
+            ok, espera = limite.consumir(chave)
+            if not ok:
+                return _login_negado(
+                    "Muitas tentativas. Aguarde alguns instantes e tente novamente.",
+                    429, espera)
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute("SELECT * FROM usuarios WHERE username=%s", (u,))
+            row = fetchone_dict(c)
+        if row:
+            if not _hash_slots.acquire(timeout=LOGIN_HASH_ESPERA):
+                return _login_negado("Servidor ocupado. Tente novamente.", 503, 1)
+            try:
+                valida = check_password_hash(row["password"], p)
+            finally:
+                _hash_slots.release()
+            if valida:
+                if hash_desatualizado(row["password"]):
+                    with get_db() as conn:
+                        conn.cursor().execute("UPDATE usuarios SET password=%s WHERE id=%s",
+                                              (hash_senha(p), row["id"]))
+                login_user(User(row))
+                return redirect(url_for("index"))
         flash("Usuário ou senha incorretos.", "error")
     msgs = get_flashed_messages(with_categories=True)
-    return render_template_string(LOGIN_HTML, css=Markup(CSS), msgs=msgs)
+    return render_template("login.html", msgs=msgs)
 
 @app.route("/logout")
 @login_required
@@ -478,73 +582,117 @@ def logout():
     return redirect(url_for("login"))
 
 # ── Inventário ────────────────────────────────
+INV_POR_PAGINA = 50
+INV_FILTROS    = ("q", "tipo", "status", "tinta_min", "tinta_max")
+
+# ?ordem= -> expressão SQL. Só valores desta lista chegam ao ORDER BY.
+INV_ORDENS = {
+    "setor":      "setor",
+    "codigo":     "codigo",
+    "quantidade": "quantidade",
+    "tinta":      "tinta_pct",
+    "status":     "CASE WHEN quantidade >= 1 THEN 2 WHEN aguardando = 1 THEN 1 ELSE 0 END",
+}
+# Mesma regra de stats.calcular_status, como condição SQL.
+INV_STATUS = {
+    "ok":         "quantidade >= 1",
+    "aguardando": "quantidade < 1 AND aguardando = 1",
+    "problema":   "quantidade < 1 AND aguardando IS DISTINCT FROM 1",
+}
+
+def _like(texto):
+    """Trecho literal para ILIKE '%...%' (escapa os curingas)."""
+    return "%" + texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def buscar_estoque(conn, filtros, ordem="setor", desc=False,
+                   pagina=1, por_pagina=INV_POR_PAGINA):
+    """Uma página do inventário, filtrada e ordenada no banco.
+
+    Retorna (itens com "status", quantos itens atendem aos filtros).
+    ValueError se um filtro, a ordem ou a página for inválido.
+    """
+    if ordem not in INV_ORDENS or pagina < 1:
+        raise ValueError(ordem)
+    where, params = [], []
+    if filtros.get("q"):
+        # Mesma expressão do índice de trigramas (migração 12); no SQLite o
+        # LIKE já ignora maiúsculas (só ASCII) e o escape é explícito.
+        where.append("(coalesce(codigo, '') || ' ' || coalesce(setor, '')) "
+                     + ("LIKE %s ESCAPE '\\'" if SQLITE else "ILIKE %s"))
+        params.append(_like(filtros["q"]))
+    if filtros.get("tipo"):
+        where.append("tipo = %s");        params.append(filtros["tipo"])
+    if filtros.get("status"):
+        if filtros["status"] not in INV_STATUS:
+            raise ValueError(filtros["status"])
+        where.append(INV_STATUS[filtros["status"]])
+    if filtros.get("tinta_min"):
+        where.append("tinta_pct >= %s");  params.append(int(filtros["tinta_min"]))
+    if filtros.get("tinta_max"):
+        where.append("tinta_pct <= %s");  params.append(int(filtros["tinta_max"]))
+    cond = (" WHERE " + " AND ".join(where)) if where else ""
+
+    # Desempate por id no mesmo sentido: o índice (coluna, id) serve nas
+    # duas direções e o LIMIT para cedo.
+    sentido = "DESC" if desc else "ASC"
+    inicio = (pagina - 1) * por_pagina
+    c = conn.cursor()
+    c.execute(f"SELECT * FROM estoque{cond} ORDER BY {INV_ORDENS[ordem]} {sentido}, id {sentido}"
+              " LIMIT %s OFFSET %s", params + [por_pagina, inicio])
+    rows = fetchall_dict(c)
+    if rows and len(rows) < por_pagina or not rows and pagina == 1:
+        encontrados = inicio + len(rows)      # última página: dispensa o count
+    else:
+        c.execute(f"SELECT count(*) FROM estoque{cond}", params)
+        encontrados = c.fetchone()[0]
+    return ([{**r, "status": calcular_status(r["quantidade"], r["aguardando"])} for r in rows],
+            encontrados)
+
 @app.route("/")
 @login_required
 def index():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM estoque ORDER BY setor")
-    rows       = fetchall_dict(c)
-    c.execute("SELECT COALESCE(SUM(quantidade),0) FROM estoque")
-    total      = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE quantidade=0")
-    zerados    = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE aguardando=1")
-    aguardando = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE quantidade>=1")
-    ok_count   = c.fetchone()[0]
-    conn.close()
-
-    dados, alerta = [], False
-    for r in rows:
-        st = calcular_status(r["quantidade"], r["aguardando"])
-        if r["quantidade"] == 0 and r["aguardando"] == 0:
-            alerta = True
-        dados.append({**r, "status": st})
-
-    zerados_count = sum(1 for d in dados if d["quantidade"]==0 and d["aguardando"]==0)
-    stats = {"total": total, "zerados": zerados, "aguardando": aguardando, "ok": ok_count}
-
-    body = render_template_string(INV_BODY,
-        dados=dados, alerta=alerta, stats=stats,
-        zerados_count=zerados_count, url_for=url_for,
-        obs_map={d["id"]: d["observacao"] for d in dados},
-        tinta_map={d["id"]: d["tinta_pct"] for d in dados})
-    return render_page("Inventário", "Controle de toners em estoque", "inventario", body)
-INV_BODY = """
-{% if alerta %}
-<div class="alert alert-danger">
-  ⚠ <strong>Atenção:</strong> {{ zerados_count }} toner(s) com estoque zerado sem pedido em aberto.
-</div>
-{% endif %}
-<div class="stats-row">
-  <div class="stat"><div class="stat-label">Total em Estoque</div><div class="stat-number c-primary">{{ stats.total }}</div><div class="stat-hint">unidades</div></div>
-  <div class="stat"><div class="stat-label">Setores OK</div><div class="stat-number c-ok">{{ stats.ok }}</div><div class="stat-hint">estoque normal</div></div>
-  <div class="stat"><div class="stat-label">Aguardando</div><div class="stat-number c-warn">{{ stats.aguardando }}</div><div class="stat-hint">pedidos em trânsito</div></div>
-  <div class="stat"><div class="stat-label">Zerados</div><div class="stat-number c-danger">{{ stats.zerados }}</div><div class="stat-hint">ação necessária</div></div>
-</div>
-<div class="card">
-  <div class="card-header">
-    <div><div class="card-title">Inventário de Toners</div><div class="card-sub">{{ dados|length }} itens cadastrados</div></div>
-  </div>
-  <div class="table-wrap">
-  <table>
-    <thead>
-      <tr><th>Código</th><th>Setor / Unidade</th><th>Tipo</th><th>Qtd</th><th>Status</th><th>Nível de Tinta</th><th>Observação</th><th>Ações</th></tr>
-    </thead>
-    <tbody>
-    {% for item in dados %}
-    <tr>
+    filtros = {k: request.args[k].strip() for k in INV_FILTROS if request.args.get(k, "").strip()}
+    ordem   = request.args.get("ordem", "setor")
+    desc    = request.args.get("desc") == "1"
+    try:
+        pagina = int(request.args.get("pagina", 1))
+    except ValueError:
+        abort(400)
+    with get_db() as conn:
+        versao = versao_estoque(conn)
+
+        def render():
+            try:
+                dados, encontrados = buscar_estoque(conn, filtros, ordem, desc, pagina)
+            except ValueError:
+                abort(400)
+            _, stats = totais(conn)
+            params = dict(filtros, ordem=ordem if ordem != "setor" else None,
+                          desc="1" if desc else None)
+            return render_page("inventario.html",
+                "Inventário", "Controle de toners em estoque", "inventario",
+                dados=dados, encontrados=encontrados, alerta=stats["sem_pedido"] > 0,
+                stats=stats, zerados_count=stats["sem_pedido"], versao=versao,
+                filtros=filtros, ordem=ordem, desc=desc, params=params, pagina=pagina,
+                paginas=max(1, math.ceil(encontrados / INV_POR_PAGINA)), tipos=estoque_csv.TIPOS)
+        # A mesma URL (filtros/ordem/página) só muda quando o estoque muda.
+        chave = hashlib.sha1(request.query_string).hexdigest()[:10]
+        return pagina_versionada(f"inv-{chave}", versao, render)
+
+# Linha da tabela do inventário: usada pela página e devolvida sozinha
+# pelas ações chamadas via fetch (ver _acao).
+LINHA_ESTOQUE = """{% macro linha(item) %}
+    <tr data-id="{{ item.id }}">
       <td><span class="code">{{ item.codigo }}</span></td>
       <td><strong>{{ item.setor }}</strong></td>
       <td>{% if item.tipo=="colorida" %}<span style="display:inline-flex;align-items:center;gap:5px;font-size:12px;font-weight:600;color:#b45309;background:#fffbeb;border:1px solid #fde68a;padding:3px 9px;border-radius:20px;white-space:nowrap">🎨 Colorida</span>{% else %}<span style="display:inline-flex;align-items:center;gap:5px;font-size:12px;font-weight:600;color:#374151;background:#f3f4f6;border:1px solid #d1d5db;padding:3px 9px;border-radius:20px;white-space:nowrap">⬛ P&amp;B</span>{% endif %}</td>
-      <td><span class="qty {% if item.quantidade==0 %}qty-0{% elif item.quantidade==1 %}qty-1{% else %}qty-ok{% endif %}">{{ item.quantidade }}</span></td>
-      <td>
+      <td data-col="qtd"><span class="qty {% if item.quantidade==0 %}qty-0{% elif item.quantidade==1 %}qty-1{% else %}qty-ok{% endif %}">{{ item.quantidade }}</span></td>
+      <td data-col="status">
         {% if item.status=="OK" %}<span class="badge badge-ok">● OK</span>
         {% elif item.status=="Aguardando Selbetti" %}<span class="badge badge-warn">● Aguardando</span>
         {% else %}<span class="badge badge-danger">● Problema</span>{% endif %}
       </td>
-      <td>
+      <td data-col="tinta">
         {% if item.tinta_pct is not none %}
           <div style="display:flex;align-items:center;gap:7px;min-width:90px">
             <div style="flex:1;height:4px;background:var(--border);border-radius:2px;overflow:hidden">
@@ -557,7 +705,7 @@ INV_BODY = """
           <span style="font-size:12px;color:var(--light)">—</span>
         {% endif %}
       </td>
-      <td><span class="obs-text {% if not item.observacao %}obs-empty{% endif %}" title="{{ item.observacao or '' }}">{{ item.observacao if item.observacao else '—' }}</span></td>
+      <td data-col="obs"><span class="obs-text {% if not item.observacao %}obs-empty{% endif %}" title="{{ item.observacao or '' }}">{{ item.observacao if item.observacao else '—' }}</span></td>
       <td>
         <div class="action-row">
           <a href="{{ url_for('mais',    id=item.id) }}" class="act act-plus">+ Add</a>
@@ -569,16 +717,69 @@ INV_BODY = """
         </div>
       </td>
     </tr>
-    {% endfor %}
+{% endmacro %}"""
+
+INV_BODY = """
+{% from "_inventario.html" import linha %}
+<div class="alert alert-danger" id="alerta-zerados" {% if not alerta %}style="display:none"{% endif %}>
+  ⚠ <strong>Atenção:</strong> <span data-stat="sem_pedido">{{ zerados_count }}</span> toner(s) com estoque zerado sem pedido em aberto.
+</div>
+<div class="stats-row">
+  <div class="stat"><div class="stat-label">Total em Estoque</div><div class="stat-number c-primary" data-stat="total">{{ stats.total }}</div><div class="stat-hint">unidades</div></div>
+  <div class="stat"><div class="stat-label">Setores OK</div><div class="stat-number c-ok" data-stat="ok">{{ stats.ok }}</div><div class="stat-hint">estoque normal</div></div>
+  <div class="stat"><div class="stat-label">Aguardando</div><div class="stat-number c-warn" data-stat="aguardando">{{ stats.aguardando }}</div><div class="stat-hint">pedidos em trânsito</div></div>
+  <div class="stat"><div class="stat-label">Zerados</div><div class="stat-number c-danger" data-stat="zerados">{{ stats.zerados }}</div><div class="stat-hint">ação necessária</div></div>
+</div>
+{% macro th_ordem(col, rotulo) %}<th><a class="th-ordem" href="{{ url_for('index', **dict(params, ordem=col, desc='1' if ordem == col and not desc else None)) }}">{{ rotulo }}{% if ordem == col %} {{ '▼' if desc else '▲' }}{% endif %}</a></th>{% endmacro %}
+<div class="card" id="inventario" data-eventos="{{ url_for('eventos_estoque', v=versao) }}">
+  <div class="card-header">
+    <div><div class="card-title">Inventário de Toners</div><div class="card-sub">{% if filtros %}{{ encontrados }} de {% endif %}<span data-stat="total_itens">{{ stats.total_itens }}</span> itens cadastrados</div></div>
+    <a href="{{ url_for('exportar_estoque') }}" class="btn btn-ghost">⬇ Exportar CSV</a>
+  </div>
+  <form method="GET" style="display:flex;gap:8px;flex-wrap:wrap;align-items:flex-end;padding:12px 20px;border-bottom:1px solid var(--border)">
+    <div style="min-width:200px;flex:1"><label>Buscar</label><input type="search" name="q" value="{{ filtros.q or '' }}" placeholder="Código ou setor"></div>
+    <div style="min-width:120px"><label>Tipo</label>
+      <select name="tipo"><option value="">Todos</option>
+        {% for t in tipos %}<option value="{{ t }}" {% if filtros.tipo==t %}selected{% endif %}>{{ t }}</option>{% endfor %}
+      </select></div>
+    <div style="min-width:130px"><label>Status</label>
+      <select name="status"><option value="">Todos</option>
+        {% for v, r in [('ok', 'OK'), ('aguardando', 'Aguardando'), ('problema', 'Problema')] %}<option value="{{ v }}" {% if filtros.status==v %}selected{% endif %}>{{ r }}</option>{% endfor %}
+      </select></div>
+    <div style="width:90px"><label>Tinta mín. %</label><input type="number" name="tinta_min" min="0" max="100" value="{{ filtros.tinta_min or '' }}"></div>
+    <div style="width:90px"><label>Tinta máx. %</label><input type="number" name="tinta_max" min="0" max="100" value="{{ filtros.tinta_max or '' }}"></div>
+    {% if params.ordem %}<input type="hidden" name="ordem" value="{{ params.ordem }}">{% endif %}
+    {% if params.desc %}<input type="hidden" name="desc" value="1">{% endif %}
+    <button type="submit" class="btn btn-primary">Filtrar</button>
+    <a href="{{ url_for('index') }}" class="btn btn-ghost">Limpar filtros</a>
+  </form>
+  <div class="table-wrap">
+  <table>
+    <thead>
+      <tr>{{ th_ordem('codigo', 'Código') }}{{ th_ordem('setor', 'Setor / Unidade') }}<th>Tipo</th>{{ th_ordem('quantidade', 'Qtd') }}{{ th_ordem('status', 'Status') }}{{ th_ordem('tinta', 'Nível de Tinta') }}<th>Observação</th><th>Ações</th></tr>
+    </thead>
+    <tbody>
+    {% for item in dados %}{{ linha(item) }}{% endfor %}
     </tbody>
   </table>
   </div>
+  {% if not dados %}
+    <p style="padding:24px 20px;color:var(--muted);font-size:13px">Nenhum item{% if filtros %} para estes filtros{% else %} cadastrado{% endif %}.</p>
+  {% endif %}
+  {% if paginas > 1 %}
+  <div style="display:flex;justify-content:space-between;align-items:center;padding:12px 20px;border-top:1px solid var(--border)">
+    {% if pagina > 1 %}<a href="{{ url_for('index', pagina=pagina - 1, **params) }}" class="btn btn-ghost">← Anterior</a>{% else %}<span></span>{% endif %}
+    <span style="font-size:12px;color:var(--muted)">Página {{ pagina }} de {{ paginas }}</span>
+    {% if pagina < paginas %}<a href="{{ url_for('index', pagina=pagina + 1, **params) }}" class="btn btn-ghost">Próxima →</a>{% else %}<span></span>{% endif %}
+  </div>
+  {% endif %}
 </div>
 <!-- Modal observação -->
 <div class="modal-backdrop" id="obs-modal">
   <div class="modal" onclick="event.stopPropagation()">
     <div class="modal-title">✏ Editar Observação</div>
     <form id="obs-form" method="POST">
+      <input type="hidden" name="versao" id="obs-versao">
       <div class="form-group">
         <label>Observação</label>
         <textarea name="observacao" id="obs-input"
@@ -593,16 +794,30 @@ INV_BODY = """
   </div>
 </div>
 
-<!-- Dados das observações em JSON seguro -->
 <script>
-var obsData = {{ obs_map | tojson }};
-var tintaData = {{ tinta_map | tojson }};
+// Os modais buscam só o item que vão editar.
+function carregarItem(id) {
+  return fetch('/api/v1/estoque/' + id, {credentials: 'same-origin'})
+    .then(function(r) { if (!r.ok) throw new Error(r.status); return r.json(); });
+}
 
 function openObs(id) {
   document.getElementById('obs-form').action = '/observacao/' + id;
-  document.getElementById('obs-input').value = obsData[id] || '';
+  var input = document.getElementById('obs-input');
+  var versao = document.getElementById('obs-versao');
+  input.value = versao.value = '';
+  input.disabled = true;
   document.getElementById('obs-modal').classList.add('open');
-  setTimeout(function(){ document.getElementById('obs-input').focus(); }, 50);
+  carregarItem(id).then(function(it) {
+    input.value = it.observacao || '';
+    versao.value = it.versao;
+  }).catch(function() {
+    closeObs();
+    alert('Não foi possível carregar o item.');
+  }).then(function() {
+    input.disabled = false;
+    input.focus();
+  });
 }
 function closeObs() {
   document.getElementById('obs-modal').classList.remove('open');
@@ -613,11 +828,23 @@ document.getElementById('obs-modal').addEventListener('click', function(e) {
 
 function openTinta(id) {
   document.getElementById('tinta-form').action = '/tinta/' + id;
-  var val = tintaData[id];
-  document.getElementById('tinta-input').value = (val !== null && val !== undefined) ? val : '';
+  var input = document.getElementById('tinta-input');
+  var versao = document.getElementById('tinta-versao');
+  input.value = versao.value = '';
+  input.disabled = true;
   updateTintaPreview();
   document.getElementById('tinta-modal').classList.add('open');
-  setTimeout(function(){ document.getElementById('tinta-input').focus(); }, 50);
+  carregarItem(id).then(function(it) {
+    input.value = (it.tinta_pct !== null && it.tinta_pct !== undefined) ? it.tinta_pct : '';
+    versao.value = it.versao;
+    updateTintaPreview();
+  }).catch(function() {
+    closeTinta();
+    alert('Não foi possível carregar o item.');
+  }).then(function() {
+    input.disabled = false;
+    input.focus();
+  });
 }
 function closeTinta() {
   document.getElementById('tinta-modal').classList.remove('open');
@@ -640,12 +867,14 @@ document.addEventListener('keydown', function(e) {
   if (e.key === 'Escape') { closeObs(); closeTinta(); }
 });
 </script>
+<script src="{{ asset('js/inventario.js') }}" defer></script>
 
 <!-- Modal tinta -->
 <div class="modal-backdrop" id="tinta-modal">
   <div class="modal" onclick="event.stopPropagation()">
     <div class="modal-title">🖨 Nível de Tinta</div>
     <form id="tinta-form" method="POST">
+      <input type="hidden" name="versao" id="tinta-versao">
       <div class="form-group">
         <label>Percentual estimado (%)</label>
         <input type="number" name="tinta_pct" id="tinta-input"
@@ -676,97 +905,254 @@ document.addEventListener('keydown', function(e) {
 """
 
 # ── Ações ─────────────────────────────────────
+def _quer_json():
+    return request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+
+def _versao_lida():
+    """Versão do item que o cliente leu (campo "versao"), se veio."""
+    v = request.values.get("versao", "")
+    return int(v) if v.isdigit() else None
+
+def linha_json(row):
+    item = {**row, "status": calcular_status(row["quantidade"], row["aguardando"])}
+    return item, str(get_template_attribute("_inventario.html", "linha")(item))
+
+ACAO_CONFLITO   = ("Outra pessoa alterou este item enquanto você editava. "
+                   "Confira os valores atuais e salve de novo.")
+ACAO_SEM_EFEITO = "Nada mudou (item inexistente ou estoque zerado)."
+
+def _acao(estoque_id, tipo, valor=None, destino=None):
+    """Aplica o movimento e responde conforme quem chamou.
+
+    Navegação comum (link/formulário): redirect, como sempre. fetch com
+    Accept: application/json: a linha atualizada (dados + HTML) e os totais,
+    lidos na mesma transação, para a página se atualizar sem recarregar.
+    Conflito de versão: 409 com a linha atual, para o cliente decidir.
+    """
+    json_ = _quer_json()
+    conflito = None
+    with get_db() as conn:
+        try:
+            row = movimentar(conn, estoque_id, tipo, valor, versao=_versao_lida())
+        except ConflitoVersao as e:
+            row, conflito = None, e.atual
+        if json_:
+            versao, tot = totais(conn)
+    if not json_:
+        return redirect(destino or url_for("index"))
+    if conflito is not None:
+        item, html = linha_json(conflito)
+        return jsonify(ok=False, conflito=True, item=item, html=html, versao=versao, stats=tot,
+                       erro=ACAO_CONFLITO), 409
+    if row is None:
+        return jsonify(ok=False, erro=ACAO_SEM_EFEITO, versao=versao, stats=tot), 409
+    item, html = linha_json(row)
+    return jsonify(ok=True, item=item, html=html, versao=versao, stats=tot)
+
 @app.route("/mais/<int:id>")
 @login_required
 def mais(id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    c.execute("UPDATE estoque SET quantidade=quantidade+1, aguardando=0 WHERE id=%s", (id,))
-    conn.commit(); conn.close()
-    registrar(id, "Adição", f"+1 unidade — {row['setor']}")
-    return redirect(url_for("index"))
+    return _acao(id, "mais")
 
 @app.route("/menos/<int:id>")
 @login_required
 def menos(id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor,quantidade FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    if row["quantidade"] > 0:
-        c.execute("UPDATE estoque SET quantidade=quantidade-1 WHERE id=%s", (id,))
-        conn.commit()
-        registrar(id, "Retirada", f"-1 unidade — {row['setor']}")
-    conn.close()
-    return redirect(url_for("index"))
+    return _acao(id, "menos")
 
 @app.route("/solicitar/<int:id>")
 @login_required
 def solicitar(id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    c.execute("UPDATE estoque SET aguardando=1 WHERE id=%s", (id,))
-    conn.commit(); conn.close()
-    registrar(id, "Solicitação", f"Pedido enviado à Selbetti — {row['setor']}")
-    return redirect("https://selbetti.com.br/")
+    return _acao(id, "solicitar", destino="https://selbetti.com.br/")
 
 @app.route("/recebido/<int:id>")
 @login_required
 def recebido(id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    c.execute("UPDATE estoque SET quantidade=quantidade+1, aguardando=0 WHERE id=%s", (id,))
-    conn.commit(); conn.close()
-    registrar(id, "Recebimento", f"Toner recebido +1 — {row['setor']}")
-    return redirect(url_for("index"))
+    return _acao(id, "recebido")
 
 @app.route("/observacao/<int:id>", methods=["POST"])
 @login_required
 def observacao(id):
     obs = request.form.get("observacao","").strip()
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    c.execute("UPDATE estoque SET observacao=%s WHERE id=%s", (obs, id))
-    conn.commit(); conn.close()
-    registrar(id, "Observação", f"Obs atualizada — {row['setor']}: \"{obs}\"")
-    return redirect(url_for("index"))
+    return _acao(id, "observacao", obs)
 
 @app.route("/tinta/<int:id>", methods=["POST"])
 @login_required
 def tinta(id):
+    return _acao(id, "tinta", valor_tinta(request.form.get("tinta_pct", "100")))
+
+def valor_tinta(texto):
+    """Campo tinta_pct do formulário -> 0..100, ou None se não é número."""
     try:
-        pct = int(request.form.get("tinta_pct", 100))
-        pct = max(0, min(100, pct))
+        return max(0, min(100, int(texto)))
     except ValueError:
-        pct = None
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT setor FROM estoque WHERE id=%s", (id,))
-    row = fetchone_dict(c)
-    c.execute("UPDATE estoque SET tinta_pct=%s WHERE id=%s", (pct, id))
-    conn.commit(); conn.close()
-    registrar(id, "Nível de Tinta", f"Tinta atualizada para {pct}% — {row['setor']}")
-    return redirect(url_for("index"))
+        return None
+
+# ── Importação / exportação CSV ───────────────
+CSV_BODY = """
+{% if resumo %}
+<div class="alert alert-ok">
+  ✔ <strong>{{ arquivo }}</strong>: {{ resumo.linhas }} linhas — {{ resumo.inseridos }} novos,
+  {{ resumo.atualizados }} atualizados, {{ resumo.inalterados }} sem alteração ({{ '%.1f'|format(segundos) }} s).
+</div>
+{% endif %}
+{% if erros %}
+<div class="alert alert-danger">
+  ⚠ <strong>{{ arquivo }}</strong>: nada foi importado.
+  {% if erros|length >= max_erros %}Mostrando os primeiros {{ max_erros }} erros.{% endif %}
+</div>
+{% endif %}
+<div class="card">
+  <div class="card-header">
+    <div><div class="card-title">Importar estoque (CSV)</div>
+      <div class="card-sub">Itens casados por código + setor: existentes são atualizados, os demais criados</div></div>
+    <a href="{{ url_for('exportar_estoque') }}" class="btn btn-ghost">⬇ Exportar CSV</a>
+  </div>
+  <form method="POST" enctype="multipart/form-data" style="display:flex;gap:8px;align-items:flex-end;padding:16px 20px">
+    <div style="flex:1"><label>Arquivo</label><input type="file" name="arquivo" accept=".csv,text/csv" required></div>
+    <button type="submit" class="btn btn-primary">Importar</button>
+  </form>
+  <div class="card-sub" style="padding:0 20px 16px">
+    Cabeçalho: <span class="code">{{ colunas|join(',') }}</span> — obrigatórias:
+    <span class="code">{{ obrigatorias|join(', ') }}</span>. Separador vírgula ou ponto e vírgula, UTF-8.
+  </div>
+  {% if erros %}
+  <div class="table-wrap">
+  <table>
+    <thead><tr><th>Linha</th><th>Erro</th></tr></thead>
+    <tbody>
+    {% for linha, msg in erros %}<tr><td><span class="code">{{ linha }}</span></td><td>{{ msg }}</td></tr>{% endfor %}
+    </tbody>
+  </table>
+  </div>
+  {% endif %}
+</div>
+"""
+
+@app.route("/estoque/importar", methods=["GET", "POST"])
+@login_required
+@admin_required
+def importar_estoque():
+    ctx = dict(colunas=estoque_csv.COLUNAS, obrigatorias=estoque_csv.OBRIGATORIAS,
+               max_erros=estoque_csv.MAX_ERROS, resumo=None, erros=None)
+    status = 200
+    arq = request.files.get("arquivo")
+    if request.method == "POST" and arq:
+        ctx["arquivo"] = arq.filename
+        inicio = time.perf_counter()
+        try:
+            with get_db() as conn:
+                ctx["resumo"] = estoque_csv.importar(conn, arq.stream, current_user.username)
+        except estoque_csv.ErroImportacao as e:
+            ctx["erros"], status = e.erros, 422
+        ctx["segundos"] = time.perf_counter() - inicio
+        if ctx["resumo"]:
+            app.logger.info("Importação CSV %s: %s em %.2f s", arq.filename,
+                            ctx["resumo"], ctx["segundos"])
+    return render_page("importar.html",
+        "Importar CSV", "Carga do estoque em massa", "importar", **ctx), status
+
+@app.route("/estoque/exportar.csv")
+@login_required
+def exportar_estoque():
+    with get_db() as conn:
+        arquivo = estoque_csv.exportar(conn)
+    nome = f"estoque-{datetime.now(ZoneInfo(TZ_LOCAL)):%Y%m%d-%H%M}.csv"
+    return Response(estoque_csv.blocos(arquivo), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={nome}",
+                             "Cache-Control": "private, no-store"})
+
+@app.cli.command("estoque-importar")
+@click.argument("arquivo", type=click.File("rb"))
+@click.option("--usuario", default="cli", help="Usuário registrado no histórico.")
+def cli_estoque_importar(arquivo, usuario):
+    """Importa um CSV de estoque (mesmo formato da tela de importação)."""
+    inicio = time.perf_counter()
+    try:
+        with get_db() as conn:
+            resumo = estoque_csv.importar(conn, arquivo, usuario)
+    except estoque_csv.ErroImportacao as e:
+        for linha, msg in e.erros:
+            click.echo(f"linha {linha}: {msg}", err=True)
+        raise click.ClickException(f"{e}; nada foi importado.")
+    click.echo(f"{resumo} em {time.perf_counter() - inicio:.2f} s")
+
+@app.cli.command("estoque-exportar")
+@click.argument("destino", type=click.File("wb"), default="-")
+def cli_estoque_exportar(destino):
+    """Exporta o estoque em CSV (padrão: saída padrão)."""
+    with get_db() as conn:
+        arquivo = estoque_csv.exportar(conn)
+    for bloco in estoque_csv.blocos(arquivo):
+        destino.write(bloco)
+
+# ── Eventos ao vivo (SSE) ─────────────────────
+def _estoque_alterado(payload):
+    """NOTIFY estoque_alterado -> um evento SSE para todos os clientes do worker."""
+    if not eventos.conectados():
+        return
+    dados = json.loads(payload)
+    with get_db() as conn:
+        versao, dados["stats"] = totais(conn)
+    if dados.get("recarregar"):
+        eventos.publicar(eventos.mensagem("recarregar", {}, versao))
+        return
+    for item in dados["itens"]:
+        item["status"] = calcular_status(item["quantidade"], item["aguardando"])
+    eventos.publicar(eventos.mensagem("estoque", dados, versao))
+
+ouvinte.inscrever("estoque_alterado", _estoque_alterado)
+# Sem conexão, notificações podem ter se perdido: os clientes recarregam.
+ouvinte.ao_reconectar(lambda: eventos.publicar(eventos.RECARREGAR))
+
+@app.route("/eventos")
+@login_required
+def eventos_estoque():
+    fila = difusor.conectar()
+    if fila is None:
+        # Worker no limite: encerra e pede ao EventSource que tente mais tarde
+        # (um status de erro faria o navegador desistir de vez).
+        return Response("retry: 60000\n\n", mimetype="text/event-stream")
+    inicial = ()
+    ultimo = request.headers.get("Last-Event-ID") or request.args.get("v")
+    if ultimo:
+        with get_db() as conn:
+            atual = versao_estoque(conn)
+        if str(atual) != ultimo:
+            inicial = (eventos.mensagem("recarregar", {}, atual),)
+    resp = Response(difusor.transmitir(fila, inicial), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    resp.call_on_close(lambda: difusor.desconectar(fila))
+    return resp
 
 # ── Histórico ─────────────────────────────────
 HIST_BODY = """
 <div class="card">
   <div class="card-header">
-    <div><div class="card-title">Histórico de Movimentações</div><div class="card-sub">{{ registros|length }} registros recentes</div></div>
+    <div><div class="card-title">Histórico de Movimentações</div><div class="card-sub">{{ registros|length }} registros nesta página</div></div>
     {% if current_user.is_admin %}
-    <a href="{{ url_for('limpar_historico') }}" onclick="return confirm('Limpar todo o histórico?')" class="btn btn-danger-ghost">Limpar tudo</a>
+    <form method="POST" action="{{ url_for('arquivar_historico') }}" onsubmit="return confirm('Arquivar e remover do banco os meses além da retenção ({{ retencao }} meses)?')">
+      <button type="submit" class="btn btn-danger-ghost">Arquivar antigos</button>
+    </form>
     {% endif %}
   </div>
+  <form method="GET" style="display:flex;gap:8px;flex-wrap:wrap;align-items:flex-end;padding:12px 20px;border-bottom:1px solid var(--border)">
+    <div style="min-width:150px"><label>Setor</label>
+      <select name="setor"><option value="">Todos</option>
+        {% for s in setores %}<option value="{{ s }}" {% if filtros.setor==s %}selected{% endif %}>{{ s }}</option>{% endfor %}
+      </select></div>
+    <div style="min-width:150px"><label>Ação</label>
+      <select name="acao"><option value="">Todas</option>
+        {% for a in acoes %}<option value="{{ a }}" {% if filtros.acao==a %}selected{% endif %}>{{ a }}</option>{% endfor %}
+      </select></div>
+    <div style="min-width:140px"><label>Usuário</label><input type="text" name="usuario" value="{{ filtros.usuario or '' }}"></div>
+    <div><label>De</label><input type="date" name="de" value="{{ filtros.de or '' }}" style="padding:7px 9px;border:1px solid var(--border);border-radius:6px"></div>
+    <div><label>Até</label><input type="date" name="ate" value="{{ filtros.ate or '' }}" style="padding:7px 9px;border:1px solid var(--border);border-radius:6px"></div>
+    {% if filtros.estoque_id %}<input type="hidden" name="estoque_id" value="{{ filtros.estoque_id }}">{% endif %}
+    <button type="submit" class="btn btn-primary">Filtrar</button>
+    <a href="{{ url_for('historico') }}" class="btn btn-ghost">Limpar filtros</a>
+  </form>
   {% if not registros %}
-    <p style="padding:24px 20px;color:var(--muted);font-size:13px">Nenhum registro ainda.</p>
+    <p style="padding:24px 20px;color:var(--muted);font-size:13px">Nenhum registro{% if filtros %} para estes filtros{% else %} ainda{% endif %}.</p>
   {% endif %}
   {% for r in registros %}
   <div class="h-item">
@@ -779,32 +1165,142 @@ HIST_BODY = """
     <div style="flex:1"><div class="h-acao">{{ r.acao }}</div><div class="h-meta">{{ r.detalhe }}</div></div>
     <div style="text-align:right;flex-shrink:0">
       <div style="font-size:12px;font-weight:600;color:var(--muted)">{{ r.usuario }}</div>
-      <div style="font-size:11px;color:var(--light)">{{ r.criado_em }}</div>
+      <div style="font-size:11px;color:var(--light)">{{ r.criado_em | datahora }}</div>
     </div>
   </div>
   {% endfor %}
+  {% if cursor or proximo %}
+  <div style="display:flex;justify-content:space-between;padding:12px 20px;border-top:1px solid var(--border)">
+    {% if cursor %}<a href="{{ url_for('historico', **filtros) }}" class="btn btn-ghost">← Mais recentes</a>{% else %}<span></span>{% endif %}
+    {% if proximo %}<a href="{{ url_for('historico', cursor=proximo, **filtros) }}" class="btn btn-ghost">Mais antigos →</a>{% endif %}
+  </div>
+  {% endif %}
 </div>
 """
 
+HIST_POR_PAGINA = 50
+HIST_FILTROS = ("setor", "estoque_id", "usuario", "acao", "de", "ate")
+
+def _cursor_codificar(row):
+    bruto = f"{row['criado_em'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+def _cursor_decodificar(cursor):
+    bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    ts, id_ = bruto.rsplit("|", 1)
+    return datetime.fromisoformat(ts), int(id_)
+
+def _inicio_do_dia(data):
+    """'YYYY-MM-DD' -> meia-noite local (timezone-aware)."""
+    return datetime.strptime(data, "%Y-%m-%d").replace(tzinfo=ZoneInfo(TZ_LOCAL))
+
+def buscar_historico(conn, filtros, cursor=None, limite=HIST_POR_PAGINA):
+    """Página do histórico em ordem (criado_em, id) decrescente.
+
+    Paginação por cursor (keyset): cada página é um range scan no índice,
+    com custo constante independente da profundidade. Retorna
+    (registros, cursor_da_proxima_pagina | None). ValueError se um filtro
+    ou o cursor for inválido.
+    """
+    c = conn.cursor()
+    c.execute(*consulta_historico(filtros, cursor, limite))
+    return pagina_historico(fetchall_dict(c), limite)
+
+def consulta_historico(filtros, cursor, limite):
+    """(sql, params) de buscar_historico(); ValueError se algo é inválido."""
+    where, params = [], []
+    # SQLite: com filtro por item, o "+" tira usuario/acao da escolha de
+    # índice; senão o planejador varre historico_acao_idx inteiro na ordem
+    # do ORDER BY em vez de usar o índice por estoque_id, bem mais seletivo.
+    por_item = SQLITE and (filtros.get("estoque_id") or filtros.get("setor"))
+    if filtros.get("estoque_id"):
+        where.append("estoque_id = %s");  params.append(int(filtros["estoque_id"]))
+    if filtros.get("setor"):
+        where.append("estoque_id IN (SELECT id FROM estoque WHERE setor = %s)")
+        params.append(filtros["setor"])
+    if filtros.get("usuario"):
+        where.append(("+" if por_item else "") + "usuario = %s")
+        params.append(filtros["usuario"])
+    if filtros.get("acao"):
+        where.append(("+" if por_item else "") + "acao = %s")
+        params.append(filtros["acao"])
+    if filtros.get("de"):
+        where.append("criado_em >= %s");  params.append(_inicio_do_dia(filtros["de"]))
+    if filtros.get("ate"):
+        where.append("criado_em < %s");   params.append(_inicio_do_dia(filtros["ate"]) + timedelta(days=1))
+    if cursor:
+        where.append("(criado_em, id) < (%s, %s)"); params.extend(_cursor_decodificar(cursor))
+    sql = "SELECT * FROM historico"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY criado_em DESC, id DESC LIMIT %s"
+    params.append(limite + 1)
+    return sql, params
+
+def pagina_historico(rows, limite):
+    """Até limite + 1 linhas -> (registros, cursor da próxima página | None)."""
+    proximo = _cursor_codificar(rows[limite - 1]) if len(rows) > limite else None
+    return rows[:limite], proximo
+
+@app.template_filter("datahora")
+def datahora(valor):
+    if not valor:
+        return ""
+    return valor.astimezone(ZoneInfo(TZ_LOCAL)).strftime("%d/%m/%Y %H:%M")
+
 @app.route("/historico")
 @login_required
 def historico():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM historico ORDER BY id DESC LIMIT 200")
-    rows = fetchall_dict(c)
-    conn.close()
-    body = render_template_string(HIST_BODY, registros=rows,
-        url_for=url_for, current_user=current_user)
-    return render_page("Histórico", "Últimas movimentações registradas", "historico", body)
-
-@app.route("/historico/limpar")
+    filtros = {k: request.args[k] for k in HIST_FILTROS if request.args.get(k)}
+    cursor  = request.args.get("cursor")
+    with get_db() as conn:
+        try:
+            rows, proximo = buscar_historico(conn, filtros, cursor)
+        except (ValueError, UnicodeDecodeError, binascii.Error):
+            abort(400)
+        _, snap = snapshot_cache.obter(conn)
+    setores = sorted({d["setor"] for d in snap.itens if d["setor"]})
+    return render_page("historico.html",
+        "Histórico", "Últimas movimentações registradas", "historico",
+        registros=rows, filtros=filtros, cursor=cursor, proximo=proximo,
+        setores=setores, acoes=[m[0] for m in MOVIMENTOS.values()] + [estoque_csv.ACAO],
+        retencao=particoes.RETENCAO_MESES)
+
+@app.route("/historico/arquivar", methods=["POST"])
 @login_required
 @admin_required
-def limpar_historico():
-    conn = get_db(); c = conn.cursor(); c.execute("DELETE FROM historico"); conn.commit(); conn.close()
+def arquivar_historico():
+    with get_db() as conn:
+        feitos = particoes.manter(conn)
+    app.logger.info("Histórico arquivado: %s", feitos)
     return redirect(url_for("historico"))
 
+@app.cli.command("historico-manter")
+def cli_historico_manter():
+    """Cria partições futuras e arquiva as que passaram da retenção."""
+    with get_db() as conn:
+        feitos = particoes.manter(conn)
+    for nome, caminho, linhas in feitos:
+        print(f"{nome}: {linhas} linhas -> {caminho}")
+    if not feitos:
+        print("Nenhuma partição expirada.")
+
+@app.cli.command("tendencias-reconstruir")
+@click.option("--desde", type=click.DateTime(["%Y-%m-%d"]), help="Primeiro dia (padrão: todo o histórico).")
+def cli_tendencias_reconstruir(desde):
+    """Refaz o resumo diário das movimentações a partir do histórico."""
+    with get_db() as conn:
+        linhas = tendencias.reconstruir(conn.cursor(), desde.date() if desde else None)
+    print(f"{linhas} linhas no resumo diário.")
+
+@app.cli.command("historico-restaurar")
+@click.argument("arquivos", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def cli_historico_restaurar(arquivos):
+    """Reimporta arquivos historico_YYYY_MM.csv.gz gerados pelo arquivamento."""
+    for caminho in arquivos:
+        with get_db() as conn:
+            print(f"{caminho}: {particoes.restaurar_arquivo(conn, caminho)} linhas")
+
 # ── Dashboard ─────────────────────────────────
 DASH_BODY = """
 <style>
@@ -896,6 +1392,74 @@ DASH_BODY = """
 
 </div>
 
+<!-- Previsão de ruptura -->
+<div class="panel" style="margin-bottom:20px">
+  <div class="panel-title">Previsão de Ruptura — próximos {{ horizonte }} dias</div>
+  <div class="panel-body">
+    <div style="font-size:11px;color:var(--muted);margin-bottom:6px">
+      Pelo ritmo de retiradas dos últimos meses.
+      Prazo médio Selbetti: {% if prazo_geral is not none %}{{ '%.1f'|format(prazo_geral) }} dias{% else %}sem pedidos recebidos no último ano{% endif %}.
+    </div>
+    {% if not riscos %}
+      <div style="display:flex;align-items:center;gap:8px;padding:16px 0;color:var(--muted);font-size:13px">
+        <span style="color:var(--ok);font-size:16px">✓</span> Nenhum item deve zerar no período
+      </div>
+    {% endif %}
+    {% for r in riscos %}
+    {% set atrasado = r.pedir_ate and r.pedir_ate <= hoje and r.aguardando != 1 %}
+    <div class="attn-item">
+      <span class="attn-dot" style="background:{% if atrasado or r.ruptura <= hoje %}var(--danger){% else %}var(--warn){% endif %}"></span>
+      <span class="attn-setor" title="{{ r.codigo }}">{{ r.setor }}</span>
+      <span style="font-size:11px;color:var(--muted);white-space:nowrap">{{ '%.1f'|format(r.consumo * 7) }}/semana · zera {% if r.ruptura <= hoje %}hoje{% else %}em {{ r.ruptura.strftime('%d/%m') }}{% endif %}</span>
+      {% if r.aguardando == 1 %}
+        <span class="mini-badge" style="background:var(--warn-bg);color:var(--warn);border-color:var(--warn-bd)">Pedido em trânsito</span>
+      {% elif atrasado %}
+        <span class="mini-badge" style="background:var(--danger-bg);color:var(--danger);border-color:var(--danger-bd)">Pedir já</span>
+      {% elif r.pedir_ate %}
+        <span class="mini-badge" style="background:var(--warn-bg);color:var(--warn);border-color:var(--warn-bd)">Pedir até {{ r.pedir_ate.strftime('%d/%m') }}</span>
+      {% endif %}
+    </div>
+    {% endfor %}
+  </div>
+</div>
+
+<!-- Tendências (movimentos_diarios) -->
+<div class="panel" style="margin-bottom:20px">
+  <div style="display:flex;justify-content:space-between;align-items:center;padding-right:18px">
+    <div class="panel-title">Movimentações — últimos {{ periodo }} dias{% if periodo > 30 %} (por semana){% endif %}</div>
+    <div style="display:flex;gap:6px;padding-top:10px">
+      {% for p in periodos %}<a href="{{ url_for('dashboard', periodo=p) }}" class="mini-badge" style="text-decoration:none;{% if p == periodo %}background:var(--primary);color:#fff;border-color:var(--primary){% else %}color:var(--muted);border-color:var(--border){% endif %}">{{ p }}d</a>{% endfor %}
+    </div>
+  </div>
+  <div class="panel-body">
+    <svg viewBox="0 0 {{ serie|length * 10 }} 100" preserveAspectRatio="none" style="width:100%;height:140px;display:block">
+      {% for p in serie %}
+      {% set he = (p.entradas / serie_max * 96)|round(1) %}{% set hr = (p.retiradas / serie_max * 96)|round(1) %}
+      <g><title>{{ p.inicio.strftime('%d/%m') }}: {{ p.retiradas }} retirada(s), {{ p.entradas }} entrada(s), {{ p.solicitacoes }} pedido(s)</title>
+        <rect x="{{ loop.index0 * 10 + 1 }}" y="{{ 100 - hr }}" width="4" height="{{ hr }}" style="fill:var(--danger)"></rect>
+        <rect x="{{ loop.index0 * 10 + 5 }}" y="{{ 100 - he }}" width="4" height="{{ he }}" style="fill:var(--ok)"></rect>
+      </g>
+      {% endfor %}
+    </svg>
+    <div style="display:flex;justify-content:space-between;font-size:11px;color:var(--muted);margin-top:6px">
+      <span>{{ serie[0].inicio.strftime('%d/%m') }}</span>
+      <span><span style="color:var(--danger)">■</span> Retiradas {{ serie|sum(attribute='retiradas') }} · <span style="color:var(--ok)">■</span> Entradas {{ serie|sum(attribute='entradas') }} · Pedidos {{ serie|sum(attribute='solicitacoes') }}</span>
+      <span>hoje</span>
+    </div>
+    {% if setores_periodo %}
+    <div style="margin-top:14px">
+      {% for d in setores_periodo %}
+      <div class="tbar-row">
+        <div class="tbar-setor" title="{{ d.setor }}">{{ d.setor }}</div>
+        <div class="tbar-track"><div class="tbar-fill" style="width:{{ (d.retiradas / setores_periodo[0].retiradas * 100)|round }}%;background:var(--danger)"></div></div>
+        <div class="tbar-val" style="color:var(--muted)" title="retiradas">{{ d.retiradas }}</div>
+      </div>
+      {% endfor %}
+    </div>
+    {% endif %}
+  </div>
+</div>
+
 <!-- Tinta ranking -->
 {% set com_tinta = detalhes | selectattr('tinta_pct') | list %}
 {% if com_tinta %}
@@ -919,34 +1483,35 @@ DASH_BODY = """
 
 
 
+# Previsão de ruptura (previsao.py): matriz de consumo em memória, por worker
+previsor = previsao.Previsor(ZoneInfo(TZ_LOCAL))
+
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT COALESCE(SUM(quantidade),0) FROM estoque")
-    total       = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE quantidade=0 AND aguardando=0")
-    zerados     = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE aguardando=1")
-    aguardando  = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque WHERE quantidade>=1")
-    ok_count    = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM estoque")
-    total_itens = c.fetchone()[0]
-    c.execute("SELECT id,setor,quantidade,tinta_pct FROM estoque ORDER BY quantidade ASC, setor ASC")
-    detalhes    = fetchall_dict(c)
-    conn.close()
-    pct_ok       = round(ok_count  / total_itens * 100) if total_itens else 0
-    pct_problema = round(zerados   / total_itens * 100) if total_itens else 0
-    # Toners com tinta crítica (≤ 20%) ou baixa (≤ 50%)
-    alertas_tinta = [d for d in detalhes if d["tinta_pct"] is not None and d["tinta_pct"] <= 20]
-    avisos_tinta  = [d for d in detalhes if d["tinta_pct"] is not None and 20 < d["tinta_pct"] <= 50]
-    body = render_template_string(DASH_BODY,
-        total=total, zerados=zerados, aguardando=aguardando, ok_count=ok_count,
-        total_itens=total_itens, detalhes=detalhes, pct_ok=pct_ok, pct_problema=pct_problema,
-        alertas_tinta=alertas_tinta, avisos_tinta=avisos_tinta)
-    return render_page("Dashboard", "Visão geral do estoque", "dashboard", body)
+    periodo = request.args.get("periodo", 30, type=int)
+    if periodo not in tendencias.PERIODOS:
+        abort(400)
+    with get_db() as conn:
+        versao, snap = snapshot_cache.obter(conn)
+
+        def render():
+            previsor.atualizar(conn)
+            hoje = previsor.hoje()
+            serie = tendencias.serie(conn, periodo, hoje)
+            return render_page("dashboard.html",
+                "Dashboard", "Visão geral do estoque", "dashboard",
+                total=snap.total, zerados=snap.sem_pedido, aguardando=snap.aguardando,
+                ok_count=snap.ok, total_itens=snap.total_itens, detalhes=snap.por_quantidade,
+                pct_ok=snap.pct_ok, pct_problema=snap.pct_problema,
+                alertas_tinta=snap.alertas_tinta, avisos_tinta=snap.avisos_tinta,
+                riscos=previsor.em_risco(snap.itens), prazo_geral=previsor.prazo_geral(),
+                hoje=hoje, horizonte=previsao.HORIZONTE,
+                periodo=periodo, periodos=tendencias.PERIODOS, serie=serie,
+                serie_max=max([max(p["entradas"], p["retiradas"]) for p in serie] + [1]),
+                setores_periodo=tendencias.por_setor(conn, periodo, hoje))
+        # Previsão e tendências andam com o calendário, não só com o estoque.
+        return pagina_versionada(f"dash-{previsor.hoje()}-{periodo}", versao, render)
 
 # ── Usuários (admin) ──────────────────────────
 USR_BODY = """
@@ -1000,14 +1565,13 @@ USR_BODY = """
 @login_required
 @admin_required
 def usuarios():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM usuarios ORDER BY nome")
-    rows = fetchall_dict(c)
-    conn.close()
-    body = render_template_string(USR_BODY, usuarios=rows,
-        url_for=url_for, current_user=current_user)
-    return render_page("Usuários", "Gerenciamento de acesso", "usuarios", body)
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM usuarios ORDER BY nome")
+        rows = fetchall_dict(c)
+    return render_page("usuarios.html",
+        "Usuários", "Gerenciamento de acesso", "usuarios",
+        usuarios=rows)
 
 @app.route("/usuarios/criar", methods=["POST"])
 @login_required
@@ -1020,13 +1584,11 @@ def criar_usuario():
     if len(password) < 6:
         return redirect(url_for("usuarios"))
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO usuarios (username,password,nome,is_admin) VALUES (%s,%s,%s,%s)",
-            (username, generate_password_hash(password), nome, is_admin)
-        )
-        conn.commit(); conn.close()
+        with get_db() as conn:
+            conn.cursor().execute(
+                "INSERT INTO usuarios (username,password,nome,is_admin) VALUES (%s,%s,%s,%s)",
+                (username, hash_senha(password), nome, is_admin)
+            )
     except Exception:
         pass
     return redirect(url_for("usuarios"))
@@ -1035,11 +1597,405 @@ def criar_usuario():
 @login_required
 @admin_required
 def excluir_usuario(id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("DELETE FROM usuarios WHERE id=%s", (id,))
-    conn.commit(); conn.close()
+    with get_db() as conn:
+        conn.cursor().execute("DELETE FROM usuarios WHERE id=%s", (id,))
     return redirect(url_for("usuarios"))
 
+# ── API JSON (v1) ─────────────────────────────
+# Autenticação: a sessão do navegador ou "Authorization: Bearer <token>".
+# Tokens são criados com `flask api-token-criar`; só o sha256 fica no banco.
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+API_LOTE_MAX     = int(os.environ.get("API_LOTE_MAX", 1000))   # movimentos por requisição
+API_HIST_MAX     = 500                                         # registros por página
+_API_PREFIXO     = "toner_"
+
+def _hash_token(token):
+    # Tokens têm 256 bits aleatórios: sha256 basta (não precisa de scrypt)
+    return hashlib.sha256(token.encode()).hexdigest()
+
+@login_manager.request_loader
+def _usuario_do_token(req):
+    if req.blueprint != "api":
+        return None
+    tipo, _, token = req.headers.get("Authorization", "").partition(" ")
+    if tipo.lower() != "bearer" or not token.strip():
+        return None
+    with get_db() as conn:
+        c = conn.cursor()
+        if SQLITE:
+            return _usuario_do_token_sqlite(c, _hash_token(token.strip()))
+        c.execute(SQL_USUARIO_DO_TOKEN, (_hash_token(token.strip()),))
+        row = fetchone_dict(c)
+    return User(row) if row else None
+
+# Uma ida ao banco: busca o usuário e registra o uso (no máximo a cada 5 min)
+SQL_USUARIO_DO_TOKEN = """
+    WITH t AS (SELECT id, usuario_id FROM api_tokens WHERE hash = %s),
+    uso AS (
+        UPDATE api_tokens SET ultimo_uso = now()
+        WHERE id = (SELECT id FROM t)
+          AND (ultimo_uso IS NULL OR ultimo_uso < now() - interval '5 minutes')
+    )
+    SELECT u.id, u.username, u.nome, u.is_admin
+    FROM t JOIN usuarios u ON u.id = t.usuario_id
+"""
+
+def _usuario_do_token_sqlite(c, hash_token):
+    # Sem UPDATE dentro de WITH: registra o uso e depois busca o usuário.
+    c.execute("""
+        UPDATE api_tokens SET ultimo_uso = now()
+        WHERE hash = %s AND (ultimo_uso IS NULL OR ultimo_uso < %s)
+    """, (hash_token, datetime.now(ZoneInfo("UTC")) - timedelta(minutes=5)))
+    c.execute("""
+        SELECT u.id, u.username, u.nome, u.is_admin
+        FROM api_tokens t JOIN usuarios u ON u.id = t.usuario_id
+        WHERE t.hash = %s
+    """, (hash_token,))
+    row = fetchone_dict(c)
+    return User(row) if row else None
+
+def _api_erro(status, mensagem, **extra):
+    resp = jsonify(erro=mensagem, **extra)
+    resp.status_code = status
+    if status == 401:
+        resp.headers["WWW-Authenticate"] = 'Bearer realm="api"'
+    return resp
+
+@app.errorhandler(HTTPException)
+def _api_erro_http(e):
+    # No app (não no blueprint) para cobrir também 404/405 de rotas inexistentes
+    if request.path.startswith(api.url_prefix + "/"):
+        return _api_erro(e.code, e.description)
+    return e
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return _api_erro(401, "Autenticação necessária (sessão ou Bearer token).")
+        return f(*args, **kwargs)
+    return decorated
+
+def _registro_json(r):
+    return {**r, "criado_em": r["criado_em"].isoformat()}
+
+@api.route("/estoque")
+@api_login_required
+def api_estoque():
+    with get_db() as conn:
+        versao, snap = snapshot_cache.obter(conn)
+    return pagina_versionada("api-estoque", versao, lambda: jsonify(
+        versao=versao, total=snap.total, total_itens=snap.total_itens, itens=snap.itens))
+
+@api.route("/estoque/<int:id>")
+@api_login_required
+def api_estoque_item(id):
+    # Leitura direta pela chave: usado pelos modais do inventário, não
+    # precisa carregar o Snapshot inteiro.
+    with get_db() as conn:
+        versao = versao_estoque(conn)
+        c = conn.cursor()
+        c.execute(SQL_ITEM, (id,))
+        row = fetchone_dict(c)
+    if row is None:
+        return _api_erro(404, f"Item {id} não encontrado.")
+    item = {**row, "status": calcular_status(row["quantidade"], row["aguardando"])}
+    return pagina_versionada(f"api-item{id}", versao, lambda: jsonify(item))
+
+@api.route("/historico")
+@api_login_required
+def api_historico():
+    filtros = {k: request.args[k] for k in HIST_FILTROS if request.args.get(k)}
+    try:
+        limite = max(1, min(int(request.args.get("limite", HIST_POR_PAGINA)), API_HIST_MAX))
+        with get_db() as conn:
+            rows, proximo = buscar_historico(conn, filtros, request.args.get("cursor"), limite)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return _api_erro(400, "Filtro, limite ou cursor inválido.")
+    return jsonify(registros=[_registro_json(r) for r in rows], proximo=proximo)
+
+def _validar_movimento(mov):
+    """{"id", "tipo", "valor"?, "versao"?} -> (id, tipo, valor, versao);
+    ValueError com a mensagem."""
+    if not isinstance(mov, dict):
+        raise ValueError("movimento deve ser um objeto")
+    tipo, estoque_id, valor = mov.get("tipo"), mov.get("id"), mov.get("valor")
+    versao = mov.get("versao")
+    if tipo not in MOVIMENTOS:
+        raise ValueError(f"tipo inválido: {tipo!r} (use {', '.join(MOVIMENTOS)})")
+    if not isinstance(estoque_id, int) or isinstance(estoque_id, bool):
+        raise ValueError("id deve ser um inteiro")
+    if versao is not None and (not isinstance(versao, int) or isinstance(versao, bool)):
+        raise ValueError("versao deve ser um inteiro (a lida em GET /estoque/<id>)")
+    if tipo == "tinta":
+        if valor is not None and (not isinstance(valor, int) or isinstance(valor, bool)
+                                  or not 0 <= valor <= 100):
+            raise ValueError("valor da tinta deve ser um inteiro de 0 a 100 (ou null)")
+    elif tipo == "observacao":
+        if not isinstance(valor, str):
+            raise ValueError("valor da observação deve ser texto")
+        valor = valor.strip()
+    elif valor is not None:
+        raise ValueError(f"{tipo} não aceita valor")
+    return estoque_id, tipo, valor, versao
+
+@api.route("/movimentos", methods=["POST"])
+@api_login_required
+def api_movimentos():
+    """Aplica uma lista de movimentos numa transação, com resultado por item.
+
+    Corpo: [{"id": 3, "tipo": "mais"}, {"id": 4, "tipo": "tinta", "valor": 40}, ...]
+    ou {"movimentos": [...], "atomico": true}. Sem `atomico`, os itens
+    válidos são gravados e os demais voltam com "ok": false; com `atomico`,
+    qualquer falha desfaz o lote inteiro (422 se inválido, 409 se sem efeito
+    ou em conflito). "versao" (opcional) é a versão do item que o cliente
+    leu: se mudou, o movimento volta com "conflito": true e o item "atual".
+    """
+    try:
+        atomico, resultados, validos = ler_lote(request.get_json(silent=True))
+    except LoteInvalido as e:
+        return _api_erro(e.status, e.mensagem, **e.extra)
+
+    inicio = time.perf_counter()
+    with get_db() as conn:
+        for i, estoque_id, tipo, valor, versao in validos:
+            try:
+                row = movimentar(conn, estoque_id, tipo, valor, versao=versao)
+            except ConflitoVersao as e:
+                resultados[i] = resultado_movimento(i, estoque_id, tipo, conflito=e.atual)
+            else:
+                resultados[i] = resultado_movimento(i, estoque_id, tipo, row)
+        aplicados = sum(r["ok"] for r in resultados)
+        desfeito = atomico and aplicados < len(resultados)
+        if desfeito:
+            conn.rollback()
+    app.logger.info("API: lote de %d movimentos (%d aplicados%s) em %.1f ms", len(resultados),
+                    aplicados, ", desfeito" if desfeito else "", (time.perf_counter() - inicio) * 1000)
+    if desfeito:
+        return _api_erro(409, LOTE_DESFEITO, resultados=resultados)
+    return jsonify(aplicados=aplicados, falhas=len(resultados) - aplicados, resultados=resultados)
+
+# ── Lote de movimentos (também usado pelo modo ASGI, asgi.py) ──
+LOTE_DESFEITO = "Algum movimento não teve efeito; o lote foi desfeito."
+
+class LoteInvalido(Exception):
+    """Corpo de POST /movimentos que não chega a ser aplicado."""
+
+    def __init__(self, status, mensagem, **extra):
+        super().__init__(mensagem)
+        self.status, self.mensagem, self.extra = status, mensagem, extra
+
+def ler_lote(corpo):
+    """JSON do corpo -> (atomico, resultados, validos).
+
+    `resultados` já traz os movimentos inválidos (os demais ficam None até
+    serem aplicados); `validos` são (indice, id, tipo, valor, versao).
+    """
+    atomico = False
+    if isinstance(corpo, dict):
+        atomico = bool(corpo.get("atomico"))
+        corpo = corpo.get("movimentos")
+    if not isinstance(corpo, list) or not corpo:
+        raise LoteInvalido(400, "Envie uma lista JSON de movimentos.")
+    if len(corpo) > API_LOTE_MAX:
+        raise LoteInvalido(413, f"No máximo {API_LOTE_MAX} movimentos por requisição.")
+
+    resultados = [None] * len(corpo)
+    validos = []
+    for i, mov in enumerate(corpo):
+        try:
+            validos.append((i, *_validar_movimento(mov)))
+        except ValueError as e:
+            resultados[i] = {"indice": i, "ok": False, "erro": str(e)}
+    if atomico and len(validos) < len(corpo):
+        raise LoteInvalido(422, "Lote inválido; nada foi aplicado.", resultados=resultados)
+    return atomico, resultados, validos
+
+def resultado_movimento(i, estoque_id, tipo, row=None, conflito=None):
+    if conflito is not None:
+        return {"indice": i, "id": estoque_id, "tipo": tipo, "ok": False,
+                "erro": f"conflito: o item está na versão {conflito['versao']}",
+                "conflito": True, "item": None, "atual": conflito}
+    return {"indice": i, "id": estoque_id, "tipo": tipo, "ok": row is not None,
+            "erro": None if row else "sem efeito (item inexistente ou estoque zerado)",
+            "item": row}
+
+app.register_blueprint(api)
+
+@app.cli.command("api-token-criar")
+@click.argument("username")
+@click.option("--nome", default="", help="Identificação do token (ex.: script do helpdesk).")
+def cli_api_token_criar(username, nome):
+    """Cria um token da API para o usuário (mostrado uma única vez)."""
+    token = _API_PREFIXO + secrets.token_urlsafe(32)
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO api_tokens (usuario_id, nome, hash)
+            SELECT id, %s, %s FROM usuarios WHERE username = %s RETURNING id
+        """, (nome, _hash_token(token), username))
+        row = c.fetchone()
+    if row is None:
+        raise click.ClickException(f"Usuário {username!r} não existe.")
+    click.echo(f"Token {row[0]} criado. Guarde-o; ele não será mostrado de novo:\n{token}")
+
+@app.cli.command("api-token-listar")
+def cli_api_token_listar():
+    """Lista os tokens da API (sem o segredo)."""
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT t.id, u.username, t.nome, t.criado_em, t.ultimo_uso
+            FROM api_tokens t JOIN usuarios u ON u.id = t.usuario_id ORDER BY t.id
+        """)
+        for id_, username, nome, criado, uso in c.fetchall():
+            click.echo(f"{id_:4d}  {username:16} {nome or '—':24} criado {datahora(criado)}"
+                       f"  último uso {datahora(uso) or 'nunca'}")
+
+@app.cli.command("api-token-revogar")
+@click.argument("token_id", type=int)
+def cli_api_token_revogar(token_id):
+    """Revoga (apaga) um token da API."""
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM api_tokens WHERE id = %s", (token_id,))
+        if c.rowcount == 0:
+            raise click.ClickException(f"Token {token_id} não existe.")
+    click.echo(f"Token {token_id} revogado.")
+
+# ══════════════════════════════════════════════
+#  Templates — compilados uma vez no carregamento do módulo
+# ══════════════════════════════════════════════
+def _pagina(corpo):
+    return '{% extends "layout.html" %}{% block content %}' + corpo + '{% endblock %}'
+
+TEMPLATES = {
+    "layout.html":     LAYOUT,
+    "login.html":      LOGIN_HTML,
+    "_inventario.html": LINHA_ESTOQUE,
+    "inventario.html": _pagina(INV_BODY),
+    "historico.html":  _pagina(HIST_BODY),
+    "dashboard.html":  _pagina(DASH_BODY),
+    "usuarios.html":   _pagina(USR_BODY),
+    "importar.html":   _pagina(CSV_BODY),
+}
+
+# CSS, fontes e logo vêm de static/ com nome versionado (ver assets.py)
+# O login não pré-carrega as fontes: é a primeira página num link lento e o
+# texto dele não espera por elas (font-display: swap).
+ASSETS_HEAD = """{% if not sem_preload %}{% for f in fontes_locais() %}<link rel="preload" href="{{ f }}" as="font" type="font/woff2" crossorigin>
+{% endfor %}{% endif %}<link rel="stylesheet" href="{{ asset('css/app.css') }}">"""
+
+app.jinja_loader = DictLoader({**TEMPLATES, "_assets_head.html": ASSETS_HEAD})
+app.jinja_env.globals.update(asset=assets.url, logo_url=assets.logo_url,
+                             fontes_locais=assets.fontes_locais)
+for _nome in TEMPLATES:
+    app.jinja_env.get_template(_nome)
+
+# ── Monitoramento ─────────────────────────────
+# Métricas por rota (metricas.py); a rota é o endpoint do Flask, para o
+# número de séries não depender das URLs acessadas.
+def _rota():
+    return (request.endpoint or "-") if has_request_context() else "-"
+
+def _observar_sql(sql, segundos, linhas, rota=None):
+    rota = rota or _rota()
+    metricas.registro.observar("toner_db_consulta_duracao_segundos", segundos, rota=rota)
+    if segundos >= metricas.LENTA_S:
+        metricas.registro.contar("toner_db_consultas_lentas_total", rota=rota)
+        perfil.consulta_lenta(sql, segundos, linhas, rota=rota)
+
+observadores_sql.append(_observar_sql)
+if perfil.ATIVO:
+    observadores_sql.append(perfil.observar_sql)
+    observadores_conexao.append(perfil.observar_conexao)
+
+def _coletar_processo(reg):
+    p = pool_stats()
+    reg.definir("toner_db_conexoes_abertas_total", p["abertas"])
+    reg.definir("toner_db_pool_timeouts_total", p["timeouts"])
+    reg.definir("toner_db_pool_emprestadas", p["emprestadas"])
+    reg.definir("toner_db_pool_abertas", p["abertas_agora"])
+    reg.definir("toner_sse_clientes", eventos.conectados())
+    h = auditoria.gravador.stats()
+    reg.definir("toner_historico_fila", h["fila"])
+    reg.definir("toner_historico_gravadas_total", h["gravadas"])
+    reg.definir("toner_historico_fila_cheia_total", h["cheia"])
+
+metricas.registro.coletores.append(_coletar_processo)
+
+@app.before_request
+def _metricas_inicio():
+    g.metricas_inicio = time.perf_counter()
+    if perfil.ATIVO:
+        perfil.iniciar()
+
+@app.after_request
+def _metricas_fim(resp):
+    # Também roda para respostas de erro (500 incluso). Em rotas de streaming
+    # (/eventos, CSV) mede até o início do corpo.
+    inicio = g.pop("metricas_inicio", None)
+    if inicio is not None:
+        rota = _rota()
+        metricas.registro.observar("toner_http_duracao_segundos", time.perf_counter() - inicio, rota=rota)
+        metricas.registro.contar("toner_http_requisicoes_total", rota=rota,
+                                 metodo=request.method, status=resp.status_code)
+        metricas.registro.gravar()
+    p = perfil.encerrar()
+    if p is not None:
+        resp.headers["Server-Timing"] = p.server_timing()
+        perfil.avaliar(p, rota=_rota(), metodo=request.method, url=request.full_path.rstrip("?"),
+                       status=resp.status_code)
+    return resp
+
+@app.teardown_request
+def _perfil_descartar(exc):
+    perfil.encerrar()     # requisição que não chegou ao after_request
+
+METRICAS_TOKEN = os.environ.get("METRICAS_TOKEN")
+
+@app.route("/metrics")
+def metricas_prometheus():
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if METRICAS_TOKEN:
+        if not hmac.compare_digest(token.encode(), METRICAS_TOKEN.encode()):
+            abort(401)
+    elif not (current_user.is_authenticated and current_user.is_admin):
+        abort(401)
+    # Contadores do estoque: versão + Snapshot em cache, em geral uma consulta.
+    with get_db() as conn:
+        _, snap = snapshot_cache.obter(conn)
+    texto = metricas.exposicao(*metricas.registro.coletar(), extra={
+        "toner_estoque_unidades":      snap.total,
+        "toner_estoque_itens":         snap.total_itens,
+        "toner_estoque_ok":            snap.ok,
+        "toner_estoque_zerados":       snap.zerados,
+        "toner_estoque_sem_pedido":    snap.sem_pedido,
+        "toner_estoque_aguardando":    snap.aguardando,
+        "toner_estoque_tinta_critica": len(snap.alertas_tinta),
+    })
+    return Response(texto, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/admin/pool")
+@login_required
+@admin_required
+def status_pool():
+    return jsonify(pool_stats())
+
+@app.route("/admin/caches")
+@login_required
+@admin_required
+def status_caches():
+    return jsonify({
+        "usuarios": user_cache.stats(),
+        "snapshot": {"hits": snapshot_cache.hits, "misses": snapshot_cache.misses},
+        "ouvinte":  {"conectado": ouvinte.conectado, "recebidas": ouvinte.recebidas},
+        "eventos":  difusor.stats(),
+        "eventos_asgi": eventos.difusor_async.stats(),
+        "previsao": previsor.stats(),
+        "historico": auditoria.gravador.stats(),
+    })
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,479 @@
+"""
+Modo ASGI: o mesmo app servido por um event loop, para muitos clientes
+ociosos (SSE) e consultas lentas sem prender uma thread por requisição.
+
+As rotas de leitura e de ação rodam como corrotinas, num pool asyncpg:
+
+    /eventos                                  SSE (eventos.DifusorAsync)
+    /api/v1/estoque, /api/v1/estoque/<id>     mesma ETag/304 do Flask
+    /api/v1/historico
+    /mais, /menos, /solicitar, /recebido, /observacao, /tinta
+    POST /api/v1/movimentos
+
+O resto (páginas, login, CSV, admin, /metrics) continua no Flask, chamado
+numa thread pelo WSGIMiddleware (a2wsgi). Comandos, regras de movimento,
+sessão e cache de usuários são os do app.py, e a entrada WSGI (gunicorn
+app:app) continua valendo. Sem sessão/token válido, ou com formulário que
+não é urlencoded, a rota passa a requisição ao Flask, que responde como
+sempre (redirect para o login, 401 da API). PERFIL_SQL só vale nas rotas
+do Flask.
+
+Só PostgreSQL: com DATABASE_URL=sqlite:... o Flask atende tudo.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+
+    ASGI_POOL_MIN    conexões asyncpg mantidas abertas          (padrão 1)
+    ASGI_POOL_MAX    limite de conexões asyncpg por processo    (padrão 10)
+    ASGI_THREADS     threads para as rotas do Flask             (padrão 32)
+
+DB_POOL_TIMEOUT também limita a espera por conexão do asyncpg (503), e
+HISTORICO_GRAVACAO=lote (auditoria.py) vale também para as ações daqui.
+"""
+
+import asyncio
+import binascii
+import functools
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import parse_qsl
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.test import EnvironBuilder
+
+import app as toner
+import auditoria
+import eventos
+import metricas
+import stats
+from db import DATABASE_URL, SQLITE, PoolTimeout, ouvinte
+from stats import cache as snapshot_cache, calcular_status
+
+log = logging.getLogger("toner.asgi")
+
+POOL_MIN = int(os.environ.get("ASGI_POOL_MIN", 1))
+POOL_MAX = int(os.environ.get("ASGI_POOL_MAX", 10))
+THREADS  = int(os.environ.get("ASGI_THREADS", 32))
+TIMEOUT  = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+
+# Rotas que não são corrotinas, e o fallback das que são.
+flask_app = WSGIMiddleware(toner.app, workers=THREADS)
+
+_pool = None
+
+
+# ─────────────────────────────────────────────
+#  Banco (asyncpg)
+# ─────────────────────────────────────────────
+_PARAMETRO = re.compile(r"%\((\w+)\)s|%s|%%")
+
+@functools.lru_cache(maxsize=256)
+def _posicional(sql):
+    """SQL no estilo do psycopg2 (%s, %(nome)s) -> ($1..$n, chaves dos parâmetros)."""
+    chaves = []
+    def trocar(m):
+        if m.group(0) == "%%":
+            return "%"
+        chave = m.group(1)
+        if chave is None:             # %s: pela posição
+            chaves.append(len(chaves))
+            return f"${len(chaves)}"
+        if chave not in chaves:
+            chaves.append(chave)
+        return f"${chaves.index(chave) + 1}"
+    return _PARAMETRO.sub(trocar, sql), tuple(chaves)
+
+async def _executar(conn, metodo, sql, params=(), rota="-"):
+    """conn.fetch/fetchrow/fetchval com os comandos e parâmetros do app.py,
+    medido como os do get_db() (métricas e log de consultas lentas)."""
+    sql_pg, chaves = _posicional(sql)
+    inicio = time.perf_counter()
+    resultado = await getattr(conn, metodo)(sql_pg, *(params[k] for k in chaves))
+    linhas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+    toner._observar_sql(sql, time.perf_counter() - inicio, linhas, rota=rota)
+    return resultado
+
+@asynccontextmanager
+async def _conexao():
+    try:
+        conn = await _pool.acquire(timeout=TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout(f"Nenhuma conexão asyncpg livre em {TIMEOUT}s") from None
+    try:
+        yield conn
+    finally:
+        await _pool.release(conn)
+
+class _Desfazer(Exception):
+    """Sai de conn.transaction() com rollback, sem ser um erro."""
+
+
+# ─────────────────────────────────────────────
+#  Equivalentes assíncronos do app.py
+# ─────────────────────────────────────────────
+@contextmanager
+def _historico():
+    """Linhas de histórico de uma transação do asyncpg, no modo em lote
+    (auditoria.py): vão para a fila se ela confirmar, liberam a vaga se não.
+    None no modo síncrono."""
+    if not auditoria.LOTE:
+        yield None
+        return
+    pendentes = []
+    try:
+        yield pendentes
+    except BaseException:
+        auditoria.gravador.descartar(pendentes)
+        raise
+    auditoria.gravador.entregar(pendentes)
+
+async def _movimentar(conn, estoque_id, tipo, valor, usuario, versao, rota, pendentes=None):
+    """movimentar() no asyncpg: o mesmo comando único do PostgreSQL. Com
+    `pendentes` (_historico()) e vaga na fila, só o UPDATE; a linha de
+    histórico vai para a lista."""
+    # Sem esperar vaga, que pararia o event loop: fila cheia, comando único.
+    em_lote = pendentes is not None and auditoria.gravador.reservar()
+    sql, params, checar = toner.comando_movimento(estoque_id, tipo, valor, usuario, versao,
+                                                  historico=not em_lote)
+    try:
+        row = await _executar(conn, "fetchrow", sql, params, rota)
+        if row is None and checar:
+            atual = await _executar(conn, "fetchrow", toner.SQL_ITEM, (estoque_id,), rota)
+            if atual is not None:
+                raise toner.ConflitoVersao(dict(atual))
+    except BaseException:
+        if em_lote:
+            auditoria.gravador.liberar(1)
+        raise
+    if em_lote:
+        if row is None:
+            auditoria.gravador.liberar(1)
+        else:
+            pendentes.append(toner.linha_historico(row, params))
+    return dict(row) if row is not None else None
+
+async def _totais(conn, rota):
+    versao, *valores = await _executar(conn, "fetchrow", stats.SQL_TOTAIS, rota=rota)
+    return versao or 0, dict(zip(stats.CAMPOS_TOTAIS, valores))
+
+async def _versao_estoque(conn, rota):
+    return await _executar(conn, "fetchval", stats.SQL_VERSAO, rota=rota) or 0
+
+# Sessão do Flask (cookie assinado com app.secret_key), lida como o flask-login lê.
+_sessao = toner.app.session_interface.get_signing_serializer(toner.app)
+
+def _id_da_sessao(request):
+    cookie = request.cookies.get(toner.app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+    try:
+        dados = _sessao.loads(cookie, max_age=int(toner.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return dados.get("_user_id")
+
+async def _usuario(request, api, rota):
+    """User da sessão (via user_cache) ou, na API, do Bearer token; None sem login."""
+    user_id = _id_da_sessao(request)
+    if user_id is not None:
+        user, geracao = toner.user_cache.consultar(str(user_id))
+        if user is None:
+            async with _conexao() as conn:
+                row = await _executar(conn, "fetchrow", toner.SQL_USUARIO, (int(user_id),), rota)
+            user = toner.User(row) if row else None
+            toner.user_cache.guardar(str(user_id), user, geracao)
+        if user is not None:
+            return user
+    if api:
+        tipo, _, token = request.headers.get("authorization", "").partition(" ")
+        if tipo.lower() == "bearer" and token.strip():
+            async with _conexao() as conn:
+                row = await _executar(conn, "fetchrow", toner.SQL_USUARIO_DO_TOKEN,
+                                      (toner._hash_token(token.strip()),), rota)
+            return toner.User(row) if row else None
+    return None
+
+
+# ─────────────────────────────────────────────
+#  Respostas
+# ─────────────────────────────────────────────
+def _json(dados, status=200):
+    return Response(toner.app.json.dumps(dados, separators=(",", ":")), status,
+                    media_type="application/json")
+
+def _api_erro(status, mensagem, **extra):
+    return _json({"erro": mensagem, **extra}, status)
+
+def _versionada(request, nome, versao, user, render):
+    """pagina_versionada() do app.py: ETag forte, 304 se o cliente já tem a versão."""
+    etag = toner.etag_pagina(nome, versao, user)
+    if parse_etags(request.headers.get("if-none-match")).contains(etag):
+        resp = Response(status_code=304)
+    else:
+        resp = render()
+    resp.headers["ETag"] = f'"{etag}"'
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def _quer_json(request):
+    aceita = parse_accept_header(request.headers.get("accept"), MIMEAccept)
+    return aceita.best_match(["text/html", "application/json"]) == "application/json"
+
+def _linha_json(request, row):
+    # O template da linha usa url_for: precisa de um contexto de requisição.
+    raiz = f"{request.url.scheme}://{request.url.netloc}{request.scope.get('root_path', '')}"
+    with toner.app.request_context(EnvironBuilder(base_url=raiz).get_environ()):
+        return toner.linha_json(row)
+
+async def _formulario(request):
+    """Campos do formulário urlencoded; None se veio em outro formato
+    (multipart), que fica com o Flask."""
+    tipo = request.headers.get("content-type", "")
+    if not tipo.startswith("application/x-www-form-urlencoded"):
+        return None
+    return dict(parse_qsl((await request.body()).decode("utf-8", "replace"),
+                          keep_blank_values=True))
+
+
+def _nativa(endpoint, api=False):
+    """Corrotina fn(request, user, rota) como rota do Starlette.
+
+    Exige login (sem ele, o Flask responde) e mede como o Flask: mesmas
+    métricas, com o endpoint do Flask como rota. Se fn devolver flask_app,
+    a requisição segue para o Flask.
+    """
+    def decorador(fn):
+        @functools.wraps(fn)
+        async def rota(request):
+            inicio = time.perf_counter()
+            try:
+                user = await _usuario(request, api, endpoint)
+                if user is None:
+                    return flask_app
+                resp = await fn(request, user, endpoint)
+            except PoolTimeout:
+                resp = Response("Servidor ocupado. Tente novamente.", 503, {"Retry-After": "1"})
+            if resp is not flask_app:
+                metricas.registro.observar("toner_http_duracao_segundos",
+                                           time.perf_counter() - inicio, rota=endpoint)
+                metricas.registro.contar("toner_http_requisicoes_total", rota=endpoint,
+                                         metodo=request.method, status=resp.status_code)
+                metricas.registro.gravar()
+            return resp
+        return rota
+    return decorador
+
+
+# ══════════════════════════════════════════════
+#  Rotas
+# ══════════════════════════════════════════════
+
+# ── Ações ─────────────────────────────────────
+async def _acao(request, user, rota, tipo, valor=None, destino=None, form=None):
+    """_acao() do app.py: redirect na navegação comum; com Accept JSON, a
+    linha atualizada e os totais (409 com a linha atual em conflito)."""
+    lida = {**request.query_params, **(form or {})}.get("versao", "")
+    json_ = _quer_json(request)
+    conflito = None
+    with _historico() as pendentes:
+        async with _conexao() as conn, conn.transaction():
+            try:
+                row = await _movimentar(conn, request.path_params["id"], tipo, valor, user.nome,
+                                        int(lida) if lida.isdigit() else None, rota, pendentes)
+            except toner.ConflitoVersao as e:
+                row, conflito = None, e.atual
+            if json_:
+                versao, tot = await _totais(conn, rota)
+    if not json_:
+        return RedirectResponse(destino or request.scope.get("root_path", "") + "/", 302)
+    if conflito is not None:
+        item, html = _linha_json(request, conflito)
+        return _json({"ok": False, "conflito": True, "item": item, "html": html, "versao": versao,
+                      "stats": tot, "erro": toner.ACAO_CONFLITO}, 409)
+    if row is None:
+        return _json({"ok": False, "erro": toner.ACAO_SEM_EFEITO, "versao": versao, "stats": tot}, 409)
+    item, html = _linha_json(request, row)
+    return _json({"ok": True, "item": item, "html": html, "versao": versao, "stats": tot})
+
+@_nativa("mais")
+async def mais(request, user, rota):
+    return await _acao(request, user, rota, "mais")
+
+@_nativa("menos")
+async def menos(request, user, rota):
+    return await _acao(request, user, rota, "menos")
+
+@_nativa("solicitar")
+async def solicitar(request, user, rota):
+    return await _acao(request, user, rota, "solicitar", destino="https://selbetti.com.br/")
+
+@_nativa("recebido")
+async def recebido(request, user, rota):
+    return await _acao(request, user, rota, "recebido")
+
+@_nativa("observacao")
+async def observacao(request, user, rota):
+    form = await _formulario(request)
+    if form is None:
+        return flask_app
+    return await _acao(request, user, rota, "observacao", form.get("observacao", "").strip(), form=form)
+
+@_nativa("tinta")
+async def tinta(request, user, rota):
+    form = await _formulario(request)
+    if form is None:
+        return flask_app
+    return await _acao(request, user, rota, "tinta", toner.valor_tinta(form.get("tinta_pct", "100")),
+                       form=form)
+
+# ── Eventos ao vivo (SSE) ─────────────────────
+@_nativa("eventos_estoque")
+async def eventos_estoque(request, user, rota):
+    fila = eventos.difusor_async.conectar()
+    if fila is None:
+        return Response("retry: 60000\n\n", media_type="text/event-stream")
+    inicial = ()
+    ultimo = request.headers.get("last-event-id") or request.query_params.get("v")
+    if ultimo:
+        try:
+            async with _conexao() as conn:
+                atual = await _versao_estoque(conn, rota)
+        except BaseException:
+            eventos.difusor_async.desconectar(fila)
+            raise
+        if str(atual) != ultimo:
+            inicial = (eventos.mensagem("recarregar", {}, atual),)
+    return StreamingResponse(eventos.difusor_async.transmitir(fila, inicial),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ── API JSON (v1) ─────────────────────────────
+@_nativa("api.api_estoque", api=True)
+async def api_estoque(request, user, rota):
+    async with _conexao() as conn:
+        versao = await _versao_estoque(conn, rota)
+        snap = snapshot_cache.consultar(versao)
+        if snap is None:
+            rows = await _executar(conn, "fetch", stats.SQL_ESTOQUE, rota=rota)
+            snap = stats.montar_snapshot(dict(r) for r in rows)
+            snapshot_cache.guardar(versao, snap)
+    return _versionada(request, "api-estoque", versao, user, lambda: _json({
+        "versao": versao, "total": snap.total, "total_itens": snap.total_itens, "itens": snap.itens}))
+
+@_nativa("api.api_estoque_item", api=True)
+async def api_estoque_item(request, user, rota):
+    id_ = request.path_params["id"]
+    async with _conexao() as conn:
+        versao = await _versao_estoque(conn, rota)
+        row = await _executar(conn, "fetchrow", toner.SQL_ITEM, (id_,), rota)
+    if row is None:
+        return _api_erro(404, f"Item {id_} não encontrado.")
+    item = {**row, "status": calcular_status(row["quantidade"], row["aguardando"])}
+    return _versionada(request, f"api-item{id_}", versao, user, lambda: _json(item))
+
+@_nativa("api.api_historico", api=True)
+async def api_historico(request, user, rota):
+    args = request.query_params
+    filtros = {k: args[k] for k in toner.HIST_FILTROS if args.get(k)}
+    try:
+        limite = max(1, min(int(args.get("limite", toner.HIST_POR_PAGINA)), toner.API_HIST_MAX))
+        sql, params = toner.consulta_historico(filtros, args.get("cursor"), limite)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return _api_erro(400, "Filtro, limite ou cursor inválido.")
+    async with _conexao() as conn:
+        rows = await _executar(conn, "fetch", sql, params, rota)
+    registros, proximo = toner.pagina_historico([dict(r) for r in rows], limite)
+    return _json({"registros": [toner._registro_json(r) for r in registros], "proximo": proximo})
+
+@_nativa("api.api_movimentos", api=True)
+async def api_movimentos(request, user, rota):
+    corpo = None
+    tipo = request.headers.get("content-type", "").split(";")[0].strip()
+    if tipo == "application/json" or tipo.endswith("+json"):      # como get_json(silent=True)
+        try:
+            corpo = json.loads(await request.body())
+        except ValueError:
+            pass
+    try:
+        atomico, resultados, validos = toner.ler_lote(corpo)
+    except toner.LoteInvalido as e:
+        return _api_erro(e.status, e.mensagem, **e.extra)
+
+    inicio = time.perf_counter()
+    desfeito = False
+    try:
+        with _historico() as pendentes:
+            async with _conexao() as conn, conn.transaction():
+                for i, estoque_id, tipo, valor, versao in validos:
+                    try:
+                        row = await _movimentar(conn, estoque_id, tipo, valor, user.nome, versao,
+                                                rota, pendentes)
+                    except toner.ConflitoVersao as e:
+                        resultados[i] = toner.resultado_movimento(i, estoque_id, tipo, conflito=e.atual)
+                    else:
+                        resultados[i] = toner.resultado_movimento(i, estoque_id, tipo, row)
+                aplicados = sum(r["ok"] for r in resultados)
+                if atomico and aplicados < len(resultados):
+                    desfeito = True
+                    raise _Desfazer
+    except _Desfazer:
+        pass
+    toner.app.logger.info("API: lote de %d movimentos (%d aplicados%s) em %.1f ms", len(resultados),
+                          aplicados, ", desfeito" if desfeito else "",
+                          (time.perf_counter() - inicio) * 1000)
+    if desfeito:
+        return _api_erro(409, toner.LOTE_DESFEITO, resultados=resultados)
+    return _json({"aplicados": aplicados, "falhas": len(resultados) - aplicados,
+                  "resultados": resultados})
+
+
+# ─────────────────────────────────────────────
+#  Aplicação
+# ─────────────────────────────────────────────
+@asynccontextmanager
+async def _ciclo(_app):
+    global _pool
+    _pool = await asyncpg.create_pool(DATABASE_URL, min_size=POOL_MIN, max_size=POOL_MAX)
+    ouvinte.garantir()          # NOTIFY -> user_cache e eventos, como no Flask
+    log.info("ASGI: pool asyncpg (%d–%d conexões), %d threads para o Flask",
+             POOL_MIN, POOL_MAX, THREADS)
+    try:
+        yield
+    finally:
+        await _pool.close()
+        if auditoria.LOTE:
+            await asyncio.to_thread(auditoria.gravador.esvaziar)
+        metricas.registro.encerrar()     # sem child_exit no uvicorn (ver metricas.py)
+
+API = toner.api.url_prefix
+
+ROTAS = [
+    Route("/mais/{id:int}",                 mais),
+    Route("/menos/{id:int}",                menos),
+    Route("/solicitar/{id:int}",            solicitar),
+    Route("/recebido/{id:int}",             recebido),
+    Route("/observacao/{id:int}",           observacao, methods=["POST"]),
+    Route("/tinta/{id:int}",                tinta, methods=["POST"]),
+    Route("/eventos",                       eventos_estoque),
+    Route(f"{API}/estoque",                 api_estoque),
+    Route(f"{API}/estoque/{{id:int}}",      api_estoque_item),
+    Route(f"{API}/historico",               api_historico),
+    Route(f"{API}/movimentos",              api_movimentos, methods=["POST"]),
+    Mount("",                               flask_app),
+]
+
+if SQLITE:
+    # O asyncpg só fala com o PostgreSQL: no modo SQLite o Flask atende tudo.
+    app = flask_app
+else:
+    app = Starlette(routes=ROTAS, lifespan=_ciclo)
@@ -0,0 +1,134 @@
+"""
+Arquivos estáticos com nome versionado pelo conteúdo.
+
+No carregamento, tudo em static/ é lido para a memória e recebe um nome
+com o hash do conteúdo (css/app.css → css/app.3f2a9c1b0d.css). As páginas
+apontam para esse nome, então o arquivo pode ser cacheado para sempre
+(Cache-Control: immutable); qualquer alteração gera um nome novo.
+
+Fontes: coloque os arquivos abaixo em static/fonts/ para servi-las
+localmente (sem Google Fonts). Ausentes, a pilha de fontes do CSS cai
+para as fontes do sistema.
+
+Logo: static/img/braslimp.png (ou .svg/.webp). Ausente, usa a URL remota.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Blueprint, Response, abort, request, url_for
+
+PASTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+UM_ANO = 365 * 24 * 3600
+
+# família -> (arquivo em static/, faixa de pesos)
+FONTES = {
+    "Inter":          ("fonts/Inter-Variable.woff2",        "300 700"),
+    "JetBrains Mono": ("fonts/JetBrainsMono-Variable.woff2", "400 500"),
+}
+
+LOGOS = ("img/braslimp.svg", "img/braslimp.webp", "img/braslimp.png")
+LOGO_REMOTO = ("https://media.licdn.com/dms/image/v2/D4D0BAQG0smJnZAhyhw/company-logo_200_200/"
+               "company-logo_200_200/0/1689000003837/braslimpoficial_logo?e=2147483647&v=beta"
+               "&t=7Pq4Tq4bXr0Z1cr4VpMETmGUD4mXZed6_xccVMK7pr8")
+
+COMPRIMIVEIS = (".css", ".js", ".svg")
+
+bp = Blueprint("assets", __name__)
+
+
+class Assets:
+    def __init__(self, pasta=PASTA):
+        self.pasta    = pasta
+        self.nomes    = {}   # "css/app.css" -> "css/app.<hash>.css"
+        self.arquivos = {}   # "css/app.<hash>.css" -> (bytes, gzip|None, mimetype)
+        self.carregar()
+
+    @staticmethod
+    def _versionar(nome, dados):
+        raiz, ext = os.path.splitext(nome)
+        return f"{raiz}.{hashlib.sha256(dados).hexdigest()[:10]}{ext}"
+
+    def _registrar(self, nome, dados):
+        final = self._versionar(nome, dados)
+        gz = gzip.compress(dados, 9) if nome.endswith(COMPRIMIVEIS) else None
+        mime = mimetypes.guess_type(nome)[0] or "application/octet-stream"
+        if mime.startswith("text/") or mime == "image/svg+xml":
+            mime += "; charset=utf-8"
+        self.nomes[nome] = final
+        self.arquivos[final] = (dados, gz, mime)
+
+    def carregar(self):
+        self.nomes.clear()
+        self.arquivos.clear()
+        css = []
+        for raiz, _, arquivos in os.walk(self.pasta):
+            for arq in sorted(arquivos):
+                if arq.startswith("."):
+                    continue
+                caminho = os.path.join(raiz, arq)
+                nome = os.path.relpath(caminho, self.pasta).replace(os.sep, "/")
+                with open(caminho, "rb") as f:
+                    dados = f.read()
+                if nome.endswith(".css"):
+                    css.append((nome, dados))   # depende dos nomes das fontes
+                else:
+                    self._registrar(nome, dados)
+        for nome, dados in css:
+            if nome == "css/app.css":
+                dados = self._font_faces().encode() + dados
+            self._registrar(nome, dados)
+
+    def _font_faces(self):
+        regras = []
+        for familia, (arquivo, pesos) in FONTES.items():
+            if arquivo not in self.nomes:
+                continue
+            regras.append(
+                "@font-face{font-family:'%s';font-style:normal;font-weight:%s;"
+                "font-display:swap;src:local('%s'),url('../%s') format('woff2')}\n"
+                % (familia, pesos, familia, self.nomes[arquivo]))
+        return "".join(regras)
+
+    @property
+    def digest(self):
+        """Identifica o conjunto atual de assets (entra no ETag das páginas)."""
+        h = hashlib.sha1()
+        for final in sorted(self.arquivos):
+            h.update(final.encode())
+        return h.hexdigest()[:8]
+
+    def url(self, nome):
+        return url_for("assets.arquivo", caminho=self.nomes[nome])
+
+    def fontes_locais(self):
+        return [self.url(arq) for arq, _ in FONTES.values() if arq in self.nomes]
+
+    def logo_url(self):
+        for nome in LOGOS:
+            if nome in self.nomes:
+                return self.url(nome)
+        return LOGO_REMOTO
+
+
+assets = Assets()
+
+
+@bp.route("/assets/<path:caminho>")
+def arquivo(caminho):
+    item = assets.arquivos.get(caminho)
+    if item is None:
+        abort(404)
+    dados, gz, mime = item
+    resp = Response(content_type=mime)
+    if gz is not None:
+        resp.vary.add("Accept-Encoding")
+        if "gzip" in request.accept_encodings:
+            dados = gz
+            resp.content_encoding = "gzip"
+    resp.set_data(dados)
+    resp.headers["Cache-Control"] = f"public, max-age={UM_ANO}, immutable"
+    resp.set_etag(caminho)
+    return resp
@@ -0,0 +1,259 @@
+"""
+Gravação do histórico (auditoria) fora do caminho da requisição.
+
+Por padrão (HISTORICO_GRAVACAO=sincrona) cada movimento grava a sua linha
+de histórico no mesmo comando que altera o estoque (ver movimentar() em
+app.py): se a resposta saiu, a auditoria está no banco.
+
+Com HISTORICO_GRAVACAO=lote, movimentar() só altera o estoque e entrega a
+linha de histórico a este módulo. Ela fica presa à transação: vai para a
+fila no commit e é descartada no rollback (um lote atômico desfeito não
+deixa auditoria de nada). Uma thread por processo junta o que estiver na
+fila e grava com um COPY (executemany no SQLite) a cada HISTORICO_LOTE_MS
+ou HISTORICO_LOTE_MAX linhas, o que vier antes. criado_em é o instante do
+movimento, não o da gravação.
+
+A fila tem tamanho fixo. Cheia, o movimento espera até
+HISTORICO_FILA_ESPERA segundos por uma vaga e, se não houver, grava o
+próprio histórico na transação, como no modo síncrono: nada se perde por
+excesso de carga, só deixa de ser em lote. Se o banco recusar um lote, a
+thread tenta de novo com espera crescente, sem descartá-lo; a fila enche
+e os movimentos voltam a gravar por conta própria.
+
+Ao sair (atexit, e no fim do ciclo de vida do modo ASGI) a fila é
+esvaziada. O que ainda estiver nela se o processo morrer sem sair
+(kill -9, falta de energia) não chega ao banco, e o histórico (e o
+resumo diário dos relatórios) aparece até HISTORICO_LOTE_MS depois do
+movimento: quem precisa de auditoria garantida fica no modo síncrono.
+
+    HISTORICO_GRAVACAO     sincrona | lote                        (padrão sincrona)
+    HISTORICO_LOTE_MS      intervalo máximo entre gravações        (padrão 200)
+    HISTORICO_LOTE_MAX     linhas por gravação                     (padrão 500)
+    HISTORICO_FILA_MAX     linhas esperando na fila, por processo  (padrão 10000)
+    HISTORICO_FILA_ESPERA  segundos esperando vaga na fila cheia   (padrão 0.5)
+"""
+
+import atexit
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import db
+
+log = logging.getLogger(__name__)
+
+MODO        = os.environ.get("HISTORICO_GRAVACAO", "sincrona").strip().lower()
+LOTE        = MODO == "lote"
+INTERVALO   = int(os.environ.get("HISTORICO_LOTE_MS", 200)) / 1000
+LOTE_MAX    = int(os.environ.get("HISTORICO_LOTE_MAX", 500))
+FILA_MAX    = int(os.environ.get("HISTORICO_FILA_MAX", 10_000))
+FILA_ESPERA = float(os.environ.get("HISTORICO_FILA_ESPERA", 0.5))
+
+if MODO not in ("sincrona", "lote"):
+    raise RuntimeError(f"HISTORICO_GRAVACAO inválido: {MODO!r} (use sincrona ou lote)")
+
+# (estoque_id, usuario, acao, detalhe, criado_em), a ordem do COPY
+COLUNAS = ("estoque_id", "usuario", "acao", "detalhe", "criado_em")
+
+SQL_COPY = (f"COPY historico ({', '.join(COLUNAS)}) FROM STDIN WITH "
+            f"(FORMAT csv, FORCE_NOT_NULL (usuario, acao, detalhe))")
+SQL_INSERT = (f"INSERT INTO historico ({', '.join(COLUNAS)}) "
+              f"VALUES ({', '.join(['%s'] * len(COLUNAS))})")
+
+
+class Gravador:
+    """Fila limitada de linhas de histórico e a thread que as grava em lote.
+
+    Uma vaga é reservada antes do movimento e ocupada no commit; assim a
+    fila nunca passa de `fila_max`, mesmo com transações abertas.
+    """
+
+    def __init__(self, fila_max=FILA_MAX, lote_max=LOTE_MAX, intervalo=INTERVALO,
+                 espera=FILA_ESPERA):
+        self.fila_max  = fila_max
+        self.lote_max  = lote_max
+        self.intervalo = intervalo
+        self.espera    = espera
+        self._cond       = threading.Condition()
+        self._gravando   = threading.Lock()     # thread e esvaziar() não gravam juntas
+        self._fila       = deque()
+        self._reservadas = 0
+        self._pendentes  = {}      # conexão -> [linha] até o commit
+        self._pid        = None
+        self._saindo     = threading.Event()
+        self._stats = {"gravadas": 0, "lotes": 0, "cheia": 0, "descartadas": 0,
+                       "erros": 0, "ultimo_lote_ms": 0.0}
+
+    # ── Lado da requisição ───────────────────
+    def reservar(self, espera=0):
+        """Reserva uma vaga na fila, esperando até `espera` segundos; False
+        se ela continuar cheia (o chamador grava o histórico por conta própria)."""
+        self.garantir()
+        limite = time.monotonic() + espera
+        with self._cond:
+            while len(self._fila) + self._reservadas >= self.fila_max:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats["cheia"] += 1
+                    return False
+                self._cond.wait(restante)
+            self._reservadas += 1
+            return True
+
+    def entregar(self, linhas):
+        """Põe na fila linhas com vaga já reservada (transação confirmada)."""
+        if not linhas:
+            return
+        with self._cond:
+            # A thread acorda na primeira linha (começa a contar o intervalo)
+            # e com o lote cheio.
+            acordar = not self._fila
+            self._reservadas -= len(linhas)
+            self._fila.extend(linhas)
+            if acordar or len(self._fila) >= self.lote_max:
+                self._cond.notify_all()
+
+    def liberar(self, n):
+        """Devolve `n` vagas reservadas e não usadas."""
+        if not n:
+            return
+        with self._cond:
+            self._reservadas -= n
+            self._cond.notify_all()
+
+    def descartar(self, linhas):
+        """Devolve as vagas de linhas cuja transação foi desfeita."""
+        with self._cond:
+            self._stats["descartadas"] += len(linhas)
+        self.liberar(len(linhas))
+
+    def registrar(self, conn, linha):
+        """Prende a linha (com vaga já reservada) à transação de `conn`
+        (get_db()): vai para a fila no commit, some no rollback."""
+        self._pendentes.setdefault(conn, []).append(linha)
+
+    def fim_transacao(self, conn, confirmada):
+        """Em db.observadores_transacao."""
+        linhas = self._pendentes.pop(conn, None)
+        if linhas:
+            if confirmada:
+                self.entregar(linhas)
+            else:
+                self.descartar(linhas)
+
+    # ── Thread de gravação ───────────────────
+    def garantir(self):
+        """Inicia a thread neste processo, se ainda não estiver rodando."""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Depois de um fork, a fila herdada é do processo pai.
+                self._fila.clear()
+                self._reservadas = 0
+                self._pendentes.clear()
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name="gravador-historico",
+                             daemon=True).start()
+
+    def _loop(self):
+        while not self._saindo.is_set():
+            with self._cond:
+                # Espera um lote cheio ou o intervalo, contado da primeira linha.
+                while not self._fila and not self._saindo.is_set():
+                    self._cond.wait()
+                limite = time.monotonic() + self.intervalo
+                while len(self._fila) < self.lote_max and not self._saindo.is_set():
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+            self.gravar_lote()
+
+    def gravar_lote(self, tentativas=None):
+        """Grava até lote_max linhas da fila; enquanto o banco recusar, tenta
+        de novo com espera crescente (no máximo `tentativas` vezes). Retorna
+        quantas gravou; as de um lote recusado continuam na fila."""
+        espera = 1
+        with self._gravando:
+            with self._cond:
+                lote = [self._fila[i] for i in range(min(self.lote_max, len(self._fila)))]
+            if not lote:
+                return 0
+            tentativa = 0
+            while True:
+                tentativa += 1
+                inicio = time.perf_counter()
+                try:
+                    _gravar(lote)
+                    break
+                except Exception:
+                    self._stats["erros"] += 1
+                    if tentativas is not None and tentativa >= tentativas:
+                        log.exception("Falha gravando %d linhas de histórico; desistindo", len(lote))
+                        return 0
+                    log.exception("Falha gravando %d linhas de histórico; nova tentativa em %ss",
+                                  len(lote), espera)
+                    if self._saindo.wait(espera) and tentativas is None:
+                        return 0        # a saída (esvaziar) assume a fila
+                    espera = min(espera * 2, 30)
+            with self._cond:
+                # Só agora saem da fila: liberam vaga para os movimentos que esperam.
+                for _ in lote:
+                    self._fila.popleft()
+                self._stats["gravadas"] += len(lote)
+                self._stats["lotes"] += 1
+                self._stats["ultimo_lote_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+                self._cond.notify_all()
+        return len(lote)
+
+    def descarregar(self, tentativas=None):
+        """Grava agora o que está na fila, sem esperar o intervalo."""
+        while self.gravar_lote(tentativas):
+            pass
+
+    def esvaziar(self, tentativas=3):
+        """Para a thread e grava o que está na fila (saída do processo)."""
+        if self._pid != os.getpid():
+            return
+        self._saindo.set()
+        with self._cond:
+            self._cond.notify_all()
+        self.descarregar(tentativas)
+        with self._cond:
+            if self._fila:
+                log.error("%d linhas de histórico não foram gravadas", len(self._fila))
+
+    def stats(self):
+        with self._cond:
+            return {**self._stats, "modo": MODO, "fila": len(self._fila),
+                    "reservadas": self._reservadas, "fila_max": self.fila_max}
+
+
+def _gravar(linhas):
+    with db.get_db() as conn:
+        c = conn.cursor()
+        if db.SQLITE:
+            c.executemany(SQL_INSERT, linhas)
+            return
+        # COPY em CSV: None vira campo vazio (NULL); FORCE_NOT_NULL mantém
+        # texto vazio como '' nas colunas de texto.
+        dados = io.StringIO()
+        csv.writer(dados).writerows(
+            (estoque_id, usuario, acao, detalhe, criado_em.isoformat())
+            for estoque_id, usuario, acao, detalhe, criado_em in linhas)
+        dados.seek(0)
+        c.copy_expert(SQL_COPY, dados)
+
+
+gravador = Gravador()
+
+if LOTE:
+    db.observadores_transacao.append(gravador.fim_transacao)
+    atexit.register(gravador.esvaziar)
@@ -0,0 +1,170 @@
+"""
+Martela um único item do estoque com muitos clientes ao mesmo tempo e
+confere que nenhuma alteração se perdeu nem foi aplicada duas vezes
+(concorrência otimista, ver movimentar() em app.py).
+
+Cria um item próprio no banco toner_bench (apagado no fim, com o seu
+histórico) e dispara, de --threads clientes com sessão própria, todos
+liberados juntos:
+
+  deltas   +1/-1 sorteados, pelas rotas /mais e /menos. No fim, a
+           quantidade é a inicial + adições - retiradas aceitas, nunca
+           ficou negativa, e há uma linha de histórico por ação aceita.
+  edições  observação gravada com a versão lida logo antes (GET da API),
+           como faz o modal. Cada versão aceita uma única escrita; as
+           demais voltam 409 com a linha atual, e o texto final é o da
+           última escrita aceita.
+
+Nas duas fases, a versão do item sobe exatamente uma vez por ação
+aceita. Sai com 1 se alguma conta não fecha. Com HISTORICO_GRAVACAO=lote
+(auditoria.py), a fila do gravador é descarregada antes de contar o
+histórico.
+
+    python bench/concorrencia.py --sqlite /tmp/toner_bench.db
+    python bench/concorrencia.py --pg-local /tmp/toner-bench --threads 32 --rodadas 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import rotas                                           # noqa: E402
+
+CODIGO = "BENCH-CONCORRENCIA"
+JSON   = {"Accept": "application/json"}
+
+
+def _item(toner, id_):
+    with toner.get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT quantidade, versao, observacao FROM estoque WHERE id=%s", (id_,))
+        return c.fetchone()
+
+
+def _em_paralelo(threads, fn):
+    """fn(k, largada) em `threads` threads; todas começam juntas."""
+    largada = threading.Barrier(threads)
+    with ThreadPoolExecutor(threads) as ex:
+        return list(ex.map(lambda k: fn(k, largada), range(threads)))
+
+
+def deltas(toner, usuario_id, id_, threads, rodadas, semente):
+    """[(adições aceitas, retiradas aceitas, outras respostas)] por cliente."""
+    def cliente(k, largada):
+        rnd = random.Random(f"{semente}-deltas-{k}")
+        cl = rotas.sessao(toner, usuario_id)
+        mais = menos = outras = 0
+        largada.wait()
+        for _ in range(rodadas):
+            tipo = rnd.choice(("mais", "menos"))
+            r = cl.get(f"/{tipo}/{id_}", headers=JSON)
+            if r.status_code == 200:
+                mais += tipo == "mais"
+                menos += tipo == "menos"
+            elif not (r.status_code == 409 and tipo == "menos"):   # 409 só com estoque zerado
+                outras += 1
+        return mais, menos, outras
+    return _em_paralelo(threads, cliente)
+
+
+def edicoes(toner, usuario_id, id_, threads, rodadas):
+    """[(versões lidas das escritas aceitas, (versão gravada, texto), conflitos, outras)]"""
+    def cliente(k, largada):
+        cl = rotas.sessao(toner, usuario_id)
+        lidas, gravadas, conflitos, outras = [], [], 0, 0
+        largada.wait()
+        for i in range(rodadas):
+            versao = cl.get(f"/api/v1/estoque/{id_}").get_json()["versao"]
+            texto = f"cliente {k}, rodada {i}"
+            r = cl.post(f"/observacao/{id_}", data={"observacao": texto, "versao": versao}, headers=JSON)
+            if r.status_code == 200:
+                lidas.append(versao)
+                gravadas.append((r.get_json()["item"]["versao"], texto))
+            elif r.status_code == 409 and r.get_json().get("conflito"):
+                conflitos += 1
+            else:
+                outras += 1
+        return lidas, gravadas, conflitos, outras
+    return _em_paralelo(threads, cliente)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--pg-local", metavar="DIR", help="sobe um PostgreSQL descartável em DIR")
+    ap.add_argument("--sqlite", metavar="ARQ", help="usa o modo SQLite no arquivo ARQ")
+    ap.add_argument("--threads", type=int, default=16, help="clientes simultâneos")
+    ap.add_argument("--rodadas", type=int, default=100, help="ações por cliente, em cada fase")
+    ap.add_argument("--inicial", type=int, default=3, help="quantidade inicial do item")
+    ap.add_argument("--semente", type=int, default=42)
+    args = ap.parse_args()
+    rotas.configurar(ap, args, args.threads)
+
+    import app as toner                                # migra e semeia o banco de benchmark
+
+    with toner.get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM usuarios WHERE is_admin=1 ORDER BY id LIMIT 1")
+        usuario_id = c.fetchone()[0]
+        c.execute("INSERT INTO estoque (codigo, setor, tipo, quantidade) "
+                  "VALUES (%s, 'Bench / concorrência', 'pb', %s) RETURNING id", (CODIGO, args.inicial))
+        id_ = c.fetchone()[0]
+
+    falhas = []
+    def conferir(ok, texto):
+        print(f"  {'ok    ' if ok else 'FALHOU'}  {texto}")
+        if not ok:
+            falhas.append(texto)
+
+    try:
+        qtd0, versao0, _ = _item(toner, id_)
+        print(f"item {id_}: {args.threads} clientes x {args.rodadas} rodadas por fase\n")
+
+        print("deltas (+1/-1)")
+        res = deltas(toner, usuario_id, id_, args.threads, args.rodadas, args.semente)
+        mais, menos, outras = (sum(r[i] for r in res) for i in range(3))
+        qtd, versao, _ = _item(toner, id_)
+        toner.auditoria.gravador.descarregar()
+        with toner.get_db() as conn:
+            c = conn.cursor()
+            c.execute("SELECT count(*) FROM historico WHERE estoque_id=%s AND acao IN (%s, %s)",
+                      (id_, toner.MOVIMENTOS["mais"][0], toner.MOVIMENTOS["menos"][0]))
+            linhas = c.fetchone()[0]
+        recusadas = args.threads * args.rodadas - mais - menos - outras
+        print(f"  {mais} adições e {menos} retiradas aceitas, {recusadas} retiradas com estoque zerado")
+        conferir(outras == 0, f"nenhuma resposta inesperada ({outras})")
+        conferir(qtd == qtd0 + mais - menos, f"quantidade {qtd} = {qtd0} + {mais} - {menos}")
+        conferir(qtd >= 0, "quantidade nunca negativa")
+        conferir(linhas == mais + menos, f"{linhas} linhas de histórico para {mais + menos} ações")
+        conferir(versao == versao0 + mais + menos, f"versão {versao} = {versao0} + {mais + menos}")
+
+        print("\nedições (observação com a versão lida)")
+        versao0 = versao
+        res = edicoes(toner, usuario_id, id_, args.threads, args.rodadas)
+        lidas = [v for r in res for v in r[0]]
+        gravadas = dict(g for r in res for g in r[1])
+        conflitos, outras = sum(r[2] for r in res), sum(r[3] for r in res)
+        _, versao, obs = _item(toner, id_)
+        print(f"  {len(lidas)} escritas aceitas, {conflitos} conflitos (409)")
+        conferir(outras == 0, f"nenhuma resposta inesperada ({outras})")
+        conferir(len(set(lidas)) == len(lidas), "uma escrita aceita por versão lida")
+        conferir(versao == versao0 + len(lidas), f"versão {versao} = {versao0} + {len(lidas)}")
+        conferir(gravadas.get(versao) == obs, f"texto final é o da última escrita aceita ({obs!r})")
+    finally:
+        toner.auditoria.gravador.descarregar()
+        with toner.get_db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM historico WHERE estoque_id=%s", (id_,))
+            c.execute("DELETE FROM movimentos_diarios WHERE estoque_id=%s", (id_,))
+            c.execute("DELETE FROM estoque WHERE id=%s", (id_,))
+
+    print(f"\n{'tudo certo' if not falhas else f'{len(falhas)} verificação(ões) falharam'}")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Vazão da importação/exportação CSV do estoque.
+
+Gera um CSV sintético de N impressoras e mede, numa transação que é
+desfeita no final (o banco não muda):
+
+    validação     só o parsing/normalização em Python
+    inserção      importar() com todos os itens novos
+    atualização   reimportar com as quantidades alteradas
+    sem mudança   reimportar o mesmo arquivo
+    exportação    exportar() + leitura de todos os blocos
+
+    DATABASE_URL=postgresql://... python bench/csv_estoque.py [-n 100000]
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import estoque_csv                                     # noqa: E402
+from db import pool                                    # noqa: E402
+
+
+def gerar(n, semente=0, delta=0):
+    rnd = random.Random(semente)
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(estoque_csv.COLUNAS)
+    for i in range(n):
+        w.writerow([f"BENCH{i:07d}", f"Site {i // 50:05d} / Sala {i % 50:02d}",
+                    rnd.choice(estoque_csv.TIPOS), rnd.randint(0, 5) + delta,
+                    rnd.randint(0, 1), rnd.choice(["", rnd.randint(0, 100)]),
+                    rnd.choice(["", "Troca agendada", "Cilindro gasto"])])
+    return buf.getvalue().encode()
+
+
+def cronometrar(nome, n, fn):
+    inicio = time.perf_counter()
+    resultado = fn()
+    dt = time.perf_counter() - inicio
+    print(f"{nome:12} {dt:8.2f} s {n / dt:12,.0f} linhas/s   {resultado or ''}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-n", type=int, default=100_000, help="linhas no CSV")
+    args = ap.parse_args()
+
+    dados = gerar(args.n)
+    alterados = gerar(args.n, delta=1)
+    print(f"CSV: {args.n:,} linhas, {len(dados) / 1e6:.1f} MB")
+
+    def exportar():
+        total = 0
+        for bloco in estoque_csv.blocos(estoque_csv.exportar(conn)):
+            total += len(bloco)
+        return f"{total / 1e6:.1f} MB"
+
+    conn, usos = pool.getconn()
+    try:
+        cronometrar("validação", args.n, lambda: estoque_csv.validar(io.BytesIO(dados))[2])
+        cronometrar("inserção", args.n, lambda: estoque_csv.importar(conn, io.BytesIO(dados), "bench"))
+        cronometrar("atualização", args.n, lambda: estoque_csv.importar(conn, io.BytesIO(alterados), "bench"))
+        cronometrar("sem mudança", args.n, lambda: estoque_csv.importar(conn, io.BytesIO(alterados), "bench"))
+        cronometrar("exportação", args.n, exportar)
+    finally:
+        conn.rollback()
+        pool.putconn(conn, usos)
+
+
+if __name__ == "__main__":
+    main()
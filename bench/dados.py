@@ -0,0 +1,205 @@
+"""
+Gerador de dados sintéticos e determinísticos para os benchmarks.
+
+Substitui estoque, histórico e resumo diário do banco de DATABASE_URL por
+uma frota sintética: mesma semente, mesmos dados. O histórico cobre os
+últimos 24 meses, com a mistura de ações e o texto de detalhe que
+movimentar() grava. Só roda em bancos cujo nome começa com "toner_bench"
+(os dados atuais são apagados). No SQLite (arquivo toner_bench*.db) o
+sorteio é feito em Python: mesma semente, mesmos dados, mas não os mesmos
+do PostgreSQL.
+
+    frota   itens em estoque
+    18      como a instalação de exemplo
+    1k      1.000
+    10k     10.000
+
+    DATABASE_URL=postgresql://.../toner_bench python bench/dados.py --frota 10k --historico 10000000
+    DATABASE_URL=sqlite:////tmp/toner_bench.db python bench/dados.py --frota 1k
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+FROTAS = {"18": 18, "1k": 1_000, "10k": 10_000}
+MESES  = 24
+LOTE   = 1_000_000      # linhas de histórico por INSERT
+LOTE_SQLITE = 50_000    # linhas por executemany()
+
+# (ação de MOVIMENTOS, peso) — retiradas e recebimentos dominam o uso real
+MISTURA = (
+    ("mais",       0.08),
+    ("menos",      0.40),
+    ("solicitar",  0.15),
+    ("recebido",   0.15),
+    ("tinta",      0.17),
+    ("observacao", 0.05),
+)
+
+
+def _sql_acao(movimentos):
+    """CASE que sorteia ação e detalhe a partir de r (0..1) e do setor."""
+    acao, detalhe, limite = [], [], 0.0
+    for tipo, peso in MISTURA:
+        limite += peso
+        nome, _, _, texto = movimentos[tipo]
+        antes, _, depois = texto.partition("{setor}")
+        valor = "(floor(r * 1000)::int % 101)::text" if tipo == "tinta" else "'Sintético'"
+        acao.append(f"WHEN r < {limite:.2f} THEN '{nome}'")
+        detalhe.append(
+            f"WHEN r < {limite:.2f} THEN "
+            f"replace('{antes}', '{{valor}}', {valor}) || setor || replace('{depois}', '{{valor}}', {valor})")
+    # Vai para um execute() com parâmetros: % literal vira %%.
+    return (f"CASE {' '.join(acao)} ELSE '{movimentos['menos'][0]}' END".replace("%", "%%"),
+            f"CASE {' '.join(detalhe)} ELSE '' END".replace("%", "%%"))
+
+
+def gerar(conn, itens, historico, semente=42, saida=print):
+    """Recria os dados; `conn` num banco toner_bench*. Não faz commit."""
+    import app as toner
+    import db
+    import tendencias
+
+    c = conn.cursor()
+    if db.SQLITE:
+        c.execute("PRAGMA database_list")
+        banco = os.path.basename(c.fetchone()[2])
+    else:
+        c.execute("SELECT current_database()")
+        banco = c.fetchone()[0]
+    if not banco.startswith("toner_bench"):
+        raise SystemExit(f"Recusado: o banco '{banco}' não é de benchmark (toner_bench*).")
+
+    if db.SQLITE:
+        _gerar_sqlite(c, toner.MOVIMENTOS, itens, historico, semente, saida)
+    else:
+        _gerar_postgres(c, toner.MOVIMENTOS, itens, historico, semente, saida)
+
+    inicio = time.perf_counter()
+    linhas = tendencias.reconstruir(c)
+    saida(f"resumo:     {linhas:>12,} linhas  {time.perf_counter() - inicio:6.1f} s")
+    c.execute("ANALYZE estoque")
+    c.execute("ANALYZE historico")
+    c.execute("ANALYZE movimentos_diarios")
+
+
+def _gerar_postgres(c, movimentos, itens, historico, semente, saida):
+    import particoes
+
+    # Sem paralelismo: random() depois de setseed() segue a ordem das linhas.
+    c.execute("SET LOCAL max_parallel_workers_per_gather = 0")
+    c.execute("SET LOCAL toner.resumo_diario = 'off'")     # refeito no fim
+    c.execute("SELECT setseed(%s)", (semente % 1000 / 1000,))
+    c.execute("TRUNCATE estoque, historico, movimentos_diarios RESTART IDENTITY")
+
+    inicio = time.perf_counter()
+    c.execute("""
+        INSERT INTO estoque (codigo, setor, tipo, quantidade, aguardando, tinta_pct, observacao)
+        SELECT 'BN' || lpad(g::text, 6, '0'),
+               'Unidade ' || lpad((g / 20)::text, 4, '0') || ' / Sala ' || (g %% 20),
+               CASE WHEN random() < 0.2 THEN 'colorida' ELSE 'pb' END,
+               floor(random() * 4)::int,
+               (random() < 0.15)::int,
+               CASE WHEN random() < 0.8 THEN floor(random() * 101)::int END,
+               CASE WHEN random() < 0.1 THEN 'Cilindro gasto' ELSE '' END
+        FROM generate_series(1, %s) g
+    """, (itens,))
+    saida(f"estoque:    {itens:>12,} itens   {time.perf_counter() - inicio:6.1f} s")
+
+    hoje = date.today().replace(day=1)
+    for n in range(-MESES, 1):
+        particoes.criar_particao(c, particoes._somar_meses(hoje, n))
+
+    acao, detalhe = _sql_acao(movimentos)
+    usuarios = [f"Técnico {i}" for i in range(1, 9)]
+    inicio = time.perf_counter()
+    feitas = 0
+    while feitas < historico:
+        lote = min(LOTE, historico - feitas)
+        c.execute(f"""
+            INSERT INTO historico (estoque_id, usuario, acao, detalhe, criado_em)
+            SELECT e.id, (%(usuarios)s)[1 + floor(s.u * 8)::int], {acao}, {detalhe}, s.quando
+            FROM (
+                SELECT 1 + floor(random() * %(itens)s)::int AS estoque_id, random() AS r,
+                       random() AS u, now() - random() * interval '{MESES} months' AS quando
+                FROM generate_series(1, %(lote)s)
+            ) s JOIN estoque e ON e.id = s.estoque_id
+        """, {"usuarios": usuarios, "itens": itens, "lote": lote})
+        feitas += lote
+        saida(f"historico:  {feitas:>12,} linhas  {time.perf_counter() - inicio:6.1f} s")
+
+
+def _gerar_sqlite(c, movimentos, itens, historico, semente, saida):
+    rnd = random.Random(semente)
+    c.execute("SET LOCAL toner.resumo_diario = 'off'")     # refeito no fim
+    c.execute("DELETE FROM historico")
+    c.execute("DELETE FROM movimentos_diarios")
+    c.execute("DELETE FROM estoque")
+    c.execute("DELETE FROM sqlite_sequence WHERE name = 'estoque'")
+
+    inicio = time.perf_counter()
+    setores = [f"Unidade {g // 20:04d} / Sala {g % 20}" for g in range(1, itens + 1)]
+    c.executemany("""
+        INSERT INTO estoque (codigo, setor, tipo, quantidade, aguardando, tinta_pct, observacao)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, [(f"BN{g:06d}", setores[g - 1],
+           "colorida" if rnd.random() < 0.2 else "pb",
+           int(rnd.random() * 4),
+           int(rnd.random() < 0.15),
+           int(rnd.random() * 101) if rnd.random() < 0.8 else None,
+           "Cilindro gasto" if rnd.random() < 0.1 else "")
+          for g in range(1, itens + 1)])
+    saida(f"estoque:    {itens:>12,} itens   {time.perf_counter() - inicio:6.1f} s")
+
+    # (limite acumulado, ação, detalhe antes/depois do setor, tipo)
+    sorteio, limite = [], 0.0
+    for tipo, peso in MISTURA:
+        limite += peso
+        nome, _, _, texto = movimentos[tipo]
+        antes, _, depois = texto.partition("{setor}")
+        sorteio.append((limite, nome, antes, depois, tipo))
+    usuarios = [f"Técnico {i}" for i in range(1, 9)]
+    agora = datetime.now(timezone.utc)
+    periodo = timedelta(days=MESES * 365.25 / 12)
+
+    def linha():
+        estoque_id = 1 + int(rnd.random() * itens)
+        r, u, q = rnd.random(), rnd.random(), rnd.random()
+        _, nome, antes, depois, tipo = next((s for s in sorteio if r < s[0]), sorteio[1])
+        valor = str(int(r * 1000) % 101) if tipo == "tinta" else "Sintético"
+        detalhe = (antes.replace("{valor}", valor) + setores[estoque_id - 1]
+                   + depois.replace("{valor}", valor))
+        return estoque_id, usuarios[int(u * 8)], nome, detalhe, agora - q * periodo
+
+    inicio = time.perf_counter()
+    feitas = 0
+    while feitas < historico:
+        lote = min(LOTE_SQLITE, historico - feitas)
+        c.executemany("""
+            INSERT INTO historico (estoque_id, usuario, acao, detalhe, criado_em)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [linha() for _ in range(lote)])
+        feitas += lote
+        saida(f"historico:  {feitas:>12,} linhas  {time.perf_counter() - inicio:6.1f} s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--frota", choices=FROTAS, default="1k")
+    ap.add_argument("--historico", type=int, default=100_000, help="linhas de histórico")
+    ap.add_argument("--semente", type=int, default=42)
+    args = ap.parse_args()
+
+    from db import get_db
+    with get_db() as conn:
+        gerar(conn, FROTAS[args.frota], args.historico, args.semente)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark de renderização das páginas.
+
+Compara, para cada página, o custo de renderizar como antes
+(render_template_string do corpo + do layout a cada requisição) com o
+registro de templates compilados (render_template numa passada só).
+
+    DATABASE_URL=postgresql://... python bench/render.py [-n 500]
+
+Os dados vêm do banco uma vez; o tempo medido é só de template.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as toner                                    # noqa: E402
+from flask import render_template, render_template_string  # noqa: E402
+from flask_login import login_user                     # noqa: E402
+from markupsafe import Markup                          # noqa: E402
+
+LAYOUT_ANTIGO = toner.LAYOUT.replace(
+    "{% block content %}{% endblock %}", "{{ body }}")
+
+
+def render_antigo(corpo, title, sub, active, **ctx):
+    body = render_template_string(corpo, **ctx)
+    return render_template_string(
+        LAYOUT_ANTIGO, page_title=title, page_sub=sub, active=active,
+        body=Markup(body))
+
+
+def cronometrar(fn, n):
+    fn()
+    inicio = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - inicio) / n * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-n", type=int, default=500, help="renderizações por página")
+    args = ap.parse_args()
+
+    with toner.get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM usuarios WHERE is_admin=1 ORDER BY id LIMIT 1")
+        usuario = toner.User(toner.fetchone_dict(c))
+        _, snap = toner.snapshot_cache.obter(conn)
+        dados, encontrados = toner.buscar_estoque(conn, {})
+        _, tot = toner.totais(conn)
+        toner.previsor.atualizar(conn)
+        hoje = toner.previsor.hoje()
+        serie = toner.tendencias.serie(conn, 30, hoje)
+        setores_periodo = toner.tendencias.por_setor(conn, 30, hoje)
+        c.execute("SELECT * FROM historico ORDER BY id DESC LIMIT 200")
+        registros = toner.fetchall_dict(c)
+
+    paginas = [
+        ("inventario", toner.INV_BODY, ("Inventário", "", "inventario"), dict(
+            dados=dados, encontrados=encontrados, alerta=tot["sem_pedido"] > 0,
+            stats=tot, zerados_count=tot["sem_pedido"], versao=0, filtros={},
+            ordem="setor", desc=False, params={}, pagina=1,
+            paginas=max(1, -(-encontrados // toner.INV_POR_PAGINA)),
+            tipos=toner.estoque_csv.TIPOS)),
+        ("dashboard", toner.DASH_BODY, ("Dashboard", "", "dashboard"), dict(
+            total=snap.total, zerados=snap.sem_pedido, aguardando=snap.aguardando,
+            ok_count=snap.ok, total_itens=snap.total_itens,
+            detalhes=snap.por_quantidade, pct_ok=snap.pct_ok,
+            pct_problema=snap.pct_problema, alertas_tinta=snap.alertas_tinta,
+            avisos_tinta=snap.avisos_tinta,
+            riscos=toner.previsor.em_risco(snap.itens),
+            prazo_geral=toner.previsor.prazo_geral(), hoje=hoje, horizonte=30,
+            periodo=30, periodos=toner.tendencias.PERIODOS, serie=serie,
+            serie_max=max([max(p["entradas"], p["retiradas"]) for p in serie] + [1]),
+            setores_periodo=setores_periodo)),
+        ("historico", toner.HIST_BODY, ("Histórico", "", "historico"), dict(
+            registros=registros, filtros={}, cursor=None, proximo=None,
+            setores=sorted({d["setor"] for d in snap.itens}), acoes=[],
+            retencao=24)),
+    ]
+
+    print(f"{'página':12} {'antes (ms)':>11} {'depois (ms)':>12} {'ganho':>7}")
+    with toner.app.test_request_context("/"):
+        login_user(usuario)
+        for nome, corpo, (title, sub, active), ctx in paginas:
+            antes = cronometrar(
+                lambda: render_antigo(corpo, title, sub, active, **ctx), args.n)
+            depois = cronometrar(
+                lambda: render_template(f"{nome}.html", page_title=title,
+                                        page_sub=sub, active=active, **ctx), args.n)
+            print(f"{nome:12} {antes:11.3f} {depois:12.3f} {antes / depois:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Carga nas rotas da aplicação: latência, vazão e consultas por requisição.
+
+Gera (ou reaproveita) uma frota sintética com bench/dados.py num banco
+toner_bench e dispara, rota por rota, requisições de --clientes clientes
+simultâneos contra o app WSGI de verdade (test client do Flask, sessão de
+admin, sem cache do navegador: toda resposta é renderizada). Para cada
+rota: p50/p95/p99, requisições/s, erros e comandos SQL por requisição.
+
+    --pg-local DIR   sobe um PostgreSQL descartável em DIR (pgserver, se
+                     instalado; senão initdb/pg_ctl do PATH ou de PG_BIN)
+    --sqlite ARQ     modo SQLite (db_sqlite.py), no arquivo ARQ (toner_bench*.db)
+    (sem elas)       usa o servidor de DATABASE_URL, banco toner_bench
+
+    python bench/rotas.py --pg-local /tmp/toner-bench --frota 10k --historico 10000000
+    python bench/rotas.py --sqlite /tmp/toner_bench.db --salvar sqlite
+    python bench/rotas.py --sem-gerar --salvar antes
+    python bench/rotas.py --sem-gerar --comparar antes     # sai com 1 se piorou
+
+Baselines ficam em bench/baselines/<nome>.json. Piorou: p95 acima de
+--limite (padrão 15%) e mais de 1 ms do baseline, ou mais comandos SQL por
+requisição. As ações (mais/menos alternados) rodam por último: gravam no
+histórico, então rode com dados regerados para comparar números absolutos.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dados                                           # noqa: E402
+
+BANCO     = "toner_bench"
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines")
+
+# nome -> (método, caminho ou função(ids sorteados, i) -> caminho, cabeçalhos)
+JSON = {"Accept": "application/json"}
+ROTAS = {
+    "inventario":        ("GET", "/", {}),
+    "inventario_busca":  ("GET", "/?q=sala+1&status=ok&ordem=quantidade&desc=1", {}),
+    "inventario_pagina": ("GET", "/?pagina=10", {}),
+    "dashboard":         ("GET", "/dashboard", {}),
+    "dashboard_365":     ("GET", "/dashboard?periodo=365", {}),
+    "historico":         ("GET", "/historico", {}),
+    "historico_filtro":  ("GET", "/historico?acao=Retirada&setor=Unidade+0000+%2F+Sala+1", {}),
+    "api_item":          ("GET", lambda ids, i: f"/api/v1/estoque/{ids[i]}", {}),
+    # +1 e -1 no mesmo item, pelo mesmo cliente: o -1 nunca encontra zero
+    "acao":              ("GET", lambda ids, i: f"/{'menos' if i % 2 else 'mais'}/{ids[i // 2]}", JSON),
+}
+
+
+# ── Servidor e banco ─────────────────────────────────────
+def _pg_local(diretorio):
+    """Sobe um PostgreSQL em `diretorio` (socket local, sem senha); retorna a URL."""
+    try:
+        import pgserver
+    except ImportError:
+        pgserver = None
+    if pgserver is not None:
+        return pgserver.get_server(diretorio, cleanup_mode="stop").get_uri("postgres")
+
+    def binario(nome):
+        pg_bin = os.environ.get("PG_BIN")
+        return os.path.join(pg_bin, nome) if pg_bin else shutil.which(nome)
+
+    if not binario("pg_ctl"):
+        raise SystemExit("PostgreSQL não encontrado: instale pgserver ou defina PG_BIN.")
+    dados_pg = os.path.join(diretorio, "pgdata")
+    if not os.path.exists(dados_pg):
+        subprocess.run([binario("initdb"), "-D", dados_pg, "-U", "postgres", "--auth=trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([binario("pg_ctl"), "-D", dados_pg, "-l", os.path.join(diretorio, "log"), "-w",
+                    "-o", f"-k {diretorio} -c listen_addresses=''", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+    return f"postgresql://postgres@/postgres?host={diretorio}"
+
+
+def _url_banco(url, banco):
+    partes = urlsplit(url)
+    return urlunsplit(partes._replace(path="/" + banco))
+
+
+def _criar_banco(url):
+    import psycopg2
+    conn = psycopg2.connect(_url_banco(url, "postgres"))
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM pg_database WHERE datname = %s", (BANCO,))
+    if c.fetchone() is None:
+        c.execute(f"CREATE DATABASE {BANCO}")
+    conn.close()
+
+
+def configurar(ap, args, conexoes):
+    """Aponta DATABASE_URL para o banco de benchmark (--sqlite, --pg-local ou
+    o servidor do ambiente). Antes de importar o app."""
+    if args.sqlite:
+        if not os.path.basename(args.sqlite).startswith(BANCO):
+            ap.error(f"o arquivo do SQLite deve se chamar {BANCO}*.db")
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(args.sqlite)
+    else:
+        url = _pg_local(os.path.abspath(args.pg_local)) if args.pg_local else os.environ.get("DATABASE_URL")
+        if not url:
+            ap.error("defina DATABASE_URL ou use --pg-local DIR / --sqlite ARQ")
+        _criar_banco(url)
+        os.environ["DATABASE_URL"] = _url_banco(url, BANCO)
+    os.environ.setdefault("DB_POOL_MAX", str(max(10, conexoes + 2)))
+    os.environ.setdefault("DB_LENTA_MS", "60000")      # o log de lentas não é o objeto aqui
+
+
+def sessao(toner, usuario_id):
+    """Test client já logado como `usuario_id`."""
+    cl = toner.app.test_client()
+    with cl.session_transaction() as s:
+        s["_user_id"] = str(usuario_id)
+        s["_fresh"] = True
+    return cl
+
+
+# ── Medição ──────────────────────────────────────────────
+_local = threading.local()
+
+def _contar_sql(sql, segundos, linhas):
+    _local.comandos = getattr(_local, "comandos", 0) + 1
+
+
+def _percentil(valores, p):
+    # nearest-rank: sempre uma latência que de fato ocorreu
+    ordenados = sorted(valores)
+    return ordenados[max(0, -(-len(ordenados) * p // 100) - 1)]
+
+
+def medir(toner, usuario_id, nome, n, clientes, aquecimento, semente, itens):
+    metodo, caminho, cabecalhos = ROTAS[nome]
+    # Cada cliente tem aquecimento e sequência próprios, em número par
+    # (pares +1/-1 das ações); n é arredondado para cima.
+    aquecer     = -(-aquecimento // clientes // 2) * 2
+    por_cliente = -(-n // clientes // 2) * 2
+
+    def cliente(k):
+        rnd = random.Random(f"{semente}-{nome}-{k}")
+        total = aquecer + por_cliente
+        ids = [rnd.randint(1, itens) for _ in range(total)]
+        cl = sessao(toner, usuario_id)
+        tempos, comandos, erros = [], [], 0
+        for i in range(total):
+            url = caminho(ids, i) if callable(caminho) else caminho
+            _local.comandos = 0
+            inicio = time.perf_counter()
+            resp = cl.open(url, method=metodo, headers=cabecalhos)
+            resp.get_data()
+            dt = time.perf_counter() - inicio
+            if i < aquecer:
+                continue
+            tempos.append(dt)
+            comandos.append(_local.comandos)
+            erros += resp.status_code >= 400
+        return tempos, comandos, erros
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(clientes) as ex:
+        partes = list(ex.map(cliente, range(clientes)))
+    duracao = time.perf_counter() - inicio
+    tempos   = [t for p in partes for t in p[0]]
+    comandos = [q for p in partes for q in p[1]]
+    return {
+        "n":       len(tempos),
+        "erros":   sum(p[2] for p in partes),
+        "rps":     round((aquecer * clientes + len(tempos)) / duracao, 1),
+        "p50_ms":  round(_percentil(tempos, 50) * 1000, 2),
+        "p95_ms":  round(_percentil(tempos, 95) * 1000, 2),
+        "p99_ms":  round(_percentil(tempos, 99) * 1000, 2),
+        "sql_req": round(sum(comandos) / len(comandos), 2),
+    }
+
+
+def comparar(atual, base, limite):
+    """Linhas do relatório comparativo e se houve regressão."""
+    piorou = False
+    linhas = [f"{'rota':18} {'p95 base':>9} {'p95 agora':>10} {'Δ':>7} {'sql base':>9} {'sql agora':>10}"]
+    for nome, r in atual["rotas"].items():
+        b = base["rotas"].get(nome)
+        if b is None:
+            linhas.append(f"{nome:18} {'—':>9} {r['p95_ms']:10.2f}")
+            continue
+        delta = (r["p95_ms"] - b["p95_ms"]) / b["p95_ms"] if b["p95_ms"] else 0.0
+        ruim = (delta > limite and r["p95_ms"] - b["p95_ms"] > 1.0) or r["sql_req"] > b["sql_req"]
+        piorou |= ruim
+        linhas.append(f"{nome:18} {b['p95_ms']:9.2f} {r['p95_ms']:10.2f} {delta:+6.0%} "
+                      f"{b['sql_req']:9.2f} {r['sql_req']:10.2f}{'  ← piorou' if ruim else ''}")
+    return linhas, piorou
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--frota", choices=dados.FROTAS, default="1k")
+    ap.add_argument("--historico", type=int, default=100_000, help="linhas de histórico")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--sem-gerar", action="store_true", help="usa os dados já presentes")
+    ap.add_argument("--pg-local", metavar="DIR", help="sobe um PostgreSQL descartável em DIR")
+    ap.add_argument("--sqlite", metavar="ARQ", help="usa o modo SQLite no arquivo ARQ")
+    ap.add_argument("--clientes", type=int, default=8, help="clientes simultâneos")
+    ap.add_argument("--requisicoes", type=int, default=200, help="requisições medidas por rota")
+    ap.add_argument("--aquecimento", type=int, default=20, help="requisições descartadas por rota")
+    ap.add_argument("--rotas", default=",".join(ROTAS), help="lista separada por vírgulas")
+    ap.add_argument("--salvar", metavar="NOME", help="grava o resultado como baseline")
+    ap.add_argument("--comparar", metavar="NOME", help="compara com um baseline salvo")
+    ap.add_argument("--limite", type=float, default=0.15, help="piora tolerada no p95 (fração)")
+    args = ap.parse_args()
+    rotas = [r for r in args.rotas.split(",") if r]
+    for r in rotas:
+        if r not in ROTAS:
+            ap.error(f"rota desconhecida: {r} (opções: {', '.join(ROTAS)})")
+
+    configurar(ap, args, args.clientes)
+
+    import app as toner                                # migra e semeia o banco de benchmark
+    from db import observadores_sql
+
+    with toner.get_db() as conn:
+        if not args.sem_gerar:
+            dados.gerar(conn, dados.FROTAS[args.frota], args.historico, args.semente)
+        c = conn.cursor()
+        c.execute("SELECT id FROM usuarios WHERE is_admin=1 ORDER BY id LIMIT 1")
+        usuario_id = c.fetchone()[0]
+        c.execute("SELECT count(*) FROM estoque")
+        itens = c.fetchone()[0]
+        c.execute("SELECT count(*) FROM historico")
+        linhas_hist = c.fetchone()[0]
+
+    observadores_sql.append(_contar_sql)
+    resultado = {
+        "config": {"itens": itens, "historico": linhas_hist, "clientes": args.clientes,
+                   "requisicoes": args.requisicoes, "semente": args.semente},
+        "rotas": {},
+    }
+    print(f"{itens:,} itens, {linhas_hist:,} linhas de histórico, {args.clientes} clientes\n")
+    print(f"{'rota':18} {'n':>5} {'erros':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}")
+    for nome in rotas:
+        r = medir(toner, usuario_id, nome, args.requisicoes, args.clientes,
+                  args.aquecimento, args.semente, itens)
+        resultado["rotas"][nome] = r
+        print(f"{nome:18} {r['n']:5} {r['erros']:5} {r['rps']:8.1f} {r['p50_ms']:8.2f} "
+              f"{r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {r['sql_req']:8.2f}")
+
+    if args.salvar:
+        os.makedirs(BASELINES, exist_ok=True)
+        destino = os.path.join(BASELINES, f"{args.salvar}.json")
+        with open(destino, "w") as f:
+            json.dump(resultado, f, indent=2)
+        print(f"\nbaseline gravado em {destino}")
+
+    if args.comparar:
+        with open(os.path.join(BASELINES, f"{args.comparar}.json")) as f:
+            base = json.load(f)
+        if base["config"] != resultado["config"]:
+            print(f"\naviso: configuração diferente do baseline: {base['config']}")
+        linhas, piorou = comparar(resultado, base, args.limite)
+        print()
+        print("\n".join(linhas))
+        if piorou:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
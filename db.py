@@ -0,0 +1,387 @@
+"""
+Pool de conexões PostgreSQL (um por worker do gunicorn).
+
+Com DATABASE_URL=sqlite:///arquivo.db o banco é um arquivo SQLite local,
+com a mesma interface (ver db_sqlite.py); SQLITE/BACKEND dizem qual está
+em uso, para os poucos comandos que mudam de um para o outro.
+
+Uso:
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(...)
+
+Ao sair do bloco sem exceção a transação é confirmada (commit); com exceção
+é desfeita (rollback). Em ambos os casos a conexão volta para o pool.
+
+Configuração por variáveis de ambiente:
+    DB_POOL_MIN      conexões mantidas abertas            (padrão 1)
+    DB_POOL_MAX      limite de conexões por processo      (padrão 10)
+    DB_POOL_TIMEOUT  segundos esperando conexão livre     (padrão 5)
+    DB_POOL_RECYCLE  usos antes de reabrir a conexão      (padrão 1000)
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+log = logging.getLogger(__name__)
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro de DB_POOL_TIMEOUT."""
+
+
+# Chamados com (sql, segundos, linhas) depois de cada comando das conexões
+# do pool, e com (segundos_de_espera) a cada get_db() (ver metricas.py e
+# perfil.py). Devem ser baratos: rodam no caminho de toda consulta.
+observadores_sql     = []
+observadores_conexao = []
+# Chamados com (conn, confirmada) depois de cada commit/rollback das
+# conexões do pool, inclusive os feitos à mão (ver auditoria.py).
+observadores_transacao = []
+
+class CursorMedido(psycopg2.extensions.cursor):
+    """Cursor que mede o tempo de cada comando e avisa observadores_sql."""
+
+    def _medir(self, sql, fn, *args):
+        inicio = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            segundos = time.perf_counter() - inicio
+            for observador in observadores_sql:
+                observador(sql, segundos, self.rowcount)
+
+    def execute(self, sql, args=None):
+        return self._medir(sql, super().execute, sql, args)
+
+    def executemany(self, sql, args_seq):
+        return self._medir(sql, super().executemany, sql, args_seq)
+
+    def copy_expert(self, sql, arquivo, size=8192):
+        return self._medir(sql, super().copy_expert, sql, arquivo, size)
+
+
+class ConexaoMedida(psycopg2.extensions.connection):
+    """Conexão que avisa observadores_transacao do fim de cada transação."""
+
+    def commit(self):
+        super().commit()
+        for observador in observadores_transacao:
+            observador(self, True)
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            for observador in observadores_transacao:
+                observador(self, False)
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, recycle=1000):
+        self.dsn     = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+
+        self._cond  = threading.Condition()
+        self._idle  = []      # [(conn, usos)]
+        self._total = 0       # conexões abertas (livres + emprestadas)
+        self._pid   = os.getpid()
+
+        self.stats = {
+            "checkouts":      0,
+            "timeouts":       0,
+            "abertas":        0,   # conexões criadas desde o início
+            "fechadas":       0,
+            "descartadas":    0,   # falharam no health check
+            "recicladas":     0,
+            "espera_total_s": 0.0,
+        }
+
+    # ── Conexões ─────────────────────────────
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=ConexaoMedida,
+                                cursor_factory=CursorMedido)
+        conn.autocommit = False
+        return conn
+
+    def _close(self, conn):
+        self.stats["fechadas"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _saudavel(self, conn):
+        """Health check barato: conexão aberta e sem transação pendente."""
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _check_fork(self):
+        # Depois de um fork as conexões herdadas pertencem ao processo pai.
+        if self._pid != os.getpid():
+            self._idle  = []
+            self._total = 0
+            self._pid   = os.getpid()
+
+    # ── API ──────────────────────────────────
+    def getconn(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        with self._cond:
+            self._check_fork()
+            while True:
+                while self._idle:
+                    conn, usos = self._idle.pop()
+                    if self._saudavel(conn):
+                        self.stats["checkouts"] += 1
+                        self.stats["espera_total_s"] += time.monotonic() - inicio
+                        return conn, usos
+                    self.stats["descartadas"] += 1
+                    self._total -= 1
+                    self._close(conn)
+                if self._total < self.maxconn:
+                    self._total += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Nenhuma conexão livre em {self.timeout}s "
+                        f"(máximo {self.maxconn})")
+                self._cond.wait(restante)
+        # Conexão nova aberta fora do lock para não travar os outros threads.
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats["abertas"] += 1
+            self.stats["checkouts"] += 1
+            self.stats["espera_total_s"] += time.monotonic() - inicio
+        return conn, 0
+
+    def putconn(self, conn, usos, descartar=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            usos += 1
+            if usos >= self.recycle:
+                self.stats["recicladas"] += 1
+                descartar = True
+            if descartar or conn.closed:
+                self._total -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, usos))
+            self._cond.notify()
+
+    def preencher(self):
+        """Abre conexões até o mínimo configurado."""
+        while True:
+            with self._cond:
+                self._check_fork()
+                if self._total >= self.minconn:
+                    return
+                self._total += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self.stats["abertas"] += 1
+                self._idle.append((conn, 0))
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        inicio = time.perf_counter()
+        conn, usos = self.getconn()
+        for observador in observadores_conexao:
+            observador(time.perf_counter() - inicio)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                self.putconn(conn, usos, descartar=True)
+                raise
+            self.putconn(conn, usos)
+            raise
+        self.putconn(conn, usos)
+
+    def snapshot(self):
+        with self._cond:
+            self._check_fork()
+            emprestadas = self._total - len(self._idle)
+            return {
+                **self.stats,
+                "pid":         self._pid,
+                "min":         self.minconn,
+                "max":         self.maxconn,
+                "abertas_agora": self._total,
+                "livres":      len(self._idle),
+                "emprestadas": emprestadas,
+            }
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._total -= len(self._idle)
+            self._idle = []
+
+
+# ─────────────────────────────────────────────
+#  Pool global do processo
+# ─────────────────────────────────────────────
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+# sqlite:///arquivo.db -> banco embutido (db_sqlite.py); o resto, PostgreSQL.
+SQLITE  = DATABASE_URL.startswith("sqlite:")
+BACKEND = "sqlite" if SQLITE else "postgres"
+
+if SQLITE:
+    import db_sqlite
+    pool = db_sqlite.ConexoesPorThread(
+        db_sqlite.caminho(DATABASE_URL),
+        timeout=float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+        observadores_sql=observadores_sql,
+        observadores_conexao=observadores_conexao,
+        observadores_transacao=observadores_transacao,
+    )
+else:
+    pool = ConnectionPool(
+        DATABASE_URL,
+        minconn=int(os.environ.get("DB_POOL_MIN", 1)),
+        maxconn=int(os.environ.get("DB_POOL_MAX", 10)),
+        timeout=float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+        recycle=int(os.environ.get("DB_POOL_RECYCLE", 1000)),
+    )
+
+def get_db():
+    return pool.connection()
+
+def pool_stats():
+    return pool.snapshot()
+
+
+# ─────────────────────────────────────────────
+#  LISTEN/NOTIFY — um ouvinte por processo
+# ─────────────────────────────────────────────
+class Ouvinte:
+    """Conexão dedicada que escuta canais NOTIFY e despacha para callbacks.
+
+    Roda numa thread daemon iniciada sob demanda (e reiniciada após fork).
+    Se a conexão cair, reconecta com espera crescente e chama os callbacks
+    de `ao_reconectar`, já que notificações podem ter sido perdidas.
+    """
+
+    def __init__(self, dsn):
+        self.dsn          = dsn
+        self._lock        = threading.Lock()
+        self._canais      = {}    # canal -> [callback(payload)]
+        self._reconectar  = []
+        self._pid         = None
+        self._conn        = None
+        self.conectado    = False
+        self.recebidas    = 0
+
+    def inscrever(self, canal, callback):
+        with self._lock:
+            novo = canal not in self._canais
+            self._canais.setdefault(canal, []).append(callback)
+            conn = self._conn
+        if novo and conn is not None:
+            # Força a thread a reconectar já escutando o canal novo.
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def ao_reconectar(self, callback):
+        with self._lock:
+            self._reconectar.append(callback)
+
+    def garantir(self):
+        """Inicia a thread neste processo, se ainda não estiver rodando."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid  = os.getpid()
+            self._conn = None
+            threading.Thread(target=self._loop, name="ouvinte-notify",
+                             daemon=True).start()
+
+    def _loop(self):
+        espera = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with self._lock:
+                    canais = list(self._canais)
+                    reconectar = list(self._reconectar)
+                    self._conn = conn
+                c = conn.cursor()
+                for canal in canais:
+                    c.execute(f'LISTEN "{canal}"')
+                self.conectado, espera = True, 1
+                for cb in reconectar:
+                    cb()
+                while True:
+                    if select.select([conn], [], [], 30) != ([], [], []):
+                        conn.poll()
+                    else:
+                        c.execute("SELECT 1")   # keepalive
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        self.recebidas += 1
+                        with self._lock:
+                            callbacks = list(self._canais.get(n.channel, ()))
+                        for cb in callbacks:
+                            try:
+                                cb(n.payload)
+                            except Exception:
+                                log.exception("Erro tratando NOTIFY %s", n.channel)
+            except Exception:
+                self.conectado = False
+                if conn is not None and not conn.closed:
+                    conn.close()
+                log.warning("Ouvinte NOTIFY desconectado; nova tentativa em %ss", espera)
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+
+if SQLITE:
+    ouvinte = db_sqlite.OuvinteLocal()
+    pool.ao_confirmar = ouvinte.notificar
+else:
+    ouvinte = Ouvinte(DATABASE_URL)
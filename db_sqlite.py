@@ -0,0 +1,369 @@
+"""
+Modo SQLite: o banco num arquivo local, para instalações de um só escritório.
+
+Com DATABASE_URL=sqlite:///toner.db, db.py usa este módulo no lugar do
+pool PostgreSQL, com a mesma interface: get_db() entrega uma conexão cuja
+transação começa no primeiro comando, commit ao sair do bloco e rollback
+com exceção; cursores aceitam parâmetros %s / %(nome)s. Diferenças:
+
+  - uma conexão por thread, mantida aberta entre requisições (cache de
+    páginas e comandos preparados continuam quentes); um get_db() dentro
+    de outro, na mesma thread, entra na transação de fora;
+  - WAL: leituras não esperam a escrita nem a escrevem; escritas são
+    serializadas, esperando até DB_POOL_TIMEOUT segundos pela trava;
+  - NOTIFY vira entrega local: os triggers chamam notificar() e
+    notificar_linha(), e as notificações vão para o OuvinteLocal no
+    commit. Só o próprio processo as recebe: use um único worker do
+    gunicorn (com quantas threads quiser);
+  - data/hora é gravada como texto ISO 8601 em UTC e volta como datetime
+    com fuso (colunas TIMESTAMPTZ; DATE volta como date);
+  - SET LOCAL nome = 'valor' vale até o fim da transação e é lido por
+    current_setting(nome, true), como no PostgreSQL.
+
+Os triggers dependem das funções registradas aqui: altere o banco pela
+aplicação (ou pelo flask shell), não pelo cliente sqlite3.
+
+    DATABASE_URL     sqlite:///toner.db (relativo) ou sqlite:////var/lib/toner/toner.db
+    DB_POOL_TIMEOUT  segundos esperando a trava de escrita   (padrão 5)
+    SQLITE_CACHE_MB  cache de páginas por conexão            (padrão 32)
+    SQLITE_MMAP_MB   leitura do arquivo por mmap             (padrão 256)
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
+
+log = logging.getLogger(__name__)
+
+CACHE_MB = int(os.environ.get("SQLITE_CACHE_MB", 32))
+MMAP_MB  = int(os.environ.get("SQLITE_MMAP_MB", 256))
+
+# Expressão SQL do instante atual no mesmo formato de _iso(), para DEFAULT
+# de colunas (funções registradas não valem em DEFAULT).
+AGORA = "(strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))"
+
+PAYLOAD_MAX = 7900      # como o limite do NOTIFY: acima disso, "recarregar"
+
+
+def caminho(url):
+    """sqlite:///rel.db -> rel.db; sqlite:////abs/toner.db -> /abs/toner.db"""
+    p = urlsplit(url).path
+    return p[1:] if p.startswith("/") else p
+
+
+# ─────────────────────────────────────────────
+#  Tipos
+# ─────────────────────────────────────────────
+def _iso(dt):
+    return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+sqlite3.register_adapter(datetime, _iso)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter("TIMESTAMPTZ", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+
+
+@lru_cache(maxsize=16)
+def _fuso(nome):
+    return ZoneInfo(nome)
+
+@lru_cache(maxsize=4096)
+def _dia_local(ts, tz):
+    return datetime.fromisoformat(ts).astimezone(_fuso(tz)).date().isoformat()
+
+@lru_cache(maxsize=64)
+def _regex(padrao):
+    return re.compile(padrao)
+
+def _regexp_grupo(texto, padrao):
+    m = _regex(padrao).search(texto or "")
+    return m.group(1) if m else None
+
+
+# ─────────────────────────────────────────────
+#  Conexão e cursor
+# ─────────────────────────────────────────────
+_PARAM     = re.compile(r"%\((\w+)\)s|%s|%%")
+_SET_LOCAL = re.compile(r"\s*SET\s+LOCAL\s+([\w.]+)\s*=\s*'([^']*)'\s*$", re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def traduzir(sql):
+    """Parâmetros do psycopg2 (%s, %(nome)s, %%) -> sqlite3 (?, :nome, %)."""
+    return _PARAM.sub(lambda m: f":{m.group(1)}" if m.group(1)
+                      else "?" if m.group(0) == "%s" else "%", sql)
+
+def _literal(v):
+    if v is None:
+        return "NULL"
+    if isinstance(v, bool):
+        return str(int(v))
+    if isinstance(v, (int, float)):
+        return repr(v)
+    if isinstance(v, datetime):
+        v = _iso(v)
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+class CursorSQLite(sqlite3.Cursor):
+    """Cursor com parâmetros no estilo do psycopg2 e medição de cada comando."""
+
+    def _medir(self, sql, fn, *args):
+        inicio = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            segundos = time.perf_counter() - inicio
+            for observador in self.connection.observadores_sql:
+                observador(sql, segundos, self.rowcount)
+
+    def execute(self, sql, args=None):
+        conn = self.connection
+        m = _SET_LOCAL.match(sql)
+        if m:
+            conn.iniciar()
+            conn.locais[m.group(1)] = m.group(2)
+            return self
+        conn.iniciar()
+        if args is None:
+            return self._medir(sql, super().execute, sql)
+        return self._medir(sql, super().execute, traduzir(sql), args)
+
+    def executemany(self, sql, args_seq):
+        self.connection.iniciar()
+        return self._medir(sql, super().executemany, traduzir(sql), args_seq)
+
+    def mogrify(self, sql, args=None):
+        """Como o do psycopg2: o comando com os parâmetros já no texto (bytes)."""
+        if args is None:
+            return sql.encode()
+        if isinstance(args, dict):
+            texto = _PARAM.sub(lambda m: _literal(args[m.group(1)]) if m.group(1)
+                               else "%" if m.group(0) == "%%" else m.group(0), sql)
+        else:
+            valores = iter(args)
+            texto = _PARAM.sub(lambda m: _literal(next(valores)) if m.group(0) == "%s"
+                               else "%" if m.group(0) == "%%" else m.group(0), sql)
+        return texto.encode()
+
+
+class ConexaoSQLite(sqlite3.Connection):
+    """Conexão em modo autocommit do sqlite3, com BEGIN automático antes do
+    primeiro comando (como o psycopg2) e NOTIFY entregue no commit."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.em_uso    = False
+        self.locais    = {}          # SET LOCAL da transação corrente
+        self.pendentes = []          # [(canal, payload)] até o commit
+        self.linhas    = {}          # canal -> [json da linha] (notificar_linha)
+        self.observadores_sql = ()
+        self.observadores_transacao = ()
+        self.ao_confirmar     = None
+
+    def cursor(self, factory=CursorSQLite):
+        return super().cursor(factory)
+
+    def iniciar(self):
+        if not self.in_transaction:
+            super().execute("BEGIN")
+
+    def _limpar(self):
+        self.locais.clear()
+        pendentes, linhas = self.pendentes, self.linhas
+        self.pendentes, self.linhas = [], {}
+        return pendentes, linhas
+
+    def commit(self):
+        super().commit()
+        pendentes, linhas = self._limpar()
+        for canal, itens in linhas.items():
+            payload = '{"itens":[' + ",".join(itens) + "]}"
+            pendentes.append((canal, payload if len(payload.encode()) <= PAYLOAD_MAX
+                              else '{"recarregar":true}'))
+        if self.ao_confirmar is not None:
+            # Como no PostgreSQL: notificações idênticas na mesma transação
+            # são entregues uma vez.
+            for canal, payload in dict.fromkeys(pendentes):
+                self.ao_confirmar(canal, payload)
+        for observador in self.observadores_transacao:
+            observador(self, True)
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._limpar()
+            for observador in self.observadores_transacao:
+                observador(self, False)
+
+    # Funções chamadas pelos triggers
+    def _notificar(self, canal, payload):
+        self.pendentes.append((canal, "" if payload is None else str(payload)))
+
+    def _notificar_linha(self, canal, linha):
+        self.linhas.setdefault(canal, []).append(linha)
+
+    def _current_setting(self, nome, faltando_ok=False):
+        return self.locais.get(nome)
+
+
+class ConexoesPorThread:
+    """Uma conexão SQLite por thread, no lugar do ConnectionPool."""
+
+    def __init__(self, arquivo, timeout=5.0, observadores_sql=(),
+                 observadores_conexao=(), observadores_transacao=(), ao_confirmar=None):
+        self.arquivo  = arquivo
+        self.timeout  = timeout
+        self.observadores_sql     = observadores_sql
+        self.observadores_conexao = observadores_conexao
+        self.observadores_transacao = observadores_transacao
+        self.ao_confirmar = ao_confirmar
+        self._local   = threading.local()
+        self._abertas = weakref.WeakSet()
+        self._lock    = threading.Lock()
+        self._pid     = os.getpid()
+        self._herdadas = []      # do processo pai: nunca fechadas aqui
+        self.stats = {"checkouts": 0, "timeouts": 0, "abertas": 0}
+
+    def _conectar(self):
+        conn = sqlite3.connect(
+            self.arquivo, timeout=self.timeout, factory=ConexaoSQLite,
+            isolation_level=None, cached_statements=256,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        for pragma in ("journal_mode = WAL", "synchronous = NORMAL", "foreign_keys = ON",
+                       "temp_store = MEMORY", f"cache_size = -{CACHE_MB * 1024}",
+                       f"mmap_size = {MMAP_MB * 1024 * 1024}"):
+            conn.execute(f"PRAGMA {pragma}").fetchall()
+        conn.create_function("now", 0, lambda: _iso(datetime.now(timezone.utc)))
+        conn.create_function("dia_local", 2, _dia_local, deterministic=True)
+        conn.create_function("regexp_grupo", 2, _regexp_grupo, deterministic=True)
+        conn.create_function("notificar", 2, conn._notificar)
+        conn.create_function("notificar_linha", 2, conn._notificar_linha)
+        conn.create_function("current_setting", 2, conn._current_setting)
+        conn.observadores_sql = self.observadores_sql
+        conn.observadores_transacao = self.observadores_transacao
+        conn.ao_confirmar = self.ao_confirmar
+        with self._lock:
+            self.stats["abertas"] += 1
+            self._abertas.add(conn)
+        return conn
+
+    def _obter(self):
+        if self._pid != os.getpid():
+            # Conexão SQLite não atravessa fork: as herdadas ficam para trás.
+            with self._lock:
+                self._herdadas.extend(self._abertas)
+                self._abertas = weakref.WeakSet()
+                self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._conectar()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        inicio = time.perf_counter()
+        conn = self._obter()
+        self.stats["checkouts"] += 1
+        for observador in self.observadores_conexao:
+            observador(time.perf_counter() - inicio)
+        if conn.em_uso:
+            yield conn                  # aninhado: quem abriu faz o commit
+            return
+        conn.em_uso = True
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+                self.stats["timeouts"] += 1
+            conn.rollback()
+            raise
+        finally:
+            conn.em_uso = False
+
+    def snapshot(self):
+        with self._lock:
+            abertas = list(self._abertas)
+        return {
+            **self.stats,
+            "backend":       "sqlite",
+            "arquivo":       self.arquivo,
+            "pid":           self._pid,
+            "abertas_agora": len(abertas),
+            "emprestadas":   sum(c.em_uso for c in abertas),
+        }
+
+    def closeall(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+
+# ─────────────────────────────────────────────
+#  Ouvinte local (no lugar de LISTEN/NOTIFY)
+# ─────────────────────────────────────────────
+class OuvinteLocal:
+    """Mesma interface de db.Ouvinte. As notificações chegam do commit das
+    conexões deste processo e os callbacks rodam numa thread própria, como
+    no PostgreSQL (nunca na thread de quem gravou)."""
+
+    def __init__(self):
+        self._lock       = threading.Lock()
+        self._canais     = {}
+        self._pid        = None
+        self._fila       = None
+        self.conectado   = True
+        self.recebidas   = 0
+
+    def inscrever(self, canal, callback):
+        with self._lock:
+            self._canais.setdefault(canal, []).append(callback)
+
+    def ao_reconectar(self, callback):
+        pass                    # não há conexão para perder
+
+    def garantir(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid, self._fila = os.getpid(), queue.SimpleQueue()
+            threading.Thread(target=self._loop, name="ouvinte-local", daemon=True).start()
+
+    def notificar(self, canal, payload):
+        # Sem ouvinte neste processo (CLI, migração), a notificação se perde,
+        # como um NOTIFY sem LISTEN.
+        if self._pid == os.getpid():
+            self._fila.put((canal, payload))
+
+    def _loop(self):
+        fila = self._fila
+        while True:
+            canal, payload = fila.get()
+            self.recebidas += 1
+            with self._lock:
+                callbacks = list(self._canais.get(canal, ()))
+            for cb in callbacks:
+                try:
+                    cb(payload)
+                except Exception:
+                    log.exception("Erro tratando notificação %s", canal)
+
+
+def carregar_json(valor):
+    """Resultado de json_group_array() (texto) -> lista; None -> None."""
+    return json.loads(valor) if isinstance(valor, str) else valor
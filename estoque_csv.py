@@ -0,0 +1,293 @@
+"""
+Importação e exportação do estoque em CSV, via COPY.
+
+Importar: o CSV é validado linha a linha (erros com o número da linha),
+normalizado num arquivo temporário e carregado com um único COPY numa
+tabela temporária; um só comando (UPDATE + INSERT numa CTE) aplica tudo em
+estoque, casando os itens por (codigo, setor). Com qualquer erro, nada é
+gravado.
+
+Colunas: codigo, setor e quantidade são obrigatórias; tipo, aguardando,
+tinta_pct e observacao são opcionais — fora do cabeçalho, os itens
+existentes mantêm o valor atual e os novos recebem o padrão. Aceita
+separador "," ou ";" (Excel pt-BR) e UTF-8 com ou sem BOM.
+
+Exportar: COPY ... TO STDOUT para um arquivo temporário; a conexão volta
+ao pool antes de a resposta começar a ser enviada.
+
+No modo SQLite não há COPY: a carga na tabela temporária é um
+executemany() e a exportação passa pelo csv.writer; o resto é igual.
+"""
+
+import codecs
+import csv
+import io
+import tempfile
+
+import db
+
+COLUNAS      = ("codigo", "setor", "tipo", "quantidade", "aguardando", "tinta_pct", "observacao")
+OBRIGATORIAS = ("codigo", "setor", "quantidade")
+TIPOS        = ("pb", "colorida")
+ACAO         = "Importação"      # acao registrada no histórico
+MAX_ERROS    = 100               # erros listados antes de desistir
+EM_MEMORIA   = 8 * 1024 * 1024   # acima disso o arquivo temporário vai para o disco
+TRAVA        = 72_012_000        # pg_advisory_xact_lock: uma importação por vez
+
+
+class ErroImportacao(ValueError):
+    """CSV inválido; `erros` é [(linha, mensagem)]."""
+
+    def __init__(self, erros):
+        super().__init__(f"{len(erros)} erro(s) no CSV")
+        self.erros = erros
+
+
+def _inteiro(valor, minimo, maximo):
+    n = int(valor)
+    if not minimo <= n <= maximo:
+        raise ValueError
+    return n
+
+def _normalizar(campos):
+    """dict da linha -> dict normalizado; ValueError com a mensagem."""
+    item = {}
+    for col in ("codigo", "setor"):
+        item[col] = campos[col].strip()
+        if not item[col]:
+            raise ValueError(f"{col} vazio")
+    try:
+        item["quantidade"] = _inteiro(campos["quantidade"], 0, 10**6)
+    except ValueError:
+        raise ValueError(f"quantidade inválida: {campos['quantidade']!r}") from None
+    if "tipo" in campos:
+        item["tipo"] = campos["tipo"].strip().lower() or "pb"
+        if item["tipo"] not in TIPOS:
+            raise ValueError(f"tipo deve ser pb ou colorida: {campos['tipo']!r}")
+    if "aguardando" in campos:
+        try:
+            item["aguardando"] = _inteiro(campos["aguardando"].strip() or 0, 0, 1)
+        except ValueError:
+            raise ValueError(f"aguardando deve ser 0 ou 1: {campos['aguardando']!r}") from None
+    if "tinta_pct" in campos:
+        v = campos["tinta_pct"].strip().rstrip("%")
+        try:
+            item["tinta_pct"] = _inteiro(v, 0, 100) if v else None
+        except ValueError:
+            raise ValueError(f"tinta_pct deve ser de 0 a 100: {campos['tinta_pct']!r}") from None
+    if "observacao" in campos:
+        item["observacao"] = campos["observacao"].strip()
+    return item
+
+def validar(arquivo):
+    """Lê o CSV (binário) e retorna (colunas, arquivo normalizado, linhas).
+
+    O arquivo normalizado está pronto para COPY ... FORMAT csv, na ordem de
+    `colunas`. Levanta ErroImportacao com os erros por linha."""
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    try:
+        cabecalho = texto.readline()
+    except UnicodeDecodeError:
+        texto.detach()
+        raise ErroImportacao([(1, "arquivo ilegível (use CSV em UTF-8)")]) from None
+    sep = ";" if cabecalho.count(";") > cabecalho.count(",") else ","
+    nomes = [n.strip().lower() for n in next(csv.reader([cabecalho], delimiter=sep), [])]
+
+    erros = [(1, f"coluna desconhecida: {n!r}") for n in nomes if n not in COLUNAS]
+    erros += [(1, f"coluna obrigatória ausente: {n}") for n in OBRIGATORIAS if n not in nomes]
+    if len(set(nomes)) != len(nomes):
+        erros.append((1, "coluna repetida no cabeçalho"))
+    if erros:
+        raise ErroImportacao(erros)
+    colunas = [c for c in COLUNAS if c in nomes]
+
+    saida = tempfile.SpooledTemporaryFile(EM_MEMORIA, mode="w+", encoding="utf-8", newline="")
+    buf = io.StringIO()            # escrito em blocos: SpooledTemporaryFile.write é caro por linha
+    escritor = csv.writer(buf)
+    vistos = {}                    # (codigo, setor) -> linha
+    linhas = 0
+    leitor = csv.reader(texto, delimiter=sep)
+    fim_anterior = 1
+    while len(erros) < MAX_ERROS:
+        try:
+            campos = next(leitor, None)
+        except (UnicodeDecodeError, csv.Error) as e:
+            erros.append((fim_anterior + 1, "arquivo ilegível (use CSV em UTF-8): "
+                                            + (e.reason if isinstance(e, UnicodeDecodeError) else str(e))))
+            break
+        if campos is None:
+            break
+        linha, fim_anterior = fim_anterior + 1, leitor.line_num + 1
+        if not any(v.strip() for v in campos):
+            continue
+        if len(campos) != len(nomes):
+            erros.append((linha, f"{len(campos)} campos, esperados {len(nomes)}"))
+        else:
+            try:
+                item = _normalizar(dict(zip(nomes, campos)))
+            except ValueError as e:
+                erros.append((linha, str(e)))
+            else:
+                chave = (item["codigo"], item["setor"])
+                if chave in vistos:
+                    erros.append((linha, f"{chave[0]} / {chave[1]} repete a linha {vistos[chave]}"))
+                else:
+                    vistos[chave] = linha
+                    escritor.writerow([item[c] for c in colunas])
+                    linhas += 1
+                    if buf.tell() > 256 * 1024:
+                        saida.write(buf.getvalue())
+                        buf.seek(0)
+                        buf.truncate()
+    texto.detach()
+    if erros:
+        saida.close()
+        raise ErroImportacao(erros)
+    saida.write(buf.getvalue())
+    saida.seek(0)
+    return colunas, saida, linhas
+
+def importar(conn, arquivo, usuario=None):
+    """Valida e aplica o CSV em estoque, numa transação (o commit é do chamador).
+
+    Retorna {"linhas", "inseridos", "atualizados", "inalterados"}."""
+    colunas, dados, linhas = validar(arquivo)
+    c = conn.cursor()
+    if db.SQLITE:
+        atualizados, inseridos = _aplicar_sqlite(c, colunas, dados)
+    else:
+        atualizados, inseridos = _aplicar(c, colunas, dados)
+    resumo = {"linhas": linhas, "inseridos": inseridos, "atualizados": atualizados,
+              "inalterados": linhas - inseridos - atualizados}
+    c.execute("INSERT INTO historico (estoque_id, usuario, acao, detalhe) VALUES (NULL, %s, %s, %s)",
+              (usuario, ACAO, f"CSV: {linhas} linhas — {inseridos} novos, "
+                              f"{atualizados} atualizados, {resumo['inalterados']} sem alteração"))
+    return resumo
+
+def _aplicar(c, colunas, dados):
+    """COPY na tabela temporária e UPDATE + INSERT; (atualizados, inseridos)."""
+    # Duas importações simultâneas inseririam o mesmo item novo duas vezes.
+    c.execute("SELECT pg_advisory_xact_lock(%s)", (TRAVA,))
+    c.execute("""
+        CREATE TEMP TABLE estoque_import (
+            codigo     TEXT NOT NULL,
+            setor      TEXT NOT NULL,
+            tipo       TEXT,
+            quantidade INTEGER NOT NULL,
+            aguardando INTEGER,
+            tinta_pct  INTEGER,
+            observacao TEXT
+        ) ON COMMIT DROP
+    """)
+    lista = ", ".join(colunas)
+    texto = [col for col in ("codigo", "setor", "tipo", "observacao") if col in colunas]
+    with dados:
+        c.copy_expert(f"COPY estoque_import ({lista}) FROM STDIN WITH "
+                      f"(FORMAT csv, FORCE_NOT_NULL ({', '.join(texto)}))", dados)
+    c.execute("ANALYZE estoque_import")
+
+    # Só reescreve as linhas que mudaram: reimportar a mesma planilha não
+    # deixa 100k versões mortas de linha para o autovacuum.
+    alterar = [col for col in colunas if col not in ("codigo", "setor")]
+    c.execute(f"""
+        WITH atualizados AS (
+            UPDATE estoque e SET {", ".join(f"{col}=i.{col}" for col in alterar)}, versao=e.versao+1
+            FROM estoque_import i
+            WHERE e.codigo = i.codigo AND e.setor = i.setor
+              AND ({", ".join(f"e.{col}" for col in alterar)})
+                  IS DISTINCT FROM ({", ".join(f"i.{col}" for col in alterar)})
+            RETURNING e.codigo, e.setor
+        ), inseridos AS (
+            INSERT INTO estoque ({lista})
+            SELECT {lista} FROM estoque_import i
+            WHERE NOT EXISTS (SELECT 1 FROM estoque e
+                              WHERE e.codigo = i.codigo AND e.setor = i.setor)
+            RETURNING 1
+        )
+        SELECT (SELECT count(DISTINCT (codigo, setor)) FROM atualizados),
+               (SELECT count(*) FROM inseridos)
+    """)
+    atualizados, inseridos = c.fetchone()
+    c.execute("DROP TABLE estoque_import")
+    return atualizados, inseridos
+
+def _aplicar_sqlite(c, colunas, dados):
+    """Mesmo efeito de _aplicar() no SQLite. Sem trava consultiva: o
+    UPDATE já pega a trava de escrita do arquivo até o commit."""
+    c.execute("DROP TABLE IF EXISTS temp.estoque_import")
+    c.execute("""
+        CREATE TEMP TABLE estoque_import (
+            codigo     TEXT NOT NULL,
+            setor      TEXT NOT NULL,
+            tipo       TEXT,
+            quantidade INTEGER NOT NULL,
+            aguardando INTEGER,
+            tinta_pct  INTEGER,
+            observacao TEXT
+        )
+    """)
+    lista = ", ".join(colunas)
+    # Como o COPY com FORCE_NOT_NULL: campo vazio é NULL, exceto nos de texto.
+    texto = [col in ("codigo", "setor", "tipo", "observacao") for col in colunas]
+    with dados:
+        c.executemany(f"INSERT INTO estoque_import ({lista}) VALUES ({', '.join(['%s'] * len(colunas))})",
+                      ([v if v or t else None for v, t in zip(linha, texto)]
+                       for linha in csv.reader(dados)))
+
+    alterar = [col for col in colunas if col not in ("codigo", "setor")]
+    c.execute(f"""
+        UPDATE estoque SET {", ".join(f"{col}=i.{col}" for col in alterar)}, versao=estoque.versao+1
+        FROM estoque_import i
+        WHERE estoque.codigo = i.codigo AND estoque.setor = i.setor
+          AND ({", ".join(f"estoque.{col}" for col in alterar)})
+              IS DISTINCT FROM ({", ".join(f"i.{col}" for col in alterar)})
+        RETURNING codigo, setor
+    """)
+    atualizados = len(set(c.fetchall()))
+    c.execute(f"""
+        INSERT INTO estoque ({lista})
+        SELECT {lista} FROM estoque_import i
+        WHERE NOT EXISTS (SELECT 1 FROM estoque e
+                          WHERE e.codigo = i.codigo AND e.setor = i.setor)
+    """)
+    inseridos = c.rowcount
+    c.execute("DROP TABLE estoque_import")
+    return atualizados, inseridos
+
+
+def exportar(conn):
+    """Estoque inteiro em CSV (UTF-8 com BOM, para o Excel), num arquivo
+    temporário posicionado no início."""
+    saida = tempfile.SpooledTemporaryFile(EM_MEMORIA, mode="w+b")
+    saida.write(codecs.BOM_UTF8)
+    if db.SQLITE:
+        _exportar_sqlite(conn.cursor(), saida)
+        saida.seek(0)
+        return saida
+    conn.cursor().copy_expert(
+        f"COPY (SELECT {', '.join(COLUNAS)} FROM estoque ORDER BY setor, codigo) "
+        f"TO STDOUT WITH (FORMAT csv, HEADER)", saida)
+    saida.seek(0)
+    return saida
+
+def _exportar_sqlite(c, saida):
+    # Mesmo formato do COPY: NULL vira campo vazio, linhas terminam em \n.
+    buf = io.StringIO()
+    escritor = csv.writer(buf, lineterminator="\n")
+    escritor.writerow(COLUNAS)
+    c.execute(f"SELECT {', '.join(COLUNAS)} FROM estoque ORDER BY setor, codigo")
+    while linhas := c.fetchmany(5000):
+        escritor.writerows(linhas)
+        saida.write(buf.getvalue().encode())
+        buf.seek(0)
+        buf.truncate()
+    saida.write(buf.getvalue().encode())
+
+def blocos(arquivo, tamanho=64 * 1024):
+    """Gera o conteúdo do arquivo em blocos e o fecha ao final."""
+    with arquivo:
+        while True:
+            bloco = arquivo.read(tamanho)
+            if not bloco:
+                return
+            yield bloco
@@ -0,0 +1,201 @@
+"""
+Eventos ao vivo do inventário (Server-Sent Events).
+
+Triggers em estoque fazem pg_notify('estoque_alterado', ...) com as linhas
+alteradas por cada comando. Em cada worker, o ouvinte compartilhado
+(db.ouvinte) recebe a notificação uma vez; o Difusor monta a mensagem SSE
+uma vez e a coloca na fila de cada cliente conectado em /eventos.
+
+Cada evento leva como `id` a versão do estoque (stats.versao_estoque). Ao
+reconectar, o navegador manda o último id em Last-Event-ID; se o estoque
+mudou no intervalo, o cliente recebe "recarregar" em vez de perder
+alterações. O mesmo vale para cliente lento (fila cheia) e para o ouvinte
+que perdeu a conexão com o banco.
+
+Cada cliente ocupa uma thread do worker (gunicorn gthread) enquanto
+conectado, então há limite por worker e a conexão é encerrada depois de
+SSE_DURACAO segundos (o EventSource reconecta sozinho). No modo ASGI
+(asgi.py) o cliente é só uma fila asyncio no event loop (DifusorAsync), e o
+limite é bem maior.
+
+    SSE_MAX_CLIENTES       clientes simultâneos por worker        (padrão 20)
+    SSE_MAX_CLIENTES_ASGI  idem, no modo ASGI                     (padrão 5000)
+    SSE_DURACAO            segundos por conexão                   (padrão 300)
+"""
+
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+MAX_CLIENTES = int(os.environ.get("SSE_MAX_CLIENTES", 20))
+MAX_CLIENTES_ASGI = int(os.environ.get("SSE_MAX_CLIENTES_ASGI", 5000))
+DURACAO      = float(os.environ.get("SSE_DURACAO", 300))
+KEEPALIVE    = 15     # segundos entre comentários ": ping" (proxies derrubam conexão ociosa)
+RETRY_MS     = 3000   # espera do EventSource antes de reconectar
+
+
+def mensagem(evento, dados, id_=None):
+    linhas = [f"event: {evento}"]
+    if id_ is not None:
+        linhas.append(f"id: {id_}")
+    linhas.append("data: " + json.dumps(dados, separators=(",", ":"), ensure_ascii=False))
+    return "\n".join(linhas) + "\n\n"
+
+RECARREGAR = mensagem("recarregar", {})
+
+
+class Difusor:
+    """Filas dos clientes SSE deste worker."""
+
+    def __init__(self, max_clientes=MAX_CLIENTES, tamanho_fila=64):
+        self.max_clientes = max_clientes
+        self.tamanho_fila = tamanho_fila
+        self._lock        = threading.Lock()
+        self._clientes    = set()
+        self.publicadas   = 0
+        self.atrasados    = 0    # clientes cuja fila encheu
+
+    @property
+    def conectados(self):
+        return len(self._clientes)
+
+    def conectar(self):
+        """Fila do novo cliente, ou None se o worker já está no limite."""
+        with self._lock:
+            if len(self._clientes) >= self.max_clientes:
+                return None
+            fila = queue.Queue(self.tamanho_fila)
+            self._clientes.add(fila)
+            return fila
+
+    def desconectar(self, fila):
+        with self._lock:
+            self._clientes.discard(fila)
+
+    def publicar(self, msg):
+        with self._lock:
+            clientes = list(self._clientes)
+            self.publicadas += 1
+        for fila in clientes:
+            try:
+                fila.put_nowait(msg)
+            except queue.Full:
+                # Cliente lento: o que está na fila já não serve, recarrega.
+                self.atrasados += 1
+                try:
+                    while True:
+                        fila.get_nowait()
+                except queue.Empty:
+                    pass
+                fila.put_nowait(RECARREGAR)
+
+    def transmitir(self, fila, inicial=()):
+        """Gerador do corpo da resposta SSE; libera a fila ao terminar."""
+        fim = time.monotonic() + DURACAO
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            yield from inicial
+            while True:
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    return
+                try:
+                    yield fila.get(timeout=min(KEEPALIVE, restante))
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.desconectar(fila)
+
+    def stats(self):
+        return {"conectados": self.conectados, "max": self.max_clientes,
+                "publicadas": self.publicadas, "atrasados": self.atrasados}
+
+
+class DifusorAsync:
+    """Como o Difusor, para o modo ASGI: filas asyncio de um único event loop.
+
+    publicar() pode vir de qualquer thread (o ouvinte NOTIFY roda na sua);
+    a entrega nas filas é agendada no loop.
+    """
+
+    def __init__(self, max_clientes=MAX_CLIENTES_ASGI, tamanho_fila=64):
+        self.max_clientes = max_clientes
+        self.tamanho_fila = tamanho_fila
+        self._loop        = None
+        self._clientes    = set()
+        self.publicadas   = 0
+        self.atrasados    = 0
+
+    @property
+    def conectados(self):
+        return len(self._clientes)
+
+    def conectar(self):
+        """Fila do novo cliente, ou None no limite. Chamado no event loop."""
+        if len(self._clientes) >= self.max_clientes:
+            return None
+        self._loop = asyncio.get_running_loop()
+        fila = asyncio.Queue(self.tamanho_fila)
+        self._clientes.add(fila)
+        return fila
+
+    def desconectar(self, fila):
+        self._clientes.discard(fila)
+
+    def publicar(self, msg):
+        if self._loop is None or not self._clientes:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._entregar, msg)
+        except RuntimeError:
+            pass          # loop encerrado (fim do worker)
+
+    def _entregar(self, msg):
+        self.publicadas += 1
+        for fila in list(self._clientes):
+            try:
+                fila.put_nowait(msg)
+            except asyncio.QueueFull:
+                # Cliente lento: o que está na fila já não serve, recarrega.
+                self.atrasados += 1
+                while not fila.empty():
+                    fila.get_nowait()
+                fila.put_nowait(RECARREGAR)
+
+    async def transmitir(self, fila, inicial=()):
+        """Corpo da resposta SSE (gerador assíncrono); libera a fila ao terminar."""
+        fim = time.monotonic() + DURACAO
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for msg in inicial:
+                yield msg
+            while True:
+                restante = fim - time.monotonic()
+                if restante <= 0:
+                    return
+                try:
+                    yield await asyncio.wait_for(fila.get(), min(KEEPALIVE, restante))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            self.desconectar(fila)
+
+    def stats(self):
+        return {"conectados": self.conectados, "max": self.max_clientes,
+                "publicadas": self.publicadas, "atrasados": self.atrasados}
+
+
+difusor = Difusor()
+difusor_async = DifusorAsync()
+
+
+def conectados():
+    """Clientes SSE deste processo, nos dois modos."""
+    return difusor.conectados + difusor_async.conectados
+
+def publicar(msg):
+    difusor.publicar(msg)
+    difusor_async.publicar(msg)
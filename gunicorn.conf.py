@@ -0,0 +1,26 @@
+"""
+Ganchos do gunicorn (lido do diretório atual; o Procfile o passa com --config).
+
+Servem às métricas (metricas.py): cada master junta os arquivos dos seus
+workers num subdiretório novo de METRICAS_DIR, e o arquivo de um worker
+que termina, normal ou morto, é marcado como de quem saiu, para os gauges
+dele pararem de contar.
+"""
+
+import os
+
+import metricas
+
+
+def on_starting(server):
+    server.log.info("Métricas em %s", metricas.nova_execucao())
+
+
+def worker_exit(server, worker):
+    # O gunicorn também chama este gancho no master, para um worker que já sumiu.
+    if worker.pid == os.getpid():
+        metricas.registro.encerrar()
+
+
+def child_exit(server, worker):
+    metricas.marcar_saida(worker.pid)
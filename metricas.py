@@ -0,0 +1,255 @@
+"""
+Métricas no formato texto do Prometheus (GET /metrics).
+
+Cada worker mantém em memória contadores, gauges e histogramas com
+rótulos. Como o gunicorn pode ter vários workers e o Prometheus fala com
+um só por coleta, cada worker grava o seu estado em METRICAS_DIR/<pid>.json
+(ao fim de uma requisição, no máximo a cada METRICAS_INTERVALO segundos);
+o worker que responde /metrics soma os arquivos dos demais ao seu estado
+atual. Arquivos de workers que já saíram continuam somando contadores e
+histogramas, que não voltam para trás quando o gunicorn recicla um
+worker; gauges (valores do momento) só contam dos workers vivos.
+
+Quem diz que um worker saiu é o gunicorn, não o pid: os ganchos de
+gunicorn.conf.py renomeiam o arquivo para saiu-<pid>-<ns>.json quando o
+worker termina (child_exit, no master, vale também para worker morto) e
+dão a cada master um subdiretório novo de METRICAS_DIR (on_starting), de
+modo que pids reaproveitados e arquivos de antes de um restart não se
+confundem com workers vivos. No uvicorn, o worker marca o próprio arquivo
+ao encerrar (asgi.py).
+
+    METRICAS_DIR        diretório comum aos workers   (padrão: temporário, por master)
+    METRICAS_INTERVALO  segundos entre gravações      (padrão 5)
+    METRICAS_TOKEN      token exigido em /metrics     (sem ele, só admin logado)
+    DB_LENTA_MS         consulta lenta: conta e loga  (padrão 200)
+"""
+
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+INTERVALO = float(os.environ.get("METRICAS_INTERVALO", 5))
+LENTA_S   = float(os.environ.get("DB_LENTA_MS", 200)) / 1000
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_SQL  = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+# nome -> (tipo, ajuda, buckets)
+METRICAS = {
+    "toner_http_requisicoes_total":       ("counter",   "Requisições atendidas, por rota, método e status.", None),
+    "toner_http_duracao_segundos":        ("histogram", "Tempo de resposta por rota (até o início do corpo).", BUCKETS_HTTP),
+    "toner_db_consulta_duracao_segundos": ("histogram", "Tempo de cada comando SQL, pela rota que o executou.", BUCKETS_SQL),
+    "toner_db_consultas_lentas_total":    ("counter",   "Comandos SQL acima de DB_LENTA_MS, por rota.", None),
+    "toner_db_conexoes_abertas_total":    ("counter",   "Conexões abertas pelo pool desde o início.", None),
+    "toner_db_pool_timeouts_total":       ("counter",   "Esperas por conexão livre que estouraram o tempo.", None),
+    "toner_db_pool_emprestadas":          ("gauge",     "Conexões do pool em uso agora.", None),
+    "toner_db_pool_abertas":              ("gauge",     "Conexões do pool abertas agora (livres + em uso).", None),
+    "toner_sse_clientes":                 ("gauge",     "Clientes conectados em /eventos.", None),
+    "toner_historico_fila":               ("gauge",     "Linhas de histórico esperando o gravador em lote.", None),
+    "toner_historico_gravadas_total":     ("counter",   "Linhas de histórico gravadas em lote.", None),
+    "toner_historico_fila_cheia_total":   ("counter",   "Movimentos que gravaram o histórico na transação (fila cheia).", None),
+    "toner_estoque_unidades":             ("gauge",     "Unidades de toner em estoque.", None),
+    "toner_estoque_itens":                ("gauge",     "Itens (setores) cadastrados.", None),
+    "toner_estoque_ok":                   ("gauge",     "Itens com estoque.", None),
+    "toner_estoque_zerados":              ("gauge",     "Itens com estoque zerado.", None),
+    "toner_estoque_sem_pedido":           ("gauge",     "Itens zerados sem pedido em aberto.", None),
+    "toner_estoque_aguardando":           ("gauge",     "Itens com pedido em trânsito.", None),
+    "toner_estoque_tinta_critica":        ("gauge",     "Itens com nível de tinta crítico.", None),
+}
+
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted(rotulos.items()))
+
+
+class Registro:
+    """Métricas deste worker."""
+
+    def __init__(self, diretorio=None, intervalo=INTERVALO):
+        self._diretorio = diretorio
+        self.intervalo  = intervalo
+        self._lock      = threading.Lock()
+        self._pid       = os.getpid()
+        self._valores   = {}     # (nome, rótulos) -> número (counter/gauge)
+        self._hist      = {}     # (nome, rótulos) -> [por bucket..., +Inf, soma]
+        self._gravado   = 0.0
+        self.coletores  = []     # funções chamadas antes de exportar o estado
+
+    @property
+    def diretorio(self):
+        # Os workers do mesmo master compartilham o diretório; decidido no
+        # worker (depois do fork), onde o master já passou por nova_execucao()
+        # ou, sem gunicorn.conf.py, getppid() é o master.
+        if self._diretorio is None:
+            self._diretorio = (os.environ.get("METRICAS_DIR") or
+                               os.path.join(tempfile.gettempdir(), f"toner-metricas-{os.getppid()}"))
+        return self._diretorio
+
+    def _check_fork(self):
+        # Herdado do master (ex.: --preload): o que ele contou não é deste worker.
+        if self._pid != os.getpid():
+            self._pid, self._valores, self._hist, self._gravado = os.getpid(), {}, {}, 0.0
+
+    # ── Registro ─────────────────────────────
+    def contar(self, nome, valor=1, **rotulos):
+        k = _chave(nome, rotulos)
+        with self._lock:
+            self._check_fork()
+            self._valores[k] = self._valores.get(k, 0) + valor
+
+    def definir(self, nome, valor, **rotulos):
+        with self._lock:
+            self._check_fork()
+            self._valores[_chave(nome, rotulos)] = valor
+
+    def observar(self, nome, valor, **rotulos):
+        buckets = METRICAS[nome][2]
+        k = _chave(nome, rotulos)
+        with self._lock:
+            self._check_fork()
+            h = self._hist.get(k)
+            if h is None:
+                h = self._hist[k] = [0] * (len(buckets) + 2)
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    h[i] += 1
+                    break
+            else:
+                h[len(buckets)] += 1
+            h[-1] += valor
+
+    # ── Estado compartilhado entre workers ───
+    def estado(self):
+        for coletor in self.coletores:
+            coletor(self)
+        with self._lock:
+            self._check_fork()
+            return {"valores": [[n, list(r), v] for (n, r), v in self._valores.items()],
+                    "hist":    [[n, list(r), h[:]] for (n, r), h in self._hist.items()]}
+
+    def gravar(self, forcar=False):
+        """Grava o estado deste worker, se já passou `intervalo` desde a última vez."""
+        agora = time.monotonic()
+        if not forcar and agora - self._gravado < self.intervalo:
+            return
+        self._gravado = agora
+        os.makedirs(self.diretorio, exist_ok=True)
+        destino = os.path.join(self.diretorio, f"{os.getpid()}.json")
+        tmp = f"{destino}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.estado(), f, separators=(",", ":"))
+            os.replace(tmp, destino)
+        except OSError as e:
+            log.warning("métricas: não foi possível gravar %s: %s", destino, e)
+
+    def encerrar(self):
+        """Fim do worker: grava o estado final e o marca como de quem saiu."""
+        self.gravar(forcar=True)
+        marcar_saida(os.getpid(), self.diretorio)
+
+    def coletar(self):
+        """Estado deste worker somado aos arquivos dos outros."""
+        valores, hist = {}, {}
+        estados = [(self.estado(), True)]
+        proprio = f"{os.getpid()}.json"
+        for caminho in glob.glob(os.path.join(self.diretorio, "*.json")):
+            nome = os.path.basename(caminho)
+            if nome == proprio:
+                continue
+            try:
+                with open(caminho) as f:
+                    estados.append((json.load(f), not nome.startswith(SAIU)))
+            except (OSError, ValueError):
+                continue          # worker gravando ou arquivo truncado: fica para a próxima
+        for e, vivo in estados:
+            for nome, rotulos, v in e["valores"]:
+                if not vivo and METRICAS.get(nome, ("gauge",))[0] == "gauge":
+                    continue      # conexões, clientes, fila: de um worker que saiu, não existem mais
+                k = (nome, tuple(map(tuple, rotulos)))
+                valores[k] = valores.get(k, 0) + v
+            for nome, rotulos, h in e["hist"]:
+                k = (nome, tuple(map(tuple, rotulos)))
+                atual = hist.get(k)
+                hist[k] = h[:] if atual is None else [a + b for a, b in zip(atual, h)]
+        return valores, hist
+
+
+# ── Ciclo de vida dos workers (gunicorn.conf.py) ──
+SAIU = "saiu-"      # prefixo dos arquivos de workers que já saíram
+
+
+def nova_execucao():
+    """No master, ao iniciar: um subdiretório de METRICAS_DIR só desta
+    execução, que os workers herdam pelo ambiente."""
+    base = os.environ.get("METRICAS_DIR") or os.path.join(tempfile.gettempdir(), "toner-metricas")
+    os.makedirs(base, exist_ok=True)
+    os.environ["METRICAS_DIR"] = tempfile.mkdtemp(prefix="execucao-", dir=base)
+    return os.environ["METRICAS_DIR"]
+
+
+def marcar_saida(pid, diretorio=None):
+    """O worker `pid` saiu: o arquivo dele passa a somar só contadores e
+    histogramas. Um worker novo com o mesmo pid grava outro <pid>.json."""
+    origem = os.path.join(diretorio or os.environ["METRICAS_DIR"], f"{pid}.json")
+    destino = os.path.join(os.path.dirname(origem), f"{SAIU}{pid}-{time.time_ns()}.json")
+    try:
+        os.replace(origem, destino)
+    except FileNotFoundError:
+        pass              # nunca gravou, ou o próprio worker já marcou (encerrar)
+    except OSError as e:
+        log.warning("métricas: não foi possível marcar %s: %s", origem, e)
+
+
+# ── Formato texto ────────────────────────────
+def _escapar(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _rotulos(rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+def _numero(v):
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+def exposicao(valores, hist, extra=None):
+    """Texto do /metrics. `extra`: {nome: valor} de gauges sem rótulo
+    calculados na hora da coleta (ex.: contadores do estoque)."""
+    valores = dict(valores)
+    for nome, v in (extra or {}).items():
+        valores[(nome, ())] = v
+    linhas = []
+    for nome, (tipo, ajuda, buckets) in METRICAS.items():
+        series = sorted((r, v) for (n, r), v in (hist if tipo == "histogram" else valores).items()
+                        if n == nome)
+        if not series:
+            continue
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        for rotulos, v in series:
+            if tipo != "histogram":
+                linhas.append(f"{nome}{_rotulos(rotulos)} {_numero(v)}")
+                continue
+            acumulado = 0
+            for limite, n in zip(buckets + (math.inf,), v):
+                acumulado += n
+                linhas.append(f"{nome}_bucket{_rotulos(rotulos, [('le', _numero(float(limite)))])} {acumulado}")
+            linhas.append(f"{nome}_sum{_rotulos(rotulos)} {_numero(float(v[-1]))}")
+            linhas.append(f"{nome}_count{_rotulos(rotulos)} {acumulado}")
+    return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
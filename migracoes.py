@@ -0,0 +1,665 @@
+"""
+Migrações versionadas do esquema.
+
+Cada passo é uma função numerada que recebe um cursor e roda na sua
+própria transação; os passos aplicados ficam em schema_version. Os passos
+são idempotentes (podem rodar sobre bancos criados pelo init_db antigo).
+
+No boot, migrar() faz uma única consulta: se o banco já está na última
+versão (e a partição mais adiante do histórico existe), não há DDL
+nenhum. Caso contrário, pega um pg_advisory_lock para que só um processo
+migre; os demais esperam a trava e, ao entrar, já encontram tudo feito.
+
+Passos novos: decore uma função com @migracao(N, "descrição"), com N
+maior que o último. Nunca altere um passo já publicado.
+
+No modo SQLite (db.SQLITE) os passos são outros, com os mesmos números:
+o passo 1 cria de uma vez o esquema equivalente aos passos 1–7 e 9–13 do
+PostgreSQL e o 8 (dados iniciais) é comum aos dois. Um passo novo que
+valha para os dois bancos usa backends=("postgres", "sqlite") — com SQL
+que sirva nos dois, ou testando db.SQLITE.
+"""
+
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+import psycopg2
+import psycopg2.errors
+
+import db
+import db_sqlite
+import particoes
+import tendencias
+
+log = logging.getLogger(__name__)
+
+TRAVA = 72_011_000   # chave do pg_advisory_lock das migrações
+
+MIGRACOES        = {}   # versao -> (descricao, funcao(cursor)), PostgreSQL
+MIGRACOES_SQLITE = {}   # idem, modo SQLite
+
+
+def migracao(versao, descricao, backends=("postgres",)):
+    def registrar(fn):
+        for backend in backends:
+            passos = MIGRACOES_SQLITE if backend == "sqlite" else MIGRACOES
+            if versao in passos:
+                raise ValueError(f"Migração {versao} duplicada: {descricao}")
+            passos[versao] = (descricao, fn)
+        return fn
+    return registrar
+
+def _passos():
+    return MIGRACOES_SQLITE if db.SQLITE else MIGRACOES
+
+def ultima_versao():
+    return max(_passos(), default=0)
+
+
+# ─────────────────────────────────────────────
+#  Runner
+# ─────────────────────────────────────────────
+def _em_dia(conn):
+    """Caminho rápido: uma consulta, sem DDL nem trava."""
+    c = conn.cursor()
+    if db.SQLITE:
+        try:
+            c.execute("SELECT max(versao) FROM schema_version")
+        except sqlite3.OperationalError:      # banco novo: sem a tabela
+            conn.rollback()
+            return False
+        versao = c.fetchone()[0]
+        conn.commit()
+        return (versao or 0) >= ultima_versao()
+    try:
+        c.execute("SELECT (SELECT max(versao) FROM schema_version), to_regclass(%s) IS NOT NULL",
+                  (particoes.particao_mais_adiante(),))
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return False
+    versao, particao = c.fetchone()
+    conn.commit()
+    return (versao or 0) >= ultima_versao() and particao
+
+def migrar(conn):
+    """Aplica os passos pendentes. Retorna [(versao, descricao)] aplicados."""
+    if _em_dia(conn):
+        return []
+    if db.SQLITE:
+        return _aplicar(conn)      # um processo só: sem trava entre processos
+    c = conn.cursor()
+    c.execute("SELECT pg_advisory_lock(%s)", (TRAVA,))
+    try:
+        aplicadas = _aplicar(conn)
+        # Partições do mês corrente em diante (virada de mês sem o cron)
+        particoes.garantir_particoes(c)
+        conn.commit()
+        return aplicadas
+    finally:
+        conn.rollback()
+        c.execute("SELECT pg_advisory_unlock(%s)", (TRAVA,))
+        conn.commit()
+
+def _aplicar(conn):
+    c = conn.cursor()
+    agora = db_sqlite.AGORA if db.SQLITE else "now()"
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao      INTEGER PRIMARY KEY,
+            descricao   TEXT        NOT NULL,
+            aplicada_em TIMESTAMPTZ NOT NULL DEFAULT {agora}
+        )
+    """)
+    conn.commit()
+    c.execute("SELECT coalesce(max(versao), 0) FROM schema_version")
+    atual = c.fetchone()[0]
+    passos = _passos()
+    aplicadas = []
+    for versao in sorted(passos):
+        if versao <= atual:
+            continue
+        descricao, fn = passos[versao]
+        log.info("Migração %d: %s", versao, descricao)
+        fn(c)
+        c.execute("INSERT INTO schema_version (versao, descricao) VALUES (%s, %s)",
+                  (versao, descricao))
+        conn.commit()
+        aplicadas.append((versao, descricao))
+    return aplicadas
+
+def status(conn):
+    """[(versao, descricao, aplicada_em|None)] de todos os passos conhecidos."""
+    c = conn.cursor()
+    try:
+        c.execute("SELECT versao, aplicada_em FROM schema_version")
+        aplicadas = dict(c.fetchall())
+    except (psycopg2.errors.UndefinedTable, sqlite3.OperationalError):
+        conn.rollback()
+        aplicadas = {}
+    passos = _passos()
+    return [(v, passos[v][0], aplicadas.get(v)) for v in sorted(passos)]
+
+
+# ─────────────────────────────────────────────
+#  Passos
+# ─────────────────────────────────────────────
+def _colunas(c, tabela):
+    c.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema=current_schema() AND table_name=%s
+    """, (tabela,))
+    return dict(c.fetchall())
+
+
+@migracao(1, "tabelas estoque, historico e usuarios")
+def _tabelas(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS estoque (
+            id         SERIAL PRIMARY KEY,
+            codigo     TEXT,
+            setor      TEXT,
+            tipo       TEXT DEFAULT 'pb',
+            quantidade INTEGER,
+            aguardando INTEGER DEFAULT 0,
+            observacao TEXT    DEFAULT \'\',
+            tinta_pct  INTEGER DEFAULT NULL
+        )
+    """)
+
+    # historico: particionado por mês (ver particoes.py)
+    c.execute("SELECT to_regclass('historico')")
+    if c.fetchone()[0] is None:
+        particoes.criar_tabela(c)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id       SERIAL PRIMARY KEY,
+            username TEXT UNIQUE,
+            password TEXT,
+            nome     TEXT,
+            is_admin INTEGER DEFAULT 0
+        )
+    """)
+
+
+@migracao(2, "estoque.modelo -> estoque.tipo (pb/colorida)")
+def _modelo_para_tipo(c):
+    colunas = _colunas(c, "estoque")
+    if "tipo" not in colunas:
+        if "modelo" in colunas:
+            c.execute("ALTER TABLE estoque RENAME COLUMN modelo TO tipo")
+            c.execute("ALTER TABLE estoque ALTER COLUMN tipo SET DEFAULT 'pb'")
+        else:
+            c.execute("ALTER TABLE estoque ADD COLUMN tipo TEXT DEFAULT 'pb'")
+    # Preenche tipo com base nos valores antigos do campo modelo
+    c.execute("UPDATE estoque SET tipo='colorida' "
+              "WHERE tipo != 'colorida' AND (tipo ILIKE '%cmyk%' OR tipo ILIKE '%color%')")
+    c.execute("UPDATE estoque SET tipo='pb' "
+              "WHERE tipo IS NULL OR (tipo != 'colorida' AND tipo != 'pb')")
+
+
+@migracao(3, "historico.criado_em TEXT -> TIMESTAMPTZ")
+def _criado_em_timestamptz(c):
+    # criado_em era TEXT 'dd/mm/YYYY HH:MM' (hora local)
+    if _colunas(c, "historico")["criado_em"] == "timestamp with time zone":
+        return
+    # Os textos foram gravados com datetime.now() do servidor; sem
+    # HISTORICO_TZ_LEGADO, vale o deslocamento UTC atual do servidor.
+    zona = os.environ.get("HISTORICO_TZ_LEGADO")
+    if zona:
+        params = (zona, None)
+    else:
+        zona = datetime.now().astimezone().strftime("%z")
+        params = (None, f"{zona[:3]}:{zona[3:]}")
+    # Fora do formato ou fora do calendário (31/02, 25:00): NULL em vez de
+    # abortar a migração.
+    c.execute("""
+        CREATE FUNCTION pg_temp.criado_em_legado(texto TEXT, zona TEXT, deslocamento INTERVAL)
+        RETURNS TIMESTAMPTZ LANGUAGE plpgsql AS $$
+        DECLARE
+            local TIMESTAMP;
+        BEGIN
+            IF texto !~ '^[0-9]{2}/[0-9]{2}/[0-9]{4} [0-9]{2}:[0-9]{2}$' THEN
+                RETURN NULL;
+            END IF;
+            local := to_timestamp(texto, 'DD/MM/YYYY HH24:MI')::timestamp;
+            IF zona IS NULL THEN
+                RETURN local AT TIME ZONE deslocamento;
+            END IF;
+            RETURN local AT TIME ZONE zona;
+        EXCEPTION WHEN datetime_field_overflow OR invalid_datetime_format THEN
+            RETURN NULL;
+        END $$
+    """)
+    # O texto que não converte fica guardado em historico_data_invalida; a
+    # linha recebe o instante 0 (1970), que no passo 4 cai em historico_padrao,
+    # fora das partições mensais que a retenção arquiva e remove.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS historico_data_invalida (
+            id        INTEGER PRIMARY KEY,
+            criado_em TEXT
+        )
+    """)
+    c.execute("""
+        INSERT INTO historico_data_invalida (id, criado_em)
+        SELECT id, criado_em FROM historico
+        WHERE pg_temp.criado_em_legado(criado_em, %s, %s::interval) IS NULL
+        ON CONFLICT (id) DO NOTHING
+    """, params)
+    if c.rowcount:
+        log.warning("Migração 3: %d linha(s) do histórico com criado_em ilegível; "
+                    "texto original em historico_data_invalida, data 1970-01-01 "
+                    "(partição historico_padrao, fora da retenção)", c.rowcount)
+    c.execute("""
+        ALTER TABLE historico ALTER COLUMN criado_em TYPE TIMESTAMPTZ USING
+            coalesce(pg_temp.criado_em_legado(criado_em, %s, %s::interval), to_timestamp(0))
+    """, params)
+    c.execute("DROP FUNCTION pg_temp.criado_em_legado(TEXT, TEXT, INTERVAL)")
+    c.execute("ALTER TABLE historico ALTER COLUMN criado_em SET DEFAULT now()")
+    c.execute("ALTER TABLE historico ALTER COLUMN criado_em SET NOT NULL")
+
+
+@migracao(4, "historico particionado por mês")
+def _historico_particionado(c):
+    if not particoes.particionado(c):
+        particoes.converter_para_particionado(c)
+    particoes.garantir_particoes(c)
+
+
+@migracao(5, "índices do histórico e do estoque")
+def _indices(c):
+    # Paginação por cursor (criado_em, id) e filtros do histórico
+    c.execute("CREATE INDEX IF NOT EXISTS historico_criado_idx  ON historico (criado_em DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS historico_estoque_idx ON historico (estoque_id, criado_em DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS historico_usuario_idx ON historico (usuario, criado_em DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS historico_acao_idx    ON historico (acao, criado_em DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_setor_idx     ON estoque (setor)")
+
+
+@migracao(6, "estoque_versao e trigger de versão do estoque")
+def _estoque_versao(c):
+    # Qualquer escrita em estoque incrementa a linha, invalidando o cache de
+    # Snapshot de todos os workers (ver stats.py).
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS estoque_versao (
+            id     INTEGER PRIMARY KEY CHECK (id = 1),
+            versao BIGINT  NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("INSERT INTO estoque_versao (id, versao) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+    c.execute("""
+        CREATE OR REPLACE FUNCTION estoque_versao_bump() RETURNS trigger AS $$
+        BEGIN
+            UPDATE estoque_versao SET versao = versao + 1 WHERE id = 1;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    c.execute("DROP TRIGGER IF EXISTS estoque_versao_bump ON estoque")
+    c.execute("""
+        CREATE TRIGGER estoque_versao_bump
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON estoque
+        FOR EACH STATEMENT EXECUTE FUNCTION estoque_versao_bump()
+    """)
+
+
+@migracao(7, "NOTIFY usuarios_alterados")
+def _usuarios_notificar(c):
+    # Usuário alterado/excluído -> NOTIFY para o cache de load_user dos workers
+    c.execute("""
+        CREATE OR REPLACE FUNCTION usuarios_notificar() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('usuarios_alterados', OLD.id::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    c.execute("DROP TRIGGER IF EXISTS usuarios_notificar ON usuarios")
+    c.execute("""
+        CREATE TRIGGER usuarios_notificar
+        AFTER UPDATE OR DELETE ON usuarios
+        FOR EACH ROW EXECUTE FUNCTION usuarios_notificar()
+    """)
+
+
+@migracao(9, "índice (codigo, setor) do estoque")
+def _indice_codigo_setor(c):
+    # Chave de casamento da importação CSV (ver estoque_csv.py)
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_codigo_setor_idx ON estoque (codigo, setor)")
+
+
+@migracao(10, "api_tokens")
+def _api_tokens(c):
+    # Tokens da API JSON: só o sha256 é guardado (ver app.py, API v1)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id         SERIAL PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id) ON DELETE CASCADE,
+            nome       TEXT    NOT NULL DEFAULT '',
+            hash       TEXT    NOT NULL UNIQUE,
+            criado_em  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            ultimo_uso TIMESTAMPTZ
+        )
+    """)
+
+
+@migracao(11, "NOTIFY estoque_alterado (eventos ao vivo)")
+def _estoque_notificar(c):
+    # Um NOTIFY por comando com as linhas alteradas (ver eventos.py). Lotes
+    # que não cabem no limite de 8000 bytes do payload viram "recarregar".
+    c.execute("""
+        CREATE OR REPLACE FUNCTION estoque_notificar() RETURNS trigger AS $$
+        DECLARE
+            n       bigint;
+            payload text;
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                SELECT count(*), json_build_object('itens', json_agg(json_build_object(
+                           'id', id, 'quantidade', quantidade, 'aguardando', aguardando,
+                           'tinta_pct', tinta_pct, 'observacao', observacao)))::text
+                  INTO n, payload FROM novos;
+            ELSIF TG_OP = 'INSERT' THEN
+                SELECT count(*) INTO n FROM novos;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT count(*) INTO n FROM antigos;
+            ELSE
+                n := 1;
+            END IF;
+            IF n = 0 THEN
+                RETURN NULL;
+            END IF;
+            IF payload IS NULL OR octet_length(payload) > 7900 THEN
+                payload := '{"recarregar":true}';
+            END IF;
+            PERFORM pg_notify('estoque_alterado', payload);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    for nome, evento, tabela in (("upd", "UPDATE", "REFERENCING NEW TABLE AS novos"),
+                                 ("ins", "INSERT", "REFERENCING NEW TABLE AS novos"),
+                                 ("del", "DELETE", "REFERENCING OLD TABLE AS antigos"),
+                                 ("trunc", "TRUNCATE", "")):
+        c.execute(f"DROP TRIGGER IF EXISTS estoque_notificar_{nome} ON estoque")
+        c.execute(f"""
+            CREATE TRIGGER estoque_notificar_{nome} AFTER {evento} ON estoque
+            {tabela} FOR EACH STATEMENT EXECUTE FUNCTION estoque_notificar()
+        """)
+
+
+@migracao(12, "índices da busca e ordenação do inventário")
+def _indices_inventario(c):
+    # Busca por trecho de código/setor (ILIKE '%...%'): GIN de trigramas,
+    # se a extensão pg_trgm estiver disponível; sem ela, a busca funciona
+    # com varredura sequencial.
+    c.execute("SAVEPOINT trgm")
+    try:
+        c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except psycopg2.Error as e:
+        c.execute("ROLLBACK TO SAVEPOINT trgm")
+        log.warning("pg_trgm indisponível; busca do inventário sem índice: %s", e.pgerror or e)
+    else:
+        # Mesma expressão usada por buscar_estoque() (app.py)
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS estoque_busca_trgm_idx ON estoque
+            USING gin ((coalesce(codigo, '') || ' ' || coalesce(setor, '')) gin_trgm_ops)
+        """)
+    c.execute("RELEASE SAVEPOINT trgm")
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_quantidade_idx ON estoque (quantidade, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_tinta_idx      ON estoque (tinta_pct, id)")
+
+
+# Tabela e trigger do resumo diário como publicados (passo 13 e passo 1 do
+# SQLite), com a tinta tomada do estoque. Congelados aqui: o trigger atual é
+# o de tendencias.instalar(), instalado pelo passo 16.
+_MOVIMENTOS_DIARIOS = """
+    CREATE TABLE IF NOT EXISTS movimentos_diarios (
+        dia          DATE    NOT NULL,
+        estoque_id   INTEGER NOT NULL,
+        setor        TEXT,
+        adicoes      INTEGER NOT NULL DEFAULT 0,
+        retiradas    INTEGER NOT NULL DEFAULT 0,
+        solicitacoes INTEGER NOT NULL DEFAULT 0,
+        recebimentos INTEGER NOT NULL DEFAULT 0,
+        tinta_pct    INTEGER,
+        PRIMARY KEY (dia, estoque_id)
+    )
+"""
+
+def _resumo_diario_tinta_do_estoque(c, tz=tendencias.TZ_LOCAL):
+    c.execute(_MOVIMENTOS_DIARIOS)
+    c.execute("CREATE INDEX IF NOT EXISTS movimentos_diarios_setor_idx ON movimentos_diarios (setor, dia)")
+    if db.SQLITE:
+        c.execute("DROP TRIGGER IF EXISTS historico_resumir")
+        c.execute(c.mogrify("""
+            CREATE TRIGGER historico_resumir AFTER INSERT ON historico
+            WHEN NEW.estoque_id IS NOT NULL
+                 AND NEW.acao IN ('Adição', 'Retirada', 'Solicitação', 'Recebimento', 'Nível de Tinta')
+                 AND current_setting('toner.resumo_diario', 1) IS NOT 'off'
+            BEGIN
+                INSERT INTO movimentos_diarios (dia, estoque_id, setor, adicoes, retiradas,
+                                                solicitacoes, recebimentos, tinta_pct)
+                SELECT dia_local(NEW.criado_em, %s), NEW.estoque_id,
+                       (SELECT setor FROM estoque WHERE id = NEW.estoque_id),
+                       NEW.acao = 'Adição', NEW.acao = 'Retirada',
+                       NEW.acao = 'Solicitação', NEW.acao = 'Recebimento',
+                       CASE WHEN NEW.acao = 'Nível de Tinta'
+                            THEN (SELECT tinta_pct FROM estoque WHERE id = NEW.estoque_id) END
+                WHERE true
+                ON CONFLICT (dia, estoque_id) DO UPDATE SET
+                    setor        = coalesce(excluded.setor, setor),
+                    adicoes      = adicoes + excluded.adicoes,
+                    retiradas    = retiradas + excluded.retiradas,
+                    solicitacoes = solicitacoes + excluded.solicitacoes,
+                    recebimentos = recebimentos + excluded.recebimentos,
+                    tinta_pct    = coalesce(excluded.tinta_pct, tinta_pct);
+            END
+        """, (tz,)).decode())
+        return
+    c.execute("""
+        CREATE OR REPLACE FUNCTION movimentos_diarios_somar() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('toner.resumo_diario', true) = 'off' THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO movimentos_diarios AS m
+                (dia, estoque_id, setor, adicoes, retiradas, solicitacoes, recebimentos, tinta_pct)
+            SELECT (n.criado_em AT TIME ZONE %s)::date, n.estoque_id, min(e.setor),
+                   count(*) FILTER (WHERE n.acao = 'Adição'),
+                   count(*) FILTER (WHERE n.acao = 'Retirada'),
+                   count(*) FILTER (WHERE n.acao = 'Solicitação'),
+                   count(*) FILTER (WHERE n.acao = 'Recebimento'),
+                   min(e.tinta_pct) FILTER (WHERE n.acao = 'Nível de Tinta')
+            FROM novos n LEFT JOIN estoque e ON e.id = n.estoque_id
+            WHERE n.estoque_id IS NOT NULL
+              AND n.acao IN ('Adição', 'Retirada', 'Solicitação', 'Recebimento', 'Nível de Tinta')
+            GROUP BY 1, 2
+            ON CONFLICT (dia, estoque_id) DO UPDATE SET
+                setor        = coalesce(EXCLUDED.setor, m.setor),
+                adicoes      = m.adicoes + EXCLUDED.adicoes,
+                retiradas    = m.retiradas + EXCLUDED.retiradas,
+                solicitacoes = m.solicitacoes + EXCLUDED.solicitacoes,
+                recebimentos = m.recebimentos + EXCLUDED.recebimentos,
+                tinta_pct    = coalesce(EXCLUDED.tinta_pct, m.tinta_pct);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """, (tz,))
+    c.execute("DROP TRIGGER IF EXISTS historico_resumir ON historico")
+    c.execute("""
+        CREATE TRIGGER historico_resumir AFTER INSERT ON historico
+        REFERENCING NEW TABLE AS novos FOR EACH STATEMENT
+        EXECUTE FUNCTION movimentos_diarios_somar()
+    """)
+
+
+@migracao(13, "resumo diário das movimentações (tendências)")
+def _movimentos_diarios(c):
+    _resumo_diario_tinta_do_estoque(c)
+    tendencias.reconstruir(c)
+
+
+# Fatias de estoque_versao (passo 15): a versão é a soma delas.
+VERSAO_FATIAS = 64
+
+@migracao(15, "versão do estoque em fatias, só com linhas alteradas")
+def _estoque_versao_fatias(c):
+    # O passo 6 incrementava uma única linha a cada comando em estoque: toda
+    # transação de escrita segurava a mesma trava de linha até o commit (os
+    # movimentos de itens diferentes ficavam em fila) e comandos sem efeito,
+    # como uma retirada com estoque zerado, mudavam a versão (e as ETags).
+    #
+    # Agora cada transação incrementa uma de VERSAO_FATIAS linhas, escolhida
+    # pelo seu txid, e só se o comando alterou alguma linha (tabelas de
+    # transição). A versão é sum(versao): sobe a cada escrita, só aparece
+    # para os outros no commit, como antes, e o valor atual é preservado (a
+    # linha 1 continua com ele). Uma sequence não serviria: nextval() é
+    # visível antes do commit, e um leitor poderia guardar no cache dados
+    # antigos sob a versão nova.
+    c.execute("ALTER TABLE estoque_versao DROP CONSTRAINT IF EXISTS estoque_versao_id_check")
+    c.execute("""
+        INSERT INTO estoque_versao (id, versao)
+        SELECT g, 0 FROM generate_series(0, %s) g
+        ON CONFLICT (id) DO NOTHING
+    """, (VERSAO_FATIAS - 1,))
+    c.execute(f"""
+        CREATE OR REPLACE FUNCTION estoque_versao_bump() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+                PERFORM 1 FROM novos LIMIT 1;
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM 1 FROM antigos LIMIT 1;
+            ELSE
+                PERFORM 1;
+            END IF;
+            IF FOUND THEN
+                UPDATE estoque_versao SET versao = versao + 1
+                WHERE id = txid_current() % {VERSAO_FATIAS};
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    c.execute("DROP TRIGGER IF EXISTS estoque_versao_bump ON estoque")
+    for nome, evento, tabela in (("upd", "UPDATE", "REFERENCING NEW TABLE AS novos"),
+                                 ("ins", "INSERT", "REFERENCING NEW TABLE AS novos"),
+                                 ("del", "DELETE", "REFERENCING OLD TABLE AS antigos"),
+                                 ("trunc", "TRUNCATE", "")):
+        c.execute(f"DROP TRIGGER IF EXISTS estoque_versao_{nome} ON estoque")
+        c.execute(f"""
+            CREATE TRIGGER estoque_versao_{nome} AFTER {evento} ON estoque
+            {tabela} FOR EACH STATEMENT EXECUTE FUNCTION estoque_versao_bump()
+        """)
+
+
+# ─────────────────────────────────────────────
+#  Passos — SQLite
+# ─────────────────────────────────────────────
+@migracao(1, "esquema completo (equivale aos passos 1–7 e 9–13 do PostgreSQL)",
+          backends=("sqlite",))
+def _esquema_sqlite(c):
+    # AUTOINCREMENT: ids de itens e usuários excluídos nunca são reusados
+    # (o histórico guarda estoque_id), como no SERIAL.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS estoque (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo     TEXT,
+            setor      TEXT,
+            tipo       TEXT DEFAULT 'pb',
+            quantidade INTEGER,
+            aguardando INTEGER DEFAULT 0,
+            observacao TEXT    DEFAULT '',
+            tinta_pct  INTEGER DEFAULT NULL
+        )
+    """)
+    # Sem partições: particoes.manter() arquiva e apaga os meses antigos.
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS historico (
+            id         INTEGER PRIMARY KEY,
+            estoque_id INTEGER,
+            usuario    TEXT,
+            acao       TEXT,
+            detalhe    TEXT,
+            criado_em  TIMESTAMPTZ NOT NULL DEFAULT {db_sqlite.AGORA}
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id       INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            nome     TEXT,
+            is_admin INTEGER DEFAULT 0
+        )
+    """)
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id) ON DELETE CASCADE,
+            nome       TEXT    NOT NULL DEFAULT '',
+            hash       TEXT    NOT NULL UNIQUE,
+            criado_em  TIMESTAMPTZ NOT NULL DEFAULT {db_sqlite.AGORA},
+            ultimo_uso TIMESTAMPTZ
+        )
+    """)
+    _indices(c)
+    _indice_codigo_setor(c)
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_quantidade_idx ON estoque (quantidade, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS estoque_tinta_idx      ON estoque (tinta_pct, id)")
+
+    # Triggers do SQLite são por linha: a versão sobe uma vez por linha
+    # alterada (basta que suba; comando sem linhas não a muda) e as linhas de
+    # estoque se juntam num único aviso no commit (db_sqlite.ConexaoSQLite).
+    # Uma linha só de versão basta: o SQLite já serializa as escritas.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS estoque_versao (
+            id     INTEGER PRIMARY KEY CHECK (id = 1),
+            versao BIGINT  NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("INSERT INTO estoque_versao (id, versao) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+    linha = ("json_object('id', NEW.id, 'quantidade', NEW.quantidade, 'aguardando', NEW.aguardando, "
+             "'tinta_pct', NEW.tinta_pct, 'observacao', NEW.observacao)")
+    for evento, aviso in (("INSERT", "notificar('estoque_alterado', '{\"recarregar\":true}')"),
+                          ("UPDATE", f"notificar_linha('estoque_alterado', {linha})"),
+                          ("DELETE", "notificar('estoque_alterado', '{\"recarregar\":true}')")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS estoque_alterado_{evento.lower()} AFTER {evento} ON estoque
+            BEGIN
+                UPDATE estoque_versao SET versao = versao + 1 WHERE id = 1;
+                SELECT {aviso};
+            END
+        """)
+    for evento in ("UPDATE", "DELETE"):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS usuarios_notificar_{evento.lower()} AFTER {evento} ON usuarios
+            BEGIN
+                SELECT notificar('usuarios_alterados', OLD.id);
+            END
+        """)
+    _resumo_diario_tinta_do_estoque(c)
+
+
+# ─────────────────────────────────────────────
+#  Passos — os dois bancos
+# ─────────────────────────────────────────────
+@migracao(14, "versão por item do estoque (concorrência otimista)",
+          backends=("postgres", "sqlite"))
+def _versao_item(c):
+    # Toda escrita em um item incrementa estoque.versao; quem edita a partir
+    # de uma leitura manda a versão lida e o UPDATE só vale se ela não mudou
+    # (ver movimentar() em app.py). Com DEFAULT constante o ADD COLUMN não
+    # reescreve a tabela. O SQLite não tem ADD COLUMN IF NOT EXISTS.
+    if db.SQLITE:
+        c.execute("PRAGMA table_info(estoque)")
+        if "versao" in {linha[1] for linha in c.fetchall()}:
+            return
+        c.execute("ALTER TABLE estoque ADD COLUMN versao INTEGER NOT NULL DEFAULT 1")
+    else:
+        c.execute("ALTER TABLE estoque ADD COLUMN IF NOT EXISTS versao INTEGER NOT NULL DEFAULT 1")
+
+
+@migracao(16, "resumo diário com a tinta lida do próprio histórico",
+          backends=("postgres", "sqlite"))
+def _resumo_tinta_do_historico(c):
+    # O trigger do passo 13 (e do passo 1 do SQLite) tomava a tinta do estoque
+    # no momento do INSERT em historico; com o histórico em lote ela pode já
+    # ter mudado. Recria o trigger lendo-a do detalhe da linha.
+    tendencias.instalar(c)
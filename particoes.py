@@ -0,0 +1,263 @@
+"""
+Histórico particionado por mês, com retenção e arquivamento.
+
+`historico` é PARTITION BY RANGE (criado_em), uma partição por mês
+(historico_YYYY_MM) mais historico_padrao, que recebe o que cair fora
+delas. Remover um mês antigo é DETACH + DROP da partição: O(1), sem
+DELETE, sem inchar a tabela e sem travar as demais partições.
+
+Antes de sair do banco, cada partição expirada é gravada em
+ARQUIVO_DIR/historico_YYYY_MM.csv.gz (CSV do COPY, com cabeçalho), que
+pode ser reimportado com restaurar_arquivo().
+
+No modo SQLite não há partições: o mês expirado (em UTC) é gravado no
+mesmo formato de arquivo e removido com DELETE; restaurar_arquivo() aceita
+os arquivos dos dois bancos.
+
+    HISTORICO_RETENCAO_MESES  meses mantidos no banco  (padrão 24)
+    ARQUIVO_DIR               destino dos arquivos     (padrão ./arquivo)
+    HISTORICO_MESES_A_FRENTE  partições criadas adiante (padrão 3)
+"""
+
+import csv
+import gzip
+import io
+import os
+import re
+import tempfile
+from datetime import date, datetime, timezone
+
+import db
+
+RETENCAO_MESES = int(os.environ.get("HISTORICO_RETENCAO_MESES", 24))
+MESES_A_FRENTE = int(os.environ.get("HISTORICO_MESES_A_FRENTE", 3))
+ARQUIVO_DIR    = os.environ.get(
+    "ARQUIVO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "arquivo"))
+
+_NOME = re.compile(r"^historico_(\d{4})_(\d{2})$")
+_ARQUIVO = re.compile(r"historico_(\d{4})_(\d{2})\.csv\.gz$")
+
+
+def _somar_meses(d, n):
+    m = d.year * 12 + d.month - 1 + n
+    return date(m // 12, m % 12 + 1, 1)
+
+def _nome(mes):
+    return f"historico_{mes.year:04d}_{mes.month:02d}"
+
+
+# ─────────────────────────────────────────────
+#  Partições
+# ─────────────────────────────────────────────
+def particionado(c):
+    c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('historico')")
+    row = c.fetchone()
+    return bool(row) and row[0] == "p"
+
+def criar_particao(c, mes):
+    """Cria a partição do mês (idempotente)."""
+    c.execute(
+        f"CREATE TABLE IF NOT EXISTS {_nome(mes)} PARTITION OF historico "
+        f"FOR VALUES FROM (%s) TO (%s)",
+        (mes.isoformat(), _somar_meses(mes, 1).isoformat()))
+
+def garantir_particoes(c, hoje=None):
+    """Partições do mês corrente até MESES_A_FRENTE adiante + a padrão."""
+    mes = (hoje or date.today()).replace(day=1)
+    for n in range(MESES_A_FRENTE + 1):
+        criar_particao(c, _somar_meses(mes, n))
+    c.execute("CREATE TABLE IF NOT EXISTS historico_padrao PARTITION OF historico DEFAULT")
+
+def particao_mais_adiante(hoje=None):
+    """Nome da última partição que garantir_particoes() cria."""
+    return _nome(_somar_meses((hoje or date.today()).replace(day=1), MESES_A_FRENTE))
+
+def listar_particoes(c):
+    """[(mes, nome)] das partições mensais, da mais antiga à mais nova."""
+    c.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child  ON child.oid  = pg_inherits.inhrelid
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        WHERE parent.oid = to_regclass('historico')
+    """)
+    meses = []
+    for (nome,) in c.fetchall():
+        m = _NOME.match(nome)
+        if m:
+            meses.append((date(int(m.group(1)), int(m.group(2)), 1), nome))
+    return sorted(meses)
+
+def converter_para_particionado(c):
+    """Migra um `historico` comum para o particionado, preservando linhas e ids."""
+    c.execute("ALTER TABLE historico RENAME TO historico_legado")
+    c.execute("ALTER TABLE historico_legado RENAME CONSTRAINT historico_pkey TO historico_legado_pkey")
+    for idx in ("historico_criado_idx", "historico_estoque_idx",
+                "historico_usuario_idx", "historico_acao_idx"):
+        c.execute(f"DROP INDEX IF EXISTS {idx}")
+    criar_tabela(c, seq_existente=True)
+    c.execute("ALTER SEQUENCE historico_id_seq OWNED BY historico.id")
+    # 1970: criado_em ilegível na migração 3; fica em historico_padrao.
+    c.execute("SELECT min(criado_em), max(criado_em) FROM historico_legado WHERE criado_em > 'epoch'")
+    ini, fim = c.fetchone()
+    if ini:
+        mes = ini.date().replace(day=1)
+        while mes <= fim.date():
+            criar_particao(c, mes)
+            mes = _somar_meses(mes, 1)
+    garantir_particoes(c)
+    c.execute("""
+        INSERT INTO historico (id, estoque_id, usuario, acao, detalhe, criado_em)
+        SELECT id, estoque_id, usuario, acao, detalhe, criado_em FROM historico_legado
+    """)
+    c.execute("DROP TABLE historico_legado")
+
+def criar_tabela(c, seq_existente=False):
+    id_col = ("id INTEGER NOT NULL DEFAULT nextval('historico_id_seq')"
+              if seq_existente else "id SERIAL")
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS historico (
+            {id_col},
+            estoque_id INTEGER,
+            usuario    TEXT,
+            acao       TEXT,
+            detalhe    TEXT,
+            criado_em  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, criado_em)
+        ) PARTITION BY RANGE (criado_em)
+    """)
+
+
+# ─────────────────────────────────────────────
+#  Retenção e arquivamento
+# ─────────────────────────────────────────────
+COLUNAS = ("id", "estoque_id", "usuario", "acao", "detalhe", "criado_em")
+
+def _utc(mes):
+    return datetime(mes.year, mes.month, 1, tzinfo=timezone.utc)
+
+def expiradas(c, hoje=None, retencao=RETENCAO_MESES):
+    limite = _somar_meses((hoje or date.today()).replace(day=1), -retencao)
+    if db.SQLITE:
+        # Meses com linhas antes do limite; criado_em é texto ISO em UTC.
+        c.execute("SELECT DISTINCT substr(criado_em, 1, 7) FROM historico WHERE criado_em < %s",
+                  (_utc(limite),))
+        meses = sorted(date(int(m[:4]), int(m[5:7]), 1) for (m,) in c.fetchall())
+        return [(mes, _nome(mes)) for mes in meses]
+    return [(mes, nome) for mes, nome in listar_particoes(c) if mes < limite]
+
+def _gravar_gz(pasta, nome, escrever):
+    """<pasta>/<nome>.csv.gz gravado por escrever(gz) de forma atômica
+    (temporário + fsync + rename). Retorna (caminho, o que escrever retornar)."""
+    os.makedirs(pasta, exist_ok=True)
+    destino = os.path.join(pasta, f"{nome}.csv.gz")
+    fd, tmp = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as bruto:
+            with gzip.GzipFile(fileobj=bruto, mode="wb") as gz:
+                linhas = escrever(gz)
+            bruto.flush()
+            os.fsync(bruto.fileno())
+        os.replace(tmp, destino)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return destino, linhas
+
+def arquivar_particao(conn, mes, nome, pasta=ARQUIVO_DIR):
+    """Grava a partição em <pasta>/<nome>.csv.gz e só então a remove.
+
+    Retorna (caminho, linhas)."""
+    if db.SQLITE:
+        return _arquivar_mes_sqlite(conn, mes, nome, pasta)
+    c = conn.cursor()
+
+    def escrever(gz):
+        c.copy_expert(
+            f"COPY (SELECT {', '.join(COLUNAS)} "
+            f"FROM {nome} ORDER BY criado_em, id) TO STDOUT WITH CSV HEADER", gz)
+        return c.rowcount
+
+    destino, linhas = _gravar_gz(pasta, nome, escrever)
+    c.execute(f"ALTER TABLE historico DETACH PARTITION {nome}")
+    c.execute(f"DROP TABLE {nome}")
+    conn.commit()
+    return destino, linhas
+
+def _arquivar_mes_sqlite(conn, mes, nome, pasta):
+    c = conn.cursor()
+    limites = {"ini": _utc(mes), "fim": _utc(_somar_meses(mes, 1))}
+
+    def escrever(gz):
+        texto = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        escritor = csv.writer(texto, lineterminator="\n")
+        escritor.writerow(COLUNAS)
+        c.execute(f"SELECT {', '.join(COLUNAS)} FROM historico "
+                  "WHERE criado_em >= %(ini)s AND criado_em < %(fim)s ORDER BY criado_em, id", limites)
+        linhas = 0
+        while lote := c.fetchmany(5000):
+            escritor.writerows(lote)
+            linhas += len(lote)
+        texto.flush()
+        texto.detach()
+        return linhas
+
+    destino, linhas = _gravar_gz(pasta, nome, escrever)
+    c.execute("DELETE FROM historico WHERE criado_em >= %(ini)s AND criado_em < %(fim)s", limites)
+    conn.commit()
+    return destino, linhas
+
+def manter(conn, hoje=None, retencao=RETENCAO_MESES, pasta=ARQUIVO_DIR):
+    """Cria as partições à frente e arquiva/remove as expiradas.
+
+    Retorna [(nome, caminho, linhas)] das partições arquivadas."""
+    c = conn.cursor()
+    if not db.SQLITE:
+        garantir_particoes(c, hoje)
+        conn.commit()
+    feitos = []
+    for mes, nome in expiradas(c, hoje, retencao):
+        caminho, linhas = arquivar_particao(conn, mes, nome, pasta)
+        feitos.append((nome, caminho, linhas))
+    return feitos
+
+def restaurar_arquivo(conn, caminho):
+    """Reimporta um historico_YYYY_MM.csv.gz (linhas já presentes são ignoradas).
+
+    Retorna o número de linhas inseridas."""
+    m = _ARQUIVO.search(os.path.basename(caminho))
+    if not m:
+        raise ValueError(f"Nome de arquivo inesperado: {caminho}")
+    c = conn.cursor()
+    if db.SQLITE:
+        return _restaurar_sqlite(conn, c, caminho)
+    criar_particao(c, date(int(m.group(1)), int(m.group(2)), 1))
+    c.execute("CREATE TEMP TABLE historico_import (LIKE historico) ON COMMIT DROP")
+    with gzip.open(caminho, "rb") as gz:
+        c.copy_expert(
+            "COPY historico_import (id, estoque_id, usuario, acao, detalhe, criado_em) "
+            "FROM STDIN WITH CSV HEADER", gz)
+    # O resumo diário (tendencias.py) não perde nada ao arquivar; as linhas
+    # de volta não podem ser somadas de novo.
+    c.execute("SET LOCAL toner.resumo_diario = 'off'")
+    c.execute("""
+        INSERT INTO historico SELECT * FROM historico_import
+        ON CONFLICT DO NOTHING
+    """)
+    inseridas = c.rowcount
+    conn.commit()
+    return inseridas
+
+def _restaurar_sqlite(conn, c, caminho):
+    with gzip.open(caminho, "rt", encoding="utf-8", newline="") as texto:
+        leitor = csv.reader(texto)
+        next(leitor, None)                           # cabeçalho
+        linhas = [(int(id_), int(estoque_id) if estoque_id else None, usuario, acao, detalhe,
+                   datetime.fromisoformat(criado_em))
+                  for id_, estoque_id, usuario, acao, detalhe, criado_em in leitor]
+    c.execute("SET LOCAL toner.resumo_diario = 'off'")
+    c.executemany(f"INSERT OR IGNORE INTO historico ({', '.join(COLUNAS)}) "
+                  "VALUES (%s, %s, %s, %s, %s, %s)", linhas)
+    inseridas = c.rowcount
+    conn.commit()
+    return inseridas
@@ -0,0 +1,133 @@
+"""
+Perfil de consultas por requisição e log de consultas lentas.
+
+Com PERFIL_SQL=1, cada requisição anota todos os comandos SQL executados
+pelas conexões do get_db() (texto, tempo, linhas) e quantas conexões
+pegou do pool. Ao final:
+
+  - comandos idênticos (mesmo SQL, parâmetros à parte) repetidos
+    PERFIL_REPETIDAS vezes ou mais são apontados como N+1;
+  - requisições com mais de PERFIL_ORCAMENTO comandos, ou com N+1, vão
+    para o log estruturado (uma linha JSON por requisição);
+  - a resposta ganha o cabeçalho Server-Timing (sql, conexões, total),
+    visível na aba Network/Timing do navegador.
+
+Independentemente disso, todo comando acima de DB_LENTA_MS vai para o
+mesmo log, como uma linha JSON "consulta_lenta".
+
+    PERFIL_SQL          liga o perfil por requisição      (padrão 0)
+    PERFIL_ORCAMENTO    comandos por requisição           (padrão 8)
+    PERFIL_REPETIDAS    repetições para apontar N+1       (padrão 3)
+    PERFIL_LOG          arquivo do log (JSON por linha)   (padrão: log da aplicação)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+ATIVO      = os.environ.get("PERFIL_SQL", "0") == "1"
+ORCAMENTO  = int(os.environ.get("PERFIL_ORCAMENTO", 8))
+REPETIDAS  = int(os.environ.get("PERFIL_REPETIDAS", 3))
+
+log = logging.getLogger("toner.perfil")
+if os.environ.get("PERFIL_LOG"):
+    _arquivo = logging.FileHandler(os.environ["PERFIL_LOG"], encoding="utf-8")
+    _arquivo.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_arquivo)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+_local = threading.local()
+
+
+def _texto(sql):
+    texto = sql.decode(errors="replace") if isinstance(sql, bytes) else str(sql)
+    return " ".join(texto.split())
+
+def _registrar(tipo, **campos):
+    log.warning(json.dumps({"tipo": tipo, **campos}, ensure_ascii=False, default=str))
+
+
+class Perfil:
+    """Comandos e conexões de uma requisição."""
+
+    __slots__ = ("inicio", "consultas", "conexoes", "espera")
+
+    def __init__(self):
+        self.inicio    = time.perf_counter()
+        self.consultas = []      # (sql, segundos, linhas)
+        self.conexoes  = 0
+        self.espera    = 0.0     # segundos aguardando conexão livre
+
+    @property
+    def tempo_sql(self):
+        return sum(s for _, s, _ in self.consultas)
+
+    def repetidas(self, minimo=REPETIDAS):
+        """[(sql, vezes, segundos somados)] dos comandos repetidos."""
+        grupos = {}
+        for sql, segundos, _ in self.consultas:
+            vezes, total = grupos.get(sql, (0, 0.0))
+            grupos[sql] = (vezes + 1, total + segundos)
+        return sorted(((sql, v, t) for sql, (v, t) in grupos.items() if v >= minimo),
+                      key=lambda r: -r[1])
+
+    def server_timing(self):
+        # Cabeçalho HTTP: só ASCII nas descrições.
+        total = time.perf_counter() - self.inicio
+        return ", ".join([
+            f'sql;dur={self.tempo_sql * 1000:.2f};desc="{len(self.consultas)} comandos"',
+            f'pool;dur={self.espera * 1000:.2f};desc="{self.conexoes} conexao(oes)"',
+            f"total;dur={total * 1000:.2f}",
+        ])
+
+    def relatorio(self, **contexto):
+        total = time.perf_counter() - self.inicio
+        return {
+            **contexto,
+            "total_ms":  round(total * 1000, 2),
+            "sql_ms":    round(self.tempo_sql * 1000, 2),
+            "comandos":  len(self.consultas),
+            "conexoes":  self.conexoes,
+            "orcamento": ORCAMENTO,
+            "n_mais_1":  [{"sql": sql[:300], "vezes": v, "ms": round(t * 1000, 2)}
+                          for sql, v, t in self.repetidas()],
+            "consultas": [{"sql": sql[:300], "ms": round(s * 1000, 3), "linhas": n}
+                          for sql, s, n in self.consultas],
+        }
+
+
+# ── Observadores (db.observadores_sql / observadores_conexao) ─────
+def observar_sql(sql, segundos, linhas):
+    p = getattr(_local, "perfil", None)
+    if p is not None:
+        p.consultas.append((_texto(sql), segundos, linhas))
+
+def observar_conexao(espera):
+    p = getattr(_local, "perfil", None)
+    if p is not None:
+        p.conexoes += 1
+        p.espera   += espera
+
+
+# ── Ciclo da requisição ─────────────────────
+def iniciar():
+    _local.perfil = Perfil()
+
+def encerrar():
+    """Perfil da requisição corrente (ou None), desligando a coleta."""
+    p = getattr(_local, "perfil", None)
+    _local.perfil = None
+    return p
+
+def avaliar(p, **contexto):
+    """Loga a requisição se passou do orçamento ou tem N+1."""
+    if len(p.consultas) > ORCAMENTO or p.repetidas():
+        _registrar("requisicao", **p.relatorio(**contexto))
+
+
+def consulta_lenta(sql, segundos, linhas, **contexto):
+    _registrar("consulta_lenta", **contexto, ms=round(segundos * 1000, 2),
+               linhas=linhas, sql=_texto(sql)[:1000])
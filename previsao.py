@@ -0,0 +1,256 @@
+"""
+Previsão de ruptura de estoque a partir do histórico de movimentações.
+
+Para cada item do estoque:
+
+    consumo   média diária de "Retirada" nos últimos PREVISAO_JANELA dias,
+              com peso exponencial (meia-vida PREVISAO_MEIA_VIDA dias):
+              o consumo recente pesa mais que o antigo
+    ruptura   data em que a quantidade atual acaba nesse ritmo
+    prazo     mediana dos intervalos Solicitação → Recebimento do item no
+              último ano (sem histórico próprio: mediana de todos os itens)
+    pedir_ate ruptura - prazo: depois disso o toner chega tarde
+
+O consumo fica numa matriz itens × dias (NumPy) mantida em memória por
+worker; a taxa de todos os itens é um único produto matriz-vetor. Cada
+atualizar() só relê do banco as linhas dos itens com movimentação nova
+desde a leitura anterior, pelo historico.id e não por criado_em: com o
+histórico em lote (auditoria.py) a linha chega ao banco depois do instante
+que registra. Na virada do dia a janela anda e a matriz é refeita inteira.
+
+    PREVISAO_JANELA     dias de histórico considerados    (padrão 90)
+    PREVISAO_MEIA_VIDA  meia-vida do peso, em dias        (padrão 21)
+    PREVISAO_HORIZONTE  dias à frente exibidos no painel  (padrão 30)
+
+No modo SQLite as consultas trocam os trechos próprios do PostgreSQL
+(AT TIME ZONE, ::int, array_agg, = ANY) por dia_local(), julianday() e
+JSON; o resultado é o mesmo.
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+import db
+from db_sqlite import carregar_json
+
+JANELA     = int(os.environ.get("PREVISAO_JANELA", 90))
+MEIA_VIDA  = float(os.environ.get("PREVISAO_MEIA_VIDA", 21))
+HORIZONTE  = int(os.environ.get("PREVISAO_HORIZONTE", 30))
+JANELA_PRAZO = 365          # dias de histórico para o prazo do fornecedor
+MARGEM       = timedelta(minutes=1)   # folga entre gerar o id de uma linha do histórico e o commit
+
+RETIRADA, SOLICITACAO, RECEBIMENTO = "Retirada", "Solicitação", "Recebimento"
+
+# Trechos que mudam com o backend: dia local, booleano -> inteiro, dias
+# entre dois instantes, filtro por lista de ids e agregação em lista.
+if db.SQLITE:
+    _DIA     = "CAST(julianday(dia_local(criado_em, %(tz)s)) - julianday(%(inicio)s) AS INTEGER)"
+    _INT     = ""
+    _DIAS    = "julianday(chegada) - julianday(pedido)"
+    FILTRO   = "AND estoque_id IN (SELECT value FROM json_each(%(ids)s))"
+    _LISTA   = "json_group_array"
+    _AGORA   = 'now() AS "agora [TIMESTAMPTZ]"'
+else:
+    _DIA     = "(criado_em AT TIME ZONE %(tz)s)::date - %(inicio)s"
+    _INT     = "::int"
+    _DIAS    = "extract(epoch FROM chegada - pedido) / 86400"
+    FILTRO   = "AND estoque_id = ANY(%(ids)s)"
+    _LISTA   = "array_agg"
+    _AGORA   = "now()"
+
+SQL_ITENS = f"SELECT {_AGORA}, {_LISTA}(id), (SELECT max(id) FROM historico) FROM estoque"
+SQL_MOVIMENTADOS = f"""
+    SELECT {_AGORA}, max(id), {_LISTA}(DISTINCT estoque_id) FROM historico
+    WHERE id > %s AND acao IN (%s, %s, %s)
+"""
+
+SQL_CONSUMO = f"""
+    SELECT estoque_id, {_DIA}, count(*)
+    FROM historico
+    WHERE acao = %(retirada)s AND criado_em >= %(desde)s {{filtro}}
+    GROUP BY 1, 2
+"""
+
+# Cada Recebimento fecha o ciclo aberto pela primeira Solicitação depois do
+# Recebimento anterior; ciclo = nº de Recebimentos antes da linha.
+SQL_PRAZOS = f"""
+    WITH ev AS (
+        SELECT estoque_id, acao, criado_em,
+               count(*) FILTER (WHERE acao = %(recebimento)s)
+                   OVER (PARTITION BY estoque_id ORDER BY criado_em, id)
+               - (acao = %(recebimento)s){_INT} AS ciclo
+        FROM historico
+        WHERE acao IN (%(solicitacao)s, %(recebimento)s) AND criado_em >= %(desde)s {{filtro}}
+    ), ciclos AS (
+        SELECT estoque_id,
+               min(criado_em) FILTER (WHERE acao = %(solicitacao)s) AS pedido,
+               min(criado_em) FILTER (WHERE acao = %(recebimento)s) AS chegada
+        FROM ev
+        GROUP BY estoque_id, ciclo
+    )
+    SELECT estoque_id, {_DIAS}
+    FROM ciclos
+    WHERE chegada > pedido
+"""
+
+
+def _pesos(dias=JANELA, meia_vida=MEIA_VIDA):
+    """Peso de cada dia da janela (o último é hoje), somando 1."""
+    idade = np.arange(dias - 1, -1, -1, dtype=np.float64)
+    w = 0.5 ** (idade / meia_vida)
+    return w / w.sum()
+
+
+class Previsor:
+    """Consumo e prazo de entrega por item, atualizados sob demanda."""
+
+    def __init__(self, tz, janela=JANELA, meia_vida=MEIA_VIDA):
+        self.tz       = tz
+        self.janela   = janela
+        self._pesos   = _pesos(janela, meia_vida)
+        self._lock    = threading.Lock()
+        self._dia     = None                      # hoje (local) da matriz atual
+        self._marcas  = deque()                   # (now() do banco, maior historico.id) por leitura
+        self._linha   = {}                        # estoque_id -> linha da matriz
+        self._consumo = np.zeros((0, janela))     # retiradas por item e dia
+        self._prazos  = {}                        # estoque_id -> intervalos (dias)
+        self.completas     = 0
+        self.incrementais  = 0
+        self.recalculados  = 0                    # itens relidos nas incrementais
+
+    def hoje(self):
+        return datetime.now(self.tz).date()
+
+    # ── Leitura do banco ─────────────────────────────────
+    def atualizar(self, conn):
+        """Traz a matriz para o estado atual do histórico."""
+        hoje = self.hoje()
+        with self._lock:
+            c = conn.cursor()
+            if self._dia != hoje:
+                c.execute(SQL_ITENS)
+                agora, ids, maior = c.fetchone()
+                ids = carregar_json(ids)
+                self._ler(c, hoje, ids or [], completa=True)
+                self.completas += 1
+            else:
+                c.execute(SQL_MOVIMENTADOS,
+                          (self._cursor(), RETIRADA, SOLICITACAO, RECEBIMENTO))
+                agora, maior, ids = c.fetchone()
+                ids = carregar_json(ids)
+                if ids:
+                    self._ler(c, hoje, ids, completa=False)
+                    self.recalculados += len(ids)
+                self.incrementais += 1
+            self._dia = hoje
+            self._marcar(agora, maior)
+
+    def _marcar(self, agora, maior):
+        # O id vem da sequence no INSERT e a linha só aparece no commit: uma
+        # transação em andamento pode gravar ids menores que o maior já
+        # lido. O cursor é o maior id visto numa leitura de pelo menos
+        # MARGEM atrás; as linhas mais novas que isso são relidas.
+        if maior is None:
+            maior = self._marcas[-1][1] if self._marcas else 0
+        self._marcas.append((agora, maior))
+        while len(self._marcas) > 1 and self._marcas[1][0] <= agora - MARGEM:
+            self._marcas.popleft()
+
+    def _cursor(self):
+        return self._marcas[0][1]
+
+    def _ler(self, c, hoje, ids, completa):
+        inicio = hoje - timedelta(days=self.janela - 1)
+        params = {
+            "tz": str(self.tz), "inicio": inicio,
+            "ids": json.dumps(list(ids)) if db.SQLITE else list(ids),
+            "retirada": RETIRADA, "solicitacao": SOLICITACAO, "recebimento": RECEBIMENTO,
+        }
+        filtro = "" if completa else FILTRO
+
+        if completa:
+            self._linha = {id_: i for i, id_ in enumerate(ids)}
+            self._consumo = np.zeros((len(ids), self.janela))
+            self._prazos = {}
+        else:
+            novos = [id_ for id_ in ids if id_ not in self._linha]
+            for id_ in novos:
+                self._linha[id_] = len(self._linha)
+            if novos:
+                self._consumo = np.vstack([self._consumo, np.zeros((len(novos), self.janela))])
+            linhas = [self._linha[id_] for id_ in ids]
+            self._consumo[linhas] = 0
+            for id_ in ids:
+                self._prazos.pop(id_, None)
+
+        c.execute(SQL_CONSUMO.format(filtro=filtro), {
+            **params, "desde": datetime.combine(inicio, time(), self.tz)})
+        rows = c.fetchall()
+        if rows:
+            estoque_id, dia, qtd = zip(*rows)
+            linha = np.array([self._linha.get(e, -1) for e in estoque_id], dtype=np.intp)
+            ok = linha >= 0                # fora disso: item já removido do estoque
+            self._consumo[linha[ok], np.array(dia)[ok]] = np.array(qtd)[ok]
+
+        c.execute(SQL_PRAZOS.format(filtro=filtro), {
+            **params, "desde": datetime.combine(hoje - timedelta(days=JANELA_PRAZO), time(), self.tz)})
+        for estoque_id, dias in c.fetchall():
+            self._prazos.setdefault(estoque_id, []).append(float(dias))
+
+    # ── Cálculo ──────────────────────────────────────────
+    def prazo_geral(self):
+        """Mediana de todos os intervalos pedido → chegada (dias), ou None."""
+        with self._lock:
+            return self._prazo_geral()
+
+    def _prazo_geral(self):
+        todos = [d for ds in self._prazos.values() for d in ds]
+        return float(np.median(todos)) if todos else None
+
+    def prever(self, itens):
+        """Previsão para cada item (linhas de estoque), na mesma ordem.
+
+        Cada resultado é o item com: consumo (unidades/dia), ruptura (date
+        ou None se não há consumo), prazo (dias ou None) e pedir_ate.
+        """
+        with self._lock:
+            hoje = self._dia or self.hoje()
+            taxas = self._consumo @ self._pesos
+            linha = np.array([self._linha.get(d["id"], -1) for d in itens], dtype=np.intp)
+            consumo = np.where(linha >= 0, taxas[linha] if len(taxas) else 0.0, 0.0)
+            geral = self._prazo_geral()
+            prazos = np.array([np.median(self._prazos[d["id"]]) if d["id"] in self._prazos
+                               else (geral if geral is not None else np.nan)
+                               for d in itens], dtype=np.float64)
+
+        qtd = np.array([d["quantidade"] for d in itens], dtype=np.float64)
+        dias = np.full_like(consumo, np.inf)
+        np.divide(np.maximum(qtd, 0), consumo, out=dias, where=consumo > 0)
+        previsoes = []
+        for d, taxa, ate_zerar, prazo in zip(itens, consumo, dias, prazos):
+            ruptura = hoje + timedelta(days=int(ate_zerar)) if np.isfinite(ate_zerar) else None
+            prazo = None if np.isnan(prazo) else round(float(prazo), 1)
+            previsoes.append({
+                **d,
+                "consumo":   float(taxa),
+                "ruptura":   ruptura,
+                "prazo":     prazo,
+                "pedir_ate": ruptura - timedelta(days=round(prazo)) if ruptura and prazo is not None else None,
+            })
+        return previsoes
+
+    def em_risco(self, itens, horizonte=HORIZONTE):
+        """Itens que zeram em até `horizonte` dias, do mais urgente ao menos."""
+        limite = (self._dia or self.hoje()) + timedelta(days=horizonte)
+        riscos = [p for p in self.prever(itens) if p["ruptura"] and p["ruptura"] <= limite]
+        return sorted(riscos, key=lambda p: (p["pedir_ate"] or p["ruptura"], p["ruptura"]))
+
+    def stats(self):
+        return {"itens": len(self._linha), "dia": str(self._dia) if self._dia else None,
+                "completas": self.completas, "incrementais": self.incrementais,
+                "recalculados": self.recalculados}
@@ -0,0 +1,145 @@
+/* Inventário sem recarregar: ações via fetch e eventos de /eventos (SSE). */
+(function () {
+  var card = document.getElementById('inventario');
+  if (!card) return;
+
+  function corTinta(p) {
+    return p <= 20 ? 'var(--danger)' : p <= 50 ? 'var(--warn)' : 'var(--ok)';
+  }
+
+  var render = {
+    qtd: function (td, it) {
+      var q = it.quantidade;
+      td.innerHTML = '<span class="qty ' + (q == 0 ? 'qty-0' : q == 1 ? 'qty-1' : 'qty-ok') + '">' + q + '</span>';
+    },
+    status: function (td, it) {
+      td.innerHTML =
+        it.status == 'OK' ? '<span class="badge badge-ok">● OK</span>' :
+        it.status == 'Aguardando Selbetti' ? '<span class="badge badge-warn">● Aguardando</span>' :
+        '<span class="badge badge-danger">● Problema</span>';
+    },
+    tinta: function (td, it) {
+      var p = it.tinta_pct;
+      if (p === null || p === undefined) {
+        td.innerHTML = '<span style="font-size:12px;color:var(--light)">—</span>';
+        return;
+      }
+      var cor = corTinta(p);
+      td.innerHTML =
+        '<div style="display:flex;align-items:center;gap:7px;min-width:90px">' +
+          '<div style="flex:1;height:4px;background:var(--border);border-radius:2px;overflow:hidden">' +
+            '<div style="height:100%;border-radius:2px;width:' + p + '%;background:' + cor + '"></div>' +
+          '</div>' +
+          '<span style="font-family:var(--mono);font-size:11px;font-weight:700;color:' + cor +
+            ';white-space:nowrap;min-width:32px;text-align:right">' + p + '%</span>' +
+          (p <= 20 ? '<span title="Crítico" style="font-size:11px;line-height:1">⚠</span>' : '') +
+        '</div>';
+    },
+    obs: function (td, it) {
+      var span = document.createElement('span');
+      span.className = 'obs-text' + (it.observacao ? '' : ' obs-empty');
+      span.title = it.observacao || '';
+      span.textContent = it.observacao || '—';
+      td.replaceChildren(span);
+    }
+  };
+
+  function realcar(tr) {
+    tr.classList.remove('atualizada');
+    void tr.offsetWidth;               // reinicia a animação
+    tr.classList.add('atualizada');
+  }
+
+  // Evento SSE: só os dados; as células são redesenhadas aqui.
+  function aplicarItem(it) {
+    var tr = card.querySelector('tr[data-id="' + it.id + '"]');
+    if (!tr) return;
+    for (var col in render) {
+      var td = tr.querySelector('[data-col="' + col + '"]');
+      if (td) render[col](td, it);
+    }
+    realcar(tr);
+  }
+
+  // Resposta de ação: a linha já vem renderizada pelo servidor.
+  function substituirLinha(it, html) {
+    var tr = card.querySelector('tr[data-id="' + it.id + '"]');
+    if (!tr) return;
+    var t = document.createElement('template');
+    t.innerHTML = html.trim();
+    var nova = t.content.firstElementChild;
+    tr.replaceWith(nova);
+    realcar(nova);
+  }
+
+  function aplicarStats(st) {
+    for (var k in st) {
+      var els = document.querySelectorAll('[data-stat="' + k + '"]');
+      for (var i = 0; i < els.length; i++) els[i].textContent = st[k];
+    }
+    var alerta = document.getElementById('alerta-zerados');
+    if (alerta) alerta.style.display = st.sem_pedido > 0 ? '' : 'none';
+  }
+
+  // ── Ações sem navegação (o link/formulário continua valendo como fallback)
+  function acao(url, corpo) {
+    return fetch(url, {
+      method: corpo ? 'POST' : 'GET', body: corpo, credentials: 'same-origin',
+      headers: {'Accept': 'application/json'}
+    }).then(function (r) {
+      if ((r.headers.get('Content-Type') || '').indexOf('application/json') < 0)
+        throw new Error('resposta não é JSON');   // ex.: sessão expirou → login
+      return r.json();
+    }).then(function (d) {
+      if (d.item) substituirLinha(d.item, d.html);
+      if (d.stats) aplicarStats(d.stats);
+      return d;
+    });
+  }
+
+  card.addEventListener('click', function (e) {
+    var a = e.target.closest('a.act-plus, a.act-minus, a.act-recv');
+    if (!a || e.button !== 0 || e.ctrlKey || e.metaKey || e.shiftKey) return;
+    e.preventDefault();
+    if (a.classList.contains('ocupado')) return;
+    a.classList.add('ocupado');
+    acao(a.href)
+      .catch(function () { location.href = a.href; })
+      .then(function () { a.classList.remove('ocupado'); });
+  });
+
+  [['obs-form', 'closeObs'], ['tinta-form', 'closeTinta']].forEach(function (par) {
+    var form = document.getElementById(par[0]);
+    if (!form) return;
+    form.addEventListener('submit', function (e) {
+      e.preventDefault();
+      // urlencoded, como o envio normal do formulário (o modo ASGI só lê esse)
+      acao(form.action, new URLSearchParams(new FormData(form)))
+        .then(function (d) {
+          // Conflito: a linha já mostra o valor atual; o modal fica aberto
+          // com a versão nova, e salvar de novo sobrescreve de propósito.
+          if (d.conflito) {
+            form.elements.versao.value = d.item.versao;
+            alert(d.erro);
+            return;
+          }
+          window[par[1]]();
+        })
+        .catch(function () { form.submit(); });
+    });
+  });
+
+  // ── Alterações dos outros usuários (SSE)
+  if (!window.EventSource) return;
+  var fonte = new EventSource(card.dataset.eventos);
+  fonte.addEventListener('estoque', function (e) {
+    var d = JSON.parse(e.data);
+    d.itens.forEach(aplicarItem);
+    if (d.stats) aplicarStats(d.stats);
+  });
+  fonte.addEventListener('recarregar', function () {
+    fonte.close();
+    location.reload();
+  });
+  window.addEventListener('pagehide', function () { fonte.close(); });
+})();
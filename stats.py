@@ -0,0 +1,160 @@
+"""
+Estatísticas do inventário calculadas numa única consulta.
+
+O Dashboard (/dashboard) renderiza a partir de um Snapshot, lido com um
+só SELECT e uma passada sobre as linhas. O inventário (/) é paginado no
+banco e usa só os contadores, via totais().
+
+O Snapshot fica em cache no processo, associado à versão do estoque
+(soma das linhas de estoque_versao, incrementadas por trigger a cada
+comando que altera estoque). Todos os workers leem a mesma versão, então
+nenhum serve dados antigos depois de uma alteração feita em outro worker.
+"""
+
+import threading
+from dataclasses import dataclass, field
+
+TINTA_CRITICA = 20   # ≤ 20% → alerta crítico
+TINTA_BAIXA   = 50   # ≤ 50% → aviso
+
+
+def calcular_status(qtd, aguardando):
+    if qtd >= 1:        return "OK"
+    if aguardando == 1: return "Aguardando Selbetti"
+    return "PROBLEMA"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    itens:         list = field(repr=False)  # linhas de estoque + "status", por setor
+    total:         int = 0                   # unidades em estoque
+    total_itens:   int = 0
+    ok:            int = 0                   # quantidade >= 1
+    aguardando:    int = 0                   # aguardando = 1
+    zerados:       int = 0                   # quantidade = 0
+    sem_pedido:    int = 0                   # quantidade = 0 e aguardando = 0
+    alertas_tinta: list = field(default_factory=list, repr=False)
+    avisos_tinta:  list = field(default_factory=list, repr=False)
+
+    @property
+    def pct_ok(self):
+        return round(self.ok / self.total_itens * 100) if self.total_itens else 0
+
+    @property
+    def pct_problema(self):
+        return round(self.sem_pedido / self.total_itens * 100) if self.total_itens else 0
+
+    @property
+    def por_quantidade(self):
+        """Itens por quantidade crescente (desempate por setor)."""
+        # sorted é estável: a ordem por setor do SELECT desempata.
+        return sorted(self.itens, key=lambda d: d["quantidade"])
+
+
+def montar_snapshot(rows):
+    """Uma passada sobre as linhas de estoque (já ordenadas por setor)."""
+    itens = []
+    total = ok = aguardando = zerados = sem_pedido = 0
+    for r in rows:
+        qtd, ag = r["quantidade"], r["aguardando"]
+        itens.append({**r, "status": calcular_status(qtd, ag)})
+        total += qtd
+        if qtd >= 1:
+            ok += 1
+        if ag == 1:
+            aguardando += 1
+        if qtd == 0:
+            zerados += 1
+            if ag == 0:
+                sem_pedido += 1
+
+    ordenados = sorted(itens, key=lambda d: d["quantidade"])
+    alertas = [d for d in ordenados
+               if d["tinta_pct"] is not None and d["tinta_pct"] <= TINTA_CRITICA]
+    avisos  = [d for d in ordenados
+               if d["tinta_pct"] is not None and TINTA_CRITICA < d["tinta_pct"] <= TINTA_BAIXA]
+
+    return Snapshot(
+        itens=itens, total=total, total_itens=len(itens), ok=ok,
+        aguardando=aguardando, zerados=zerados, sem_pedido=sem_pedido,
+        alertas_tinta=alertas, avisos_tinta=avisos,
+    )
+
+
+# Os comandos ficam à parte para o modo ASGI (asgi.py) rodá-los no asyncpg.
+SQL_ESTOQUE = "SELECT * FROM estoque ORDER BY setor"
+SQL_VERSAO  = "SELECT CAST(sum(versao) AS BIGINT) FROM estoque_versao"
+SQL_TOTAIS  = """
+    SELECT (SELECT CAST(sum(versao) AS BIGINT) FROM estoque_versao),
+           coalesce(sum(quantidade), 0), count(*),
+           count(*) FILTER (WHERE quantidade >= 1),
+           count(*) FILTER (WHERE aguardando = 1),
+           count(*) FILTER (WHERE quantidade = 0),
+           count(*) FILTER (WHERE quantidade = 0 AND aguardando = 0)
+    FROM estoque
+"""
+CAMPOS_TOTAIS = ("total", "total_itens", "ok", "aguardando", "zerados", "sem_pedido")
+
+
+def carregar_snapshot(conn):
+    c = conn.cursor()
+    c.execute(SQL_ESTOQUE)
+    cols = [d[0] for d in c.description]
+    return montar_snapshot(dict(zip(cols, r)) for r in c.fetchall())
+
+
+def totais(conn):
+    """(versao, contadores do Snapshot) numa só agregação, sem ler os itens."""
+    c = conn.cursor()
+    c.execute(SQL_TOTAIS)
+    versao, *valores = c.fetchone()
+    return versao or 0, dict(zip(CAMPOS_TOTAIS, valores))
+
+
+def versao_estoque(conn):
+    c = conn.cursor()
+    c.execute(SQL_VERSAO)
+    return c.fetchone()[0] or 0
+
+
+class SnapshotCache:
+    """Último Snapshot lido, válido enquanto a versão do estoque não mudar."""
+
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._versao = None
+        self._snap   = None
+        self.hits    = 0
+        self.misses  = 0
+
+    def obter(self, conn):
+        """Retorna (versao, snapshot); só relê o estoque se a versão mudou."""
+        versao = versao_estoque(conn)
+        snap = self.consultar(versao)
+        if snap is None:
+            # Lido depois da versão: o conteúdo é sempre igual ou mais novo
+            # que `versao`, nunca mais antigo.
+            snap = carregar_snapshot(conn)
+            self.guardar(versao, snap)
+        return versao, snap
+
+    def consultar(self, versao):
+        """Snapshot em cache se ainda é desta versão, senão None."""
+        with self._lock:
+            if versao == self._versao:
+                self.hits += 1
+                return self._snap
+            self.misses += 1
+            return None
+
+    def guardar(self, versao, snap):
+        with self._lock:
+            if self._versao is None or versao > self._versao:
+                self._versao, self._snap = versao, snap
+
+    def limpar(self):
+        with self._lock:
+            self._versao = self._snap = None
+
+
+cache = SnapshotCache()
@@ -0,0 +1,265 @@
+"""
+Resumo diário das movimentações, para os gráficos de tendência.
+
+movimentos_diarios tem uma linha por dia (no fuso TZ_LOCAL) e item:
+adições, retiradas, solicitações, recebimentos e o último nível de tinta
+informado no dia (lido do detalhe do histórico), com o setor do item. É
+mantida por um trigger de comando em historico: cada INSERT soma as suas
+linhas com ON CONFLICT DO UPDATE, na mesma transação que as grava. Os
+gráficos do dashboard leem só esta tabela, nunca o histórico.
+
+reconstruir() refaz um intervalo a partir do histórico: carga inicial
+(migração 13) e troca de TZ_LOCAL. No modo SQLite o trigger é por linha
+e o dia local vem da função dia_local() (db_sqlite.py). Arquivar meses
+do histórico não mexe no resumo; por isso a reimportação de um arquivo
+(particoes.restaurar_arquivo) desliga o trigger na sua transação
+(SET LOCAL toner.resumo_diario = 'off').
+
+    flask --app app tendencias-reconstruir [--desde AAAA-MM-DD]
+"""
+
+import os
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import db
+
+TZ_LOCAL = os.environ.get("TZ_LOCAL", "America/Fortaleza")
+PERIODOS = (7, 30, 365)
+
+# coluna -> acao do histórico (ver MOVIMENTOS em app.py)
+CONTADORES = {
+    "adicoes":      "Adição",
+    "retiradas":    "Retirada",
+    "solicitacoes": "Solicitação",
+    "recebimentos": "Recebimento",
+}
+TINTA = "Nível de Tinta"
+
+
+def _literal(c, valor):
+    return c.mogrify("%s", (valor,)).decode()
+
+def _contagens(c, alias):
+    return ",\n".join(f"count(*) FILTER (WHERE {alias}.acao = {_literal(c, acao)})"
+                      for acao in CONTADORES.values())
+
+def _acoes(c):
+    return ", ".join(_literal(c, a) for a in (*CONTADORES.values(), TINTA))
+
+
+_TABELA = """
+    CREATE TABLE IF NOT EXISTS movimentos_diarios (
+        dia          DATE    NOT NULL,
+        estoque_id   INTEGER NOT NULL,
+        setor        TEXT,
+        adicoes      INTEGER NOT NULL DEFAULT 0,
+        retiradas    INTEGER NOT NULL DEFAULT 0,
+        solicitacoes INTEGER NOT NULL DEFAULT 0,
+        recebimentos INTEGER NOT NULL DEFAULT 0,
+        tinta_pct    INTEGER,
+        PRIMARY KEY (dia, estoque_id)
+    )
+"""
+
+def instalar(c, tz=TZ_LOCAL):
+    """Tabela, índice e trigger. O fuso fica fixo na função do trigger.
+
+    Chamada pela migração 16; mudar o trigger pede uma migração nova."""
+    if db.SQLITE:
+        return _instalar_sqlite(c, tz)
+    c.execute(_TABELA)
+    c.execute("CREATE INDEX IF NOT EXISTS movimentos_diarios_setor_idx ON movimentos_diarios (setor, dia)")
+    somas = ",\n".join(f"{col} = m.{col} + EXCLUDED.{col}" for col in CONTADORES)
+    # O trigger dispara no fim do comando: estoque já tem o setor gravado
+    # pelo mesmo movimento. A tinta sai do detalhe da própria linha, como em
+    # reconstruir(): com o histórico em lote (auditoria.py) a linha chega
+    # depois do movimento e o estoque pode já estar com outra tinta.
+    c.execute(f"""
+        CREATE OR REPLACE FUNCTION movimentos_diarios_somar() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('toner.resumo_diario', true) = 'off' THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO movimentos_diarios AS m
+                (dia, estoque_id, setor, {", ".join(CONTADORES)}, tinta_pct)
+            SELECT (n.criado_em AT TIME ZONE {_literal(c, tz)})::date, n.estoque_id, min(e.setor),
+                   {_contagens(c, "n")},
+                   (array_agg(substring(n.detalhe FROM 'para ([0-9]+)%')::int
+                              ORDER BY n.criado_em DESC, n.id DESC)
+                        FILTER (WHERE n.acao = {_literal(c, TINTA)}))[1]
+            FROM novos n LEFT JOIN estoque e ON e.id = n.estoque_id
+            WHERE n.estoque_id IS NOT NULL AND n.acao IN ({_acoes(c)})
+            GROUP BY 1, 2
+            ON CONFLICT (dia, estoque_id) DO UPDATE SET
+                setor     = coalesce(EXCLUDED.setor, m.setor),
+                {somas},
+                tinta_pct = coalesce(EXCLUDED.tinta_pct, m.tinta_pct);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    c.execute("DROP TRIGGER IF EXISTS historico_resumir ON historico")
+    c.execute("""
+        CREATE TRIGGER historico_resumir AFTER INSERT ON historico
+        REFERENCING NEW TABLE AS novos FOR EACH STATEMENT
+        EXECUTE FUNCTION movimentos_diarios_somar()
+    """)
+
+
+def reconstruir(c, desde=None, ate=None, tz=TZ_LOCAL):
+    """Refaz os dias [desde, ate) (datas locais; None = sem limite) a partir
+    do histórico. Retorna o número de linhas do resumo gravadas.
+
+    Dias anteriores à linha mais antiga do histórico (meses já arquivados
+    por particoes.manter) não são tocados: o resumo guarda mais tempo que
+    o histórico.
+    """
+    if db.SQLITE:
+        return _reconstruir_sqlite(c, desde, ate, tz)
+    # Bloqueia os triggers de movimentos concorrentes até o commit: nenhum
+    # movimento fica fora da releitura nem é somado duas vezes.
+    c.execute("LOCK TABLE movimentos_diarios IN SHARE ROW EXCLUSIVE MODE")
+    c.execute("SELECT (min(criado_em) AT TIME ZONE %s)::date FROM historico", (tz,))
+    primeiro = c.fetchone()[0]
+    if primeiro is None:
+        return 0
+    desde = max(desde, primeiro) if desde else primeiro
+    cond, hist, params = [], [], {"tz": tz, "desde": desde}
+    cond.append("dia >= %(desde)s")
+    hist.append("AND h.criado_em >= %(desde)s::timestamp AT TIME ZONE %(tz)s")
+    if ate:
+        cond.append("dia < %(ate)s");     params["ate"] = ate
+        hist.append("AND h.criado_em < %(ate)s::timestamp AT TIME ZONE %(tz)s")
+    c.execute("DELETE FROM movimentos_diarios WHERE " + " AND ".join(cond), params)
+    # Na carga, a tinta sai do texto do histórico (o estoque só tem a atual).
+    c.execute(f"""
+        INSERT INTO movimentos_diarios
+            (dia, estoque_id, setor, {", ".join(CONTADORES)}, tinta_pct)
+        SELECT dia, estoque_id, min(setor), {", ".join(f"sum({col})" for col in CONTADORES)},
+               (array_agg(tinta ORDER BY criado_em DESC, id DESC) FILTER (WHERE tinta IS NOT NULL))[1]
+        FROM (
+            SELECT (h.criado_em AT TIME ZONE %(tz)s)::date AS dia, h.estoque_id, e.setor,
+                   h.criado_em, h.id,
+                   {", ".join(f"(h.acao = {_literal(c, a)})::int AS {col}" for col, a in CONTADORES.items())},
+                   CASE WHEN h.acao = {_literal(c, TINTA)}
+                        THEN substring(h.detalhe FROM 'para ([0-9]+)%%')::int END AS tinta
+            FROM historico h LEFT JOIN estoque e ON e.id = h.estoque_id
+            WHERE h.estoque_id IS NOT NULL AND h.acao IN ({_acoes(c)}) {" ".join(hist)}
+        ) mov
+        GROUP BY dia, estoque_id
+    """, params)
+    return c.rowcount
+
+
+# ── SQLite ───────────────────────────────────────────────
+def _instalar_sqlite(c, tz):
+    c.execute(_TABELA)
+    c.execute("CREATE INDEX IF NOT EXISTS movimentos_diarios_setor_idx ON movimentos_diarios (setor, dia)")
+    novo = ", ".join(f"NEW.acao = {_literal(c, acao)}" for acao in CONTADORES.values())
+    somas = ",\n".join(f"{col} = {col} + excluded.{col}" for col in CONTADORES)
+    c.execute("DROP TRIGGER IF EXISTS historico_resumir")
+    c.execute(f"""
+        CREATE TRIGGER historico_resumir AFTER INSERT ON historico
+        WHEN NEW.estoque_id IS NOT NULL AND NEW.acao IN ({_acoes(c)})
+             AND current_setting('toner.resumo_diario', 1) IS NOT 'off'
+        BEGIN
+            INSERT INTO movimentos_diarios (dia, estoque_id, setor, {", ".join(CONTADORES)}, tinta_pct)
+            SELECT dia_local(NEW.criado_em, {_literal(c, tz)}), NEW.estoque_id,
+                   (SELECT setor FROM estoque WHERE id = NEW.estoque_id),
+                   {novo},
+                   CASE WHEN NEW.acao = {_literal(c, TINTA)}
+                        THEN CAST(regexp_grupo(NEW.detalhe, 'para ([0-9]+)%') AS INTEGER) END
+            WHERE true
+            ON CONFLICT (dia, estoque_id) DO UPDATE SET
+                setor     = coalesce(excluded.setor, setor),
+                {somas},
+                tinta_pct = coalesce(excluded.tinta_pct, tinta_pct);
+        END
+    """)
+
+
+def _reconstruir_sqlite(c, desde, ate, tz):
+    # Sem LOCK TABLE: o DELETE já pega a trava de escrita do arquivo, que
+    # segura os movimentos concorrentes até o commit.
+    c.execute("SELECT dia_local(min(criado_em), %s) FROM historico", (tz,))
+    primeiro = c.fetchone()[0]
+    if primeiro is None:
+        return 0
+    primeiro = date.fromisoformat(primeiro)
+    desde = max(desde, primeiro) if desde else primeiro
+    fuso = ZoneInfo(tz)
+    cond, hist = ["dia >= %(desde)s"], ["AND h.criado_em >= %(desde_ts)s"]
+    params = {"tz": tz, "desde": desde, "desde_ts": datetime.combine(desde, time(), fuso)}
+    if ate:
+        cond.append("dia < %(ate)s")
+        hist.append("AND h.criado_em < %(ate_ts)s")
+        params.update(ate=ate, ate_ts=datetime.combine(ate, time(), fuso))
+    c.execute("DELETE FROM movimentos_diarios WHERE " + " AND ".join(cond), params)
+    # Última tinta do dia: first_value no lugar do array_agg(... ORDER BY)[1].
+    c.execute(f"""
+        INSERT INTO movimentos_diarios
+            (dia, estoque_id, setor, {", ".join(CONTADORES)}, tinta_pct)
+        SELECT dia, estoque_id, min(setor), {", ".join(f"sum({col})" for col in CONTADORES)},
+               max(ultima_tinta)
+        FROM (
+            SELECT *, first_value(tinta) OVER (
+                       PARTITION BY dia, estoque_id
+                       ORDER BY tinta IS NULL, criado_em DESC, id DESC) AS ultima_tinta
+            FROM (
+                SELECT dia_local(h.criado_em, %(tz)s) AS dia, h.estoque_id, e.setor,
+                       h.criado_em, h.id,
+                       {", ".join(f"h.acao = {_literal(c, a)} AS {col}" for col, a in CONTADORES.items())},
+                       CASE WHEN h.acao = {_literal(c, TINTA)}
+                            THEN CAST(regexp_grupo(h.detalhe, 'para ([0-9]+)%%') AS INTEGER) END AS tinta
+                FROM historico h LEFT JOIN estoque e ON e.id = h.estoque_id
+                WHERE h.estoque_id IS NOT NULL AND h.acao IN ({_acoes(c)}) {" ".join(hist)}
+            )
+        )
+        GROUP BY dia, estoque_id
+    """, params)
+    return c.rowcount
+
+
+# ── Consultas dos gráficos ───────────────────────────────
+def serie(conn, dias, hoje, setor=None):
+    """Totais por período dos últimos `dias` dias até `hoje`, sem lacunas.
+
+    Até 30 dias, um ponto por dia; acima disso, por semana. Cada ponto:
+    {"inicio": date, "entradas", "retiradas", "solicitacoes"}.
+    """
+    passo = 1 if dias <= 30 else 7
+    inicio = hoje - timedelta(days=dias - 1)
+    pontos = [{"inicio": inicio + timedelta(days=i), "entradas": 0, "retiradas": 0,
+               "solicitacoes": 0} for i in range(0, dias, passo)]
+    sql = """
+        SELECT dia, sum(adicoes + recebimentos), sum(retiradas), sum(solicitacoes)
+        FROM movimentos_diarios WHERE dia BETWEEN %s AND %s
+    """
+    params = [inicio, hoje]
+    if setor:
+        sql += " AND setor = %s"
+        params.append(setor)
+    c = conn.cursor()
+    c.execute(sql + " GROUP BY dia", params)
+    for dia, entradas, retiradas, solicitacoes in c.fetchall():
+        p = pontos[(dia - inicio).days // passo]
+        p["entradas"]     += entradas
+        p["retiradas"]    += retiradas
+        p["solicitacoes"] += solicitacoes
+    return pontos
+
+
+def por_setor(conn, dias, hoje, limite=8):
+    """Setores com mais retiradas nos últimos `dias` dias."""
+    c = conn.cursor()
+    c.execute("""
+        SELECT setor, sum(retiradas) AS retiradas, sum(adicoes + recebimentos) AS entradas,
+               sum(solicitacoes) AS solicitacoes
+        FROM movimentos_diarios
+        WHERE dia BETWEEN %s AND %s AND setor IS NOT NULL
+        GROUP BY setor
+        HAVING sum(retiradas) > 0
+        ORDER BY retiradas DESC, setor
+        LIMIT %s
+    """, (hoje - timedelta(days=dias - 1), hoje, limite))
+    return [dict(zip(("setor", "retiradas", "entradas", "solicitacoes"), r)) for r in c.fetchall()]
@@ -0,0 +1,109 @@
+"""
+Fixtures comuns: o app importado sobre um banco novo, em cada backend.
+
+O backend é escolhido na importação (db.py lê DATABASE_URL), então o
+fixture `toner` reimporta os módulos do app para cada um. SQLite roda
+num arquivo temporário. PostgreSQL roda no servidor de TESTE_DATABASE_URL
+ou, sem ela, num servidor descartável do pgserver (como bench/rotas.py
+--pg-local); o banco toner_teste é apagado e recriado. Sem nenhum dos
+dois, os testes do PostgreSQL são pulados e aparecem como tal no relatório.
+
+    TESTE_DATABASE_URL=postgresql://postgres@/postgres?host=/tmp python -m pytest
+"""
+
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+BANCO_PG = "toner_teste"
+JSON     = {"Accept": "application/json"}
+
+
+def _url_banco(url, banco):
+    return urlunsplit(urlsplit(url)._replace(path="/" + banco))
+
+
+def _recriar_banco_pg(url):
+    import psycopg2
+    conn = psycopg2.connect(_url_banco(url, "postgres"))
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute(f"DROP DATABASE IF EXISTS {BANCO_PG} WITH (FORCE)")
+    c.execute(f"CREATE DATABASE {BANCO_PG}")
+    conn.close()
+    return _url_banco(url, BANCO_PG)
+
+
+def _esquecer_app():
+    """Tira de sys.modules os módulos do app (o próximo import recomeça)."""
+    for nome, mod in list(sys.modules.items()):
+        arquivo = getattr(mod, "__file__", None) or ""
+        if os.path.dirname(os.path.abspath(arquivo)) == RAIZ:
+            del sys.modules[nome]
+
+
+def _servidor_pg():
+    url = os.environ.get("TESTE_DATABASE_URL")
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        pytest.skip("PostgreSQL: defina TESTE_DATABASE_URL ou instale pgserver")
+    # Caminho curto: o socket do PostgreSQL não aceita caminhos longos.
+    pasta = tempfile.mkdtemp(prefix="toner-pg-")
+    return pgserver.get_server(pasta, cleanup_mode="delete").get_uri("postgres")
+
+
+@pytest.fixture(scope="session", params=["sqlite", "postgres"])
+def toner(request, tmp_path_factory):
+    """Módulo app, com o esquema migrado e os dados iniciais."""
+    if request.param == "sqlite":
+        url = "sqlite:///" + str(tmp_path_factory.mktemp("sqlite") / "toner.db")
+    else:
+        url = _recriar_banco_pg(_servidor_pg())
+    mp = pytest.MonkeyPatch()
+    mp.setenv("DATABASE_URL", url)
+    mp.setenv("DB_LENTA_MS", "60000")
+    mp.setenv("HISTORICO_GRAVACAO", "sincrona")
+    _esquecer_app()
+    import app
+    yield app
+    _esquecer_app()
+    mp.undo()
+
+
+def consultar(toner, sql, params=()):
+    with toner.get_db() as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        return c.fetchall()
+
+
+def sessao(toner, username):
+    """Test client já logado como `username`."""
+    (uid,), = consultar(toner, "SELECT id FROM usuarios WHERE username=%s", (username,))
+    cl = toner.app.test_client()
+    with cl.session_transaction() as s:
+        s["_user_id"] = str(uid)
+        s["_fresh"] = True
+    return cl
+
+
+@pytest.fixture
+def admin(toner):
+    return sessao(toner, "admin")
+
+
+@pytest.fixture
+def item(toner):
+    """Um item com 5 unidades, sem pedido e sem observação."""
+    row, = consultar(toner, "UPDATE estoque SET quantidade=5, aguardando=0, observacao='' "
+                            "WHERE id=(SELECT min(id) FROM estoque) RETURNING id, setor, versao")
+    return dict(zip(("id", "setor", "versao"), row))
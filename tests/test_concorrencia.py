@@ -0,0 +1,107 @@
+import threading
+
+from conftest import JSON, consultar, sessao
+
+
+def _estoque(toner, estoque_id):
+    return consultar(toner, "SELECT quantidade, observacao, tinta_pct, versao FROM estoque "
+                            "WHERE id=%s", (estoque_id,))[0]
+
+
+def _historico(toner, estoque_id, acao):
+    return consultar(toner, "SELECT usuario, detalhe FROM historico WHERE estoque_id=%s "
+                            "AND acao=%s ORDER BY id", (estoque_id, acao))
+
+
+def test_duas_sessoes_com_a_mesma_versao(toner, item):
+    admin, ti = sessao(toner, "admin"), sessao(toner, "ti")
+    lida = item["versao"]            # as duas abriram o modal com esta versão
+    obs_antes = len(_historico(toner, item["id"], "Observação"))
+
+    r1 = admin.post(f"/observacao/{item['id']}", headers=JSON,
+                    data={"observacao": "trocado", "versao": lida})
+    r2 = ti.post(f"/observacao/{item['id']}", headers=JSON,
+                 data={"observacao": "sem toner", "versao": lida})
+
+    assert r1.status_code == 200 and r1.json["item"]["versao"] == lida + 1
+    assert r2.status_code == 409 and r2.json["conflito"] is True
+    assert r2.json["item"]["observacao"] == "trocado"      # a atual, para conferir
+    assert r2.json["item"]["versao"] == lida + 1
+    assert _estoque(toner, item["id"])[1::2] == ("trocado", lida + 1)
+    assert _historico(toner, item["id"], "Observação")[obs_antes:] == [
+        ("Administrador", f"Obs atualizada — {item['setor']}: \"trocado\"")]
+
+    # Com a versão nova, a segunda sessão salva.
+    r3 = ti.post(f"/observacao/{item['id']}", headers=JSON,
+                 data={"observacao": "sem toner", "versao": r2.json["item"]["versao"]})
+    assert r3.status_code == 200
+    assert _estoque(toner, item["id"])[1::2] == ("sem toner", lida + 2)
+
+
+def test_salvamentos_simultaneos(toner, item):
+    clientes = [sessao(toner, "admin"), sessao(toner, "ti")] * 4
+    largada = threading.Barrier(len(clientes))
+    status = [None] * len(clientes)
+    obs_antes = len(_historico(toner, item["id"], "Observação"))
+
+    def salvar(i, cliente):
+        largada.wait()
+        status[i] = cliente.post(f"/observacao/{item['id']}", headers=JSON,
+                                 data={"observacao": f"obs {i}", "versao": item["versao"]}).status_code
+    threads = [threading.Thread(target=salvar, args=a) for a in enumerate(clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(status) == [200] + [409] * (len(clientes) - 1)
+    vencedor = status.index(200)
+    assert _estoque(toner, item["id"])[1::2] == (f"obs {vencedor}", item["versao"] + 1)
+    assert [d for _, d in _historico(toner, item["id"], "Observação")[obs_antes:]] == [
+        f"Obs atualizada — {item['setor']}: \"obs {vencedor}\""]
+
+
+def test_deltas_nao_conferem_versao(toner, item):
+    admin, ti = sessao(toner, "admin"), sessao(toner, "ti")
+    lida = item["versao"]
+
+    assert admin.post(f"/tinta/{item['id']}", headers=JSON,
+                      data={"tinta_pct": "60", "versao": lida}).status_code == 200
+    assert ti.post(f"/tinta/{item['id']}", headers=JSON,
+                   data={"tinta_pct": "20", "versao": lida}).status_code == 409
+    # +1/-1 comutam: com a versão velha, aplicam do mesmo jeito e nenhum clique se perde.
+    assert ti.get(f"/mais/{item['id']}?versao={lida}", headers=JSON).status_code == 200
+    assert admin.get(f"/menos/{item['id']}?versao={lida}", headers=JSON).status_code == 200
+    assert ti.get(f"/mais/{item['id']}?versao={lida}", headers=JSON).status_code == 200
+
+    quantidade, _, tinta, versao = _estoque(toner, item["id"])
+    assert (quantidade, tinta, versao) == (6, 60, lida + 4)
+    assert _historico(toner, item["id"], "Nível de Tinta")[-1] == (
+        "Administrador", f"Tinta atualizada para 60% — {item['setor']}")
+
+
+def test_api_conflito_no_lote(toner, item):
+    saida = toner.app.test_cli_runner().invoke(args=["api-token-criar", "ti"]).output
+    api = toner.app.test_client()
+    cabecalho = {"Authorization": "Bearer " + saida.strip().splitlines()[-1]}
+    lida = item["versao"]
+    sessao(toner, "admin").post(f"/tinta/{item['id']}", headers=JSON,
+                                data={"tinta_pct": "80", "versao": lida})
+
+    r = api.post("/api/v1/movimentos", headers=cabecalho, json=[
+        {"id": item["id"], "tipo": "tinta", "valor": 10, "versao": lida},
+        {"id": item["id"], "tipo": "mais", "versao": lida}])
+
+    assert r.status_code == 200
+    conflito, mais = r.json["resultados"]
+    assert conflito["ok"] is False and conflito["conflito"] is True
+    assert conflito["atual"]["tinta_pct"] == 80
+    assert mais["ok"] is True
+    assert _estoque(toner, item["id"])[::2] == (6, 80)
+
+
+def test_passo_da_versao_pode_rodar_de_novo(toner, item):
+    _, passo = toner.migracoes._passos()[14]
+    with toner.get_db() as conn:
+        passo(conn.cursor())
+    assert _estoque(toner, item["id"])[3] == item["versao"]
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import db_sqlite
+from db_sqlite import traduzir
+
+
+@pytest.mark.parametrize("psycopg2, sqlite", [
+    ("SELECT * FROM estoque WHERE id=%s", "SELECT * FROM estoque WHERE id=?"),
+    ("UPDATE estoque SET tinta_pct=%(valor)s WHERE id=%(id)s",
+     "UPDATE estoque SET tinta_pct=:valor WHERE id=:id"),
+    ("SELECT %s, %(a)s, %s", "SELECT ?, :a, ?"),
+    ("WHERE setor LIKE %s ESCAPE '\\' AND detalhe LIKE '%%para%%'",
+     "WHERE setor LIKE ? ESCAPE '\\' AND detalhe LIKE '%para%'"),
+    ("SELECT regexp_grupo(detalhe, 'para ([0-9]+)%%') FROM historico WHERE id=%s",
+     "SELECT regexp_grupo(detalhe, 'para ([0-9]+)%') FROM historico WHERE id=?"),
+])
+def test_traduzir(psycopg2, sqlite):
+    assert traduzir(psycopg2) == sqlite
+
+
+# ── Conexão: SET LOCAL e NOTIFY no commit ────────────────
+@pytest.fixture
+def conexoes(tmp_path):
+    notificadas = []
+    pool = db_sqlite.ConexoesPorThread(str(tmp_path / "t.db"),
+                                       ao_confirmar=lambda c, p: notificadas.append((c, p)))
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+        c.execute("""CREATE TRIGGER t_notificar AFTER INSERT ON t
+                     BEGIN SELECT notificar('t_alterada', NEW.id); END""")
+        c.execute("""CREATE TRIGGER t_linha AFTER UPDATE ON t
+                     BEGIN SELECT notificar_linha('t_linhas', json_object('id', NEW.id, 'v', NEW.v)); END""")
+    notificadas.clear()
+    pool.notificadas = notificadas
+    yield pool
+    pool.closeall()
+
+
+def test_set_local_vale_ate_o_fim_da_transacao(conexoes):
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("SET LOCAL toner.resumo_diario = 'off'")
+        c.execute("SELECT current_setting('toner.resumo_diario', 1)")
+        assert c.fetchone()[0] == "off"
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT current_setting('toner.resumo_diario', 1)")
+        assert c.fetchone()[0] is None
+
+    with pytest.raises(RuntimeError):
+        with conexoes.connection() as conn:
+            conn.cursor().execute("SET LOCAL toner.resumo_diario = 'off'")
+            raise RuntimeError
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT current_setting('toner.resumo_diario', 1)")
+        assert c.fetchone()[0] is None
+
+
+def test_notificacao_so_no_commit(conexoes):
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO t (id, v) VALUES (1, 'a')")
+        c.execute("INSERT INTO t (id, v) VALUES (2, 'b')")
+        assert conexoes.notificadas == []          # nada antes do commit
+    assert conexoes.notificadas == [("t_alterada", "1"), ("t_alterada", "2")]
+
+
+def test_notificacao_descartada_no_rollback(conexoes):
+    with pytest.raises(RuntimeError):
+        with conexoes.connection() as conn:
+            conn.cursor().execute("INSERT INTO t (id, v) VALUES (3, 'c')")
+            raise RuntimeError
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT count(*) FROM t")
+        assert c.fetchone()[0] == 0
+    assert conexoes.notificadas == []
+
+
+def test_notificacoes_iguais_uma_vez_e_linhas_num_payload(conexoes):
+    with conexoes.connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO t (id, v) VALUES (1, 'a')")
+        c.execute("DELETE FROM t")
+        c.execute("INSERT INTO t (id, v) VALUES (1, 'a')")
+    assert conexoes.notificadas == [("t_alterada", "1")]
+
+    conexoes.notificadas.clear()
+    with conexoes.connection() as conn:
+        conn.cursor().execute("INSERT INTO t (id, v) VALUES (2, 'b')")
+        conn.cursor().execute("UPDATE t SET v = v || '!'")
+    assert conexoes.notificadas[0] == ("t_alterada", "2")
+    canal, payload = conexoes.notificadas[1]
+    assert canal == "t_linhas"
+    assert sorted(json.loads(payload)["itens"], key=lambda i: i["id"]) == [
+        {"id": 1, "v": "a!"}, {"id": 2, "v": "b!"}]
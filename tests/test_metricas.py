@@ -0,0 +1,81 @@
+import json
+
+import metricas
+
+ROTA = (("rota", "index"),)
+
+
+def _gravar_estado(diretorio, pid, clientes, requisicoes):
+    h = [0] * (len(metricas.BUCKETS_HTTP) + 2)
+    h[0], h[-1] = requisicoes, 0.001 * requisicoes
+    (diretorio / f"{pid}.json").write_text(json.dumps({
+        "valores": [["toner_sse_clientes", [], clientes],
+                    ["toner_http_requisicoes_total", [list(p) for p in ROTA], requisicoes]],
+        "hist":    [["toner_http_duracao_segundos", [list(p) for p in ROTA], h]],
+    }))
+
+
+def test_worker_que_saiu_soma_contadores_e_nao_gauges(tmp_path):
+    _gravar_estado(tmp_path, 101, clientes=7, requisicoes=5)
+    metricas.marcar_saida(101, str(tmp_path))                           # child_exit
+    _gravar_estado(tmp_path, 102, clientes=3, requisicoes=2)            # outro worker, vivo
+    registro = metricas.Registro(diretorio=str(tmp_path))
+    registro.definir("toner_sse_clientes", 1)
+    registro.contar("toner_http_requisicoes_total", rota="index")
+    registro.observar("toner_http_duracao_segundos", 0.001, rota="index")
+
+    valores, hist = registro.coletar()
+
+    assert valores[("toner_sse_clientes", ())] == 1 + 3
+    assert valores[("toner_http_requisicoes_total", ROTA)] == 1 + 5 + 2
+    assert hist[("toner_http_duracao_segundos", ROTA)][0] == 1 + 5 + 2
+
+
+def test_exposicao_sem_gauges_de_worker_que_saiu(tmp_path):
+    _gravar_estado(tmp_path, 101, clientes=7, requisicoes=5)
+    metricas.marcar_saida(101, str(tmp_path))
+    registro = metricas.Registro(diretorio=str(tmp_path))
+
+    texto = metricas.exposicao(*registro.coletar())
+
+    assert "toner_sse_clientes" not in texto
+    assert 'toner_http_requisicoes_total{rota="index"} 5' in texto
+
+
+def test_pid_reaproveitado_nao_herda_o_worker_que_saiu(tmp_path):
+    _gravar_estado(tmp_path, 101, clientes=7, requisicoes=5)
+    metricas.marcar_saida(101, str(tmp_path))
+    _gravar_estado(tmp_path, 101, clientes=2, requisicoes=1)            # worker novo, mesmo pid
+    metricas.marcar_saida(101, str(tmp_path))
+    _gravar_estado(tmp_path, 101, clientes=4, requisicoes=3)
+    metricas.marcar_saida(999, str(tmp_path))                           # nunca gravou: nada a fazer
+
+    valores, _ = metricas.Registro(diretorio=str(tmp_path)).coletar()
+
+    assert valores[("toner_sse_clientes", ())] == 4
+    assert valores[("toner_http_requisicoes_total", ROTA)] == 5 + 1 + 3
+
+
+def test_encerrar_grava_e_marca_o_proprio_arquivo(tmp_path):
+    registro = metricas.Registro(diretorio=str(tmp_path))
+    registro.definir("toner_sse_clientes", 3)
+    registro.contar("toner_http_requisicoes_total", rota="index")
+
+    registro.encerrar()
+
+    arquivo, = tmp_path.glob("*.json")
+    assert arquivo.name.startswith(metricas.SAIU)
+    valores, _ = metricas.Registro(diretorio=str(tmp_path)).coletar()
+    assert ("toner_sse_clientes", ()) not in valores
+    assert valores[("toner_http_requisicoes_total", ROTA)] == 1
+
+
+def test_cada_execucao_num_diretorio_novo(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICAS_DIR", str(tmp_path))
+    primeira = metricas.nova_execucao()
+    monkeypatch.setenv("METRICAS_DIR", str(tmp_path))      # restart do master
+    segunda = metricas.nova_execucao()
+
+    assert primeira != segunda
+    assert {primeira, segunda} <= {str(p) for p in tmp_path.iterdir()}
+    assert metricas.Registro().diretorio == segunda
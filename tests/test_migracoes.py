@@ -0,0 +1,44 @@
+import logging
+
+import pytest
+
+
+@pytest.fixture
+def legado(toner):
+    """Cursor num schema à parte com o historico de antes do passo 3."""
+    if toner.SQLITE:
+        pytest.skip("o passo 3 só existe no PostgreSQL")
+    with toner.get_db() as conn:
+        c = conn.cursor()
+        c.execute("CREATE SCHEMA legado")
+        c.execute("SET LOCAL search_path = legado")
+        c.execute("""
+            CREATE TABLE historico (id SERIAL PRIMARY KEY, estoque_id INTEGER, usuario TEXT,
+                                    acao TEXT, detalhe TEXT, criado_em TEXT)
+        """)
+        yield c
+        conn.rollback()
+
+
+def test_criado_em_ilegivel_fica_guardado_e_fora_da_retencao(toner, legado, monkeypatch, caplog):
+    monkeypatch.setenv("HISTORICO_TZ_LEGADO", "America/Sao_Paulo")
+    legado.executemany("INSERT INTO historico (criado_em) VALUES (%s)",
+                       [("05/03/2024 14:30",), ("31/02/2024 10:00",), ("ontem",), (None,)])
+    _, passo = toner.migracoes._passos()[3]
+
+    with caplog.at_level(logging.WARNING, logger="migracoes"):
+        passo(legado)
+
+    legado.execute("SELECT id, to_char(criado_em AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI') "
+                   "FROM historico ORDER BY id")
+    assert legado.fetchall() == [(1, "2024-03-05 17:30"), (2, "1970-01-01 00:00"),
+                                 (3, "1970-01-01 00:00"), (4, "1970-01-01 00:00")]
+    legado.execute("SELECT id, criado_em FROM historico_data_invalida ORDER BY id")
+    assert legado.fetchall() == [(2, "31/02/2024 10:00"), (3, "ontem"), (4, None)]
+    assert "3 linha(s) do histórico com criado_em ilegível" in caplog.text
+
+    # Passo 4: o instante 0 vai para a partição padrão, que a retenção não toca.
+    toner.particoes.converter_para_particionado(legado)
+    legado.execute("SELECT tableoid::regclass::text, count(*) FROM historico GROUP BY 1 ORDER BY 1")
+    assert legado.fetchall() == [("historico_2024_03", 1), ("historico_padrao", 3)]
+    assert "historico_padrao" not in {nome for _, nome in toner.particoes.expiradas(legado)}
@@ -0,0 +1,199 @@
+import io
+import json
+import time
+
+import pytest
+
+from conftest import JSON, consultar
+
+PAGINAS = [
+    "/",
+    "/?q=ti&status=ok&ordem=quantidade&desc=1",
+    "/?tipo=colorida&tinta_min=10&tinta_max=90&ordem=tinta",
+    "/?pagina=2",
+    "/historico",
+    "/historico?acao=Retirada",
+    "/historico?setor=TI",
+    "/dashboard",
+    "/dashboard?periodo=365",
+    "/usuarios",
+    "/estoque/importar",
+    "/metrics",
+    "/admin/pool",
+    "/admin/caches",
+]
+
+
+def _esperar(condicao, segundos=5):
+    limite = time.monotonic() + segundos
+    while not condicao():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def _ultimo_historico(toner, estoque_id):
+    return consultar(toner, "SELECT acao, detalhe FROM historico WHERE estoque_id=%s "
+                            "ORDER BY id DESC LIMIT 1", (estoque_id,))[0]
+
+
+def _resumo(toner, estoque_id):
+    return consultar(toner, "SELECT coalesce(sum(adicoes), 0), coalesce(sum(retiradas), 0) "
+                            "FROM movimentos_diarios WHERE estoque_id=%s", (estoque_id,))[0]
+
+
+@pytest.mark.parametrize("caminho", PAGINAS)
+def test_paginas(admin, caminho):
+    assert admin.get(caminho).status_code == 200
+
+
+def test_sem_login_vai_para_o_login(toner):
+    r = toner.app.test_client().get("/")
+    assert r.status_code == 302 and "/login" in r.headers["Location"]
+
+
+def test_preload_das_fontes_fora_do_login(toner, admin):
+    assert 'rel="preload"' in admin.get("/").get_data(as_text=True)
+    assert 'rel="preload"' not in toner.app.test_client().get("/login").get_data(as_text=True)
+
+
+def test_etag_da_pagina(admin):
+    etag = admin.get("/").headers["ETag"]
+    assert admin.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.parametrize("busca", ["%", "_", "100%_x", "\\"])
+def test_busca_trata_curingas_como_texto(admin, busca):
+    # %% e ESCAPE passam por traduzir() no SQLite; nenhum item tem esses caracteres.
+    r = admin.get("/", query_string={"q": busca})
+    assert r.status_code == 200
+    assert "Nenhum item para estes filtros" in r.get_data(as_text=True)
+
+
+def test_mais_grava_historico_resumo_e_versao(toner, admin, item):
+    versao = toner.versao_estoque
+    with toner.get_db() as conn:
+        antes = versao(conn)
+    adicoes, _ = _resumo(toner, item["id"])
+
+    r = admin.get(f"/mais/{item['id']}", headers=JSON)
+
+    assert r.status_code == 200
+    assert r.json["item"]["quantidade"] == 6
+    assert r.json["item"]["versao"] == item["versao"] + 1
+    assert _ultimo_historico(toner, item["id"]) == ("Adição", f"+1 unidade — {item['setor']}")
+    assert _resumo(toner, item["id"])[0] == adicoes + 1       # trigger (dia_local no SQLite)
+    with toner.get_db() as conn:
+        assert versao(conn) > antes
+
+
+def test_retirada_sem_estoque_nao_grava_nada(toner, admin, item):
+    consultar(toner, "UPDATE estoque SET quantidade=0 WHERE id=%s RETURNING id", (item["id"],))
+    n, = consultar(toner, "SELECT count(*) FROM historico WHERE estoque_id=%s", (item["id"],))[0]
+    _, retiradas = _resumo(toner, item["id"])
+
+    r = admin.get(f"/menos/{item['id']}", headers=JSON)
+
+    assert r.status_code == 409 and r.json["ok"] is False
+    assert consultar(toner, "SELECT count(*) FROM historico WHERE estoque_id=%s",
+                     (item["id"],))[0][0] == n
+    assert _resumo(toner, item["id"])[1] == retiradas
+
+
+def test_tinta_vai_para_o_resumo(toner, admin, item):
+    r = admin.post(f"/tinta/{item['id']}", data={"tinta_pct": "37"}, headers=JSON)
+
+    assert r.status_code == 200 and r.json["item"]["tinta_pct"] == 37
+    assert _ultimo_historico(toner, item["id"]) == (
+        "Nível de Tinta", f"Tinta atualizada para 37% — {item['setor']}")
+    # A tinta do resumo sai do detalhe (regexp_grupo no SQLite).
+    assert consultar(toner, "SELECT tinta_pct FROM movimentos_diarios WHERE estoque_id=%s "
+                            "ORDER BY dia DESC LIMIT 1", (item["id"],))[0][0] == 37
+
+
+def test_observacao_com_porcentagem_e_aspas(toner, admin, item):
+    obs = "troca 50% — \"urgente\" 'já'"
+    r = admin.post(f"/observacao/{item['id']}", data={"observacao": obs}, headers=JSON)
+
+    assert r.status_code == 200 and r.json["item"]["observacao"] == obs
+    assert _ultimo_historico(toner, item["id"])[1] == f"Obs atualizada — {item['setor']}: \"{obs}\""
+
+
+def test_movimento_notifica_estoque_alterado(toner, admin, item):
+    # NOTIFY no PostgreSQL; no SQLite, notificar() chamada pelo trigger.
+    recebidos = []
+    toner.ouvinte.inscrever("estoque_alterado", recebidos.append)
+    toner.ouvinte.garantir()
+    admin.get("/")      # o ouvinte do PostgreSQL já escutando o canal
+    time.sleep(0.2)
+
+    admin.get(f"/mais/{item['id']}", headers=JSON)
+
+    def chegou():
+        return any(i["id"] == item["id"] for p in recebidos for i in json.loads(p).get("itens", []))
+    assert _esperar(chegou)
+
+
+def test_csv_exporta_e_reimporta_sem_alteracao(toner, admin):
+    csv = admin.get("/estoque/exportar.csv").data
+    itens, = consultar(toner, "SELECT count(*) FROM estoque")[0]
+
+    r = admin.post("/estoque/importar", data={"arquivo": (io.BytesIO(csv), "estoque.csv")},
+                   content_type="multipart/form-data")
+
+    assert r.status_code == 200
+    texto = " ".join(r.get_data(as_text=True).split())
+    assert f"{itens} linhas — 0 novos, 0 atualizados, {itens} sem alteração" in texto
+
+
+# ── API ──────────────────────────────────────────────────
+@pytest.fixture
+def api(toner):
+    saida = toner.app.test_cli_runner().invoke(args=["api-token-criar", "admin", "--nome", "teste"]).output
+    cabecalho = {"Authorization": "Bearer " + saida.strip().splitlines()[-1]}
+    cl = toner.app.test_client()
+
+    class Api:
+        def get(self, caminho, **kw):
+            return cl.get("/api/v1" + caminho, headers=cabecalho, **kw)
+
+        def post(self, caminho, **kw):
+            return cl.post("/api/v1" + caminho, headers=cabecalho, **kw)
+    return Api()
+
+
+def test_api_sem_token(toner):
+    assert toner.app.test_client().get("/api/v1/estoque").status_code == 401
+
+
+def test_api_estoque_e_historico(toner, api, item):
+    r = api.get("/estoque")
+    assert r.status_code == 200
+    assert item["id"] in {i["id"] for i in r.json["itens"]}
+    assert api.get(f"/estoque/{item['id']}").json["quantidade"] == 5
+    assert api.get("/estoque/999999").status_code == 404
+    r = api.get("/historico", query_string={"limite": 2})
+    assert r.status_code == 200 and len(r.json["registros"]) <= 2
+
+
+def test_api_lote_atomico_desfaz_tudo(toner, api, item):
+    vazio, = consultar(toner, "UPDATE estoque SET quantidade=0 WHERE id=(SELECT max(id) FROM estoque) "
+                              "RETURNING id")[0]
+
+    r = api.post("/movimentos", json={"atomico": True, "movimentos": [
+        {"id": item["id"], "tipo": "mais"}, {"id": vazio, "tipo": "menos"}]})
+
+    assert r.status_code == 409
+    assert consultar(toner, "SELECT quantidade FROM estoque WHERE id=%s", (item["id"],))[0][0] == 5
+
+
+def test_api_lote_parcial(toner, api, item):
+    r = api.post("/movimentos", json=[{"id": item["id"], "tipo": "mais"},
+                                      {"id": item["id"], "tipo": "tinta", "valor": 40},
+                                      {"id": item["id"], "tipo": "voar"}])
+
+    assert r.status_code == 200
+    assert (r.json["aplicados"], r.json["falhas"]) == (2, 1)
+    assert consultar(toner, "SELECT quantidade, tinta_pct FROM estoque WHERE id=%s",
+                     (item["id"],))[0] == (6, 40)